@@ -4,233 +4,129 @@ import sys
 import time
 import json
 import os.path
-import hashlib
 import logging
 import threading
 from decimal import Decimal
-from flask_socketio import SocketIO
-from flask import Flask, render_template, url_for, request
 
 from binance_api import rest_master
 from binance_api import socket_master
 
 from . import trader
-
-MULTI_DEPTH_INDICATORS = ['ema', 'sma', 'rma', 'order']
-
-# Initilize globals.
-
-## Setup flask app/socket
-APP = Flask(__name__)
-SOCKET_IO = SocketIO(APP)
+from . import order_book
+from . import rule_engine
+from . import strategy_registry
+from . import candle_store
+from . import indicator_service
+from . import market_stream
+from . import market_snapshot
+from . import data_hub
+from . import recorder
+from . import user_data
+from . import fee_manager
+from . import wallet_service
+from . import capital_allocator
+from . import trigger_engine
+from . import tick_stream
+from . import order_api
+
+## Interval between each capital allocation pass.
+ALLOCATION_INTERVAL = 0.1
+
+## Interval between checks for changed strategy files.
+STRATEGY_RELOAD_INTERVAL = 5
+
+## Time after the last chart request that the indicators computed only for the chart are kept.
+CHART_SUBSCRIPTION_SECONDS = 60
+
+## Time without data after which a market stream is resubscribed.
+STALE_STREAM_SECONDS = 60
+
+## Interval between checks of the core state when running headless.
+HEADLESS_CHECK_INTERVAL = 1
 
 ## Initilize base core object.
 core_object = None
 
-started_updater = False
-
-## Initilize IP/port pair globals.
-host_ip = ''
-host_port = ''
-
 ## Set traders cache file name.
 CAHCE_FILES = 'traders.json'
 
-
-@APP.context_processor
-def override_url_for():
-    return (dict(url_for=dated_url_for))
-
-
-def dated_url_for(endpoint, **values):
-    # Override to prevent cached assets being used.
-    if endpoint == 'static':
-        filename = values.get('filename', None)
-        if filename:
-            file_path = os.path.join(APP.root_path,
-                                     endpoint,
-                                     filename)
-            values['q'] = int(os.stat(file_path).st_mtime)
-    return url_for(endpoint, **values)
-
-
-@APP.route('/', methods=['GET'])
-def control_panel():
-    # Base control panel configuration.
-    global started_updater
-
-    ## Web updater used for live updating.
-    if not (started_updater):
-        started_updater = True
-        web_updater_thread = threading.Thread(target=web_updater)
-        web_updater_thread.start()
-
-    ## Set socket ip/port.
-    start_up_data = {
-        'host': {'IP': host_ip, 'Port': host_port},
-        'market_symbols': core_object.trading_markets
-    }
-
-    return (render_template('main_page.html', data=start_up_data))
-
-
-@APP.route('/rest-api/v1/trader_update', methods=['POST'])
-def update_trader():
-    # Base API for managing trader interaction.
-    data = request.get_json()
-
-    ## Check if specified bot exists.
-    current_trader = api_error_check(data)
-
-    if current_trader == None:
-        ## No trader therefore return false.
-        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
-    elif data['action'] == 'start':
-        ## Updating trader status to running.
-        if current_trader.state_data['runtime_state'] == 'FORCE_PAUSE':
-            current_trader.state_data['runtime_state'] = 'RUN'
-    elif data['action'] == 'pause':
-        ## Updating trader status to paused.
-        if current_trader.state_data['runtime_state'] == 'RUN':
-            current_trader.state_data['runtime_state'] = 'FORCE_PAUSE'
-    else:
-        ## If action was not found return false
-        return (json.dumps({'call': False, 'message': 'INVALID_ACTION'}))
-
-    return (json.dumps({'call': True}))
-
-
-@APP.route('/rest-api/v1/get_trader_charting', methods=['GET'])
-def get_trader_charting():
-    # Endpoint to pass trader indicator data.
-    market = request.args.get('market')
-    limit = int(request.args.get('limit'))
-    data = {'market': market}
-
-    ## Check if specified bot exists.
-    current_trader = api_error_check(data)
-
-    if current_trader == None:
-        ## No trader therefore return false.
-        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
-
-    candle_data = core_object.get_trader_candles(current_trader.print_pair)[:limit]
-    indicator_data = core_object.get_trader_indicators(current_trader.print_pair)
-    short_indicator_data = shorten_indicators(indicator_data, candle_data[-1][0])
-
-    return (json.dumps(
-        {'call': True, 'data': {'market': market, 'indicators': short_indicator_data, 'candles': candle_data}}))
+## Set indicator state cache file name (restored on start so indicators only roll forward over newer candles).
+INDICATOR_CACHE_FILE = 'indicator_state.json'
 
 
-@APP.route('/rest-api/v1/get_trader_indicators', methods=['GET'])
-def get_trader_indicators():
-    # Endpoint to pass trader indicator data.
-    market = request.args.get('market')
-    limit = int(request.args.get('limit'))
-    data = {'market': market}
-
-    ## Check if specified bot exists.
-    current_trader = api_error_check(data)
-
-    if current_trader == None:
-        ## No trader therefore return false.
-        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
-
-    indicator_data = core_object.get_trader_indicators(current_trader.print_pair)
-
-    return (json.dumps({'call': True, 'data': {'market': market, 'indicators': indicator_data}}))
-
-
-@APP.route('/rest-api/v1/get_trader_candles', methods=['GET'])
-def get_trader_candles():
-    # Endpoint to pass trader candles.
-    market = request.args.get('market')
-    limit = int(request.args.get('limit'))
-    data = {'market': market}
-
-    ## Check if specified bot exists.
-    current_trader = api_error_check(data)
-
-    if current_trader == None:
-        ## No trader therefore return false.
-        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
-
-    candle_data = core_object.get_trader_candles(current_trader.print_pair)[:limit]
-
-    return (json.dumps({'call': True, 'data': {'market': market, 'candles': candle_data}}))
-
-
-@APP.route('/rest-api/v1/test', methods=['GET'])
-def test_rest_call():
-    # API endpoint test
-    return (json.dumps({'call': True, 'message': 'HELLO WORLD!'}))
+class BotCore():
 
+    def __init__(self, settings, logs_dir, cache_dir):
+        # Initilization for the bot core managment object.
+        logging.info('[BotCore] Initilizing the BotCore object.')
 
-def shorten_indicators(indicators, end_time):
-    base_indicators = {}
+        ## Setup binance REST (with the order calls it is missing e.g. cancel-replace) and socket API.
+        self.rest_api = order_api.OrderAPI(rest_master.Binance_REST(settings['public_key'], settings['private_key']),
+                                           settings['public_key'], settings['private_key'])
+        self.socket_api = socket_master.Binance_SOCK()
 
-    for ind in indicators:
-        if ind in MULTI_DEPTH_INDICATORS:
-            base_indicators.update({ind: {}})
-            for sub_ind in indicators[ind]:
-                base_indicators[ind].update({sub_ind: [[val[0] if ind != 'order' else val[0] * 1000, val[1]] for val in
-                                                       indicators[ind][sub_ind] if
-                                                       (val[0] if ind != 'order' else val[0] * 1000) > end_time]})
+        ## Setup the market data recorder/replay (replays run in test mode and never use the market streams).
+        self.replay_dir = settings['replay_dir']
+        self.recorder = None
+        self.trader_pass_condition = None
+        if settings['record_dir'] and not self.replay_dir:
+            self.recorder = recorder.MarketRecorder(settings['record_dir'])
+
+        self.user_data_events = user_data.UserDataEvents(self.socket_api, recorder=self.recorder)
+
+        ## Setup the wallet balances shared by all traders.
+        self.wallet_service = wallet_service.WalletService()
+        self.fee_manager = None
+
+        ## Setup the snapshots the market data is published to for the traders.
+        self.snapshots = market_snapshot.SnapshotHub()
+
+        ## Setup the locally handled market streams and order books (or fed from a shared data hub if set).
+        self.data_hub = settings['data_hub'] if not self.replay_dir else None
+        local_stream = None if self.data_hub or self.replay_dir else market_stream.MarketStream(recorder=self.recorder)
+
+        self.order_books = order_book.OrderBookManager(local_stream, settings['max_depth'],
+                                                       snapshots=self.snapshots, recorder=self.recorder)
+
+        ## Setup the locally built candles (extra timeframes are aggregated from the trader interval).
+        self.candle_store = candle_store.CandleStore(local_stream, settings['trader_interval'],
+                                                     settings['max_candles'], settings['trader_timeframes'],
+                                                     snapshots=self.snapshots, recorder=self.recorder)
+
+        if self.replay_dir:
+            self.market_stream = recorder.MarketReplay(self.replay_dir, settings['replay_speed'], self.candle_store,
+                                                       self.order_books, self.snapshots)
+
+            ## Replay streams are handled the same as live so the books/candles are setup through them.
+            self.order_books.market_stream = self.market_stream
+            self.candle_store.market_stream = self.market_stream
+
+            ## At max speed wait for the traders to handle each update so the rerun is the same each time.
+            self.trader_pass_condition = threading.Condition()
+            if settings['replay_speed'] == 0:
+                self.market_stream.sync = self._wait_for_traders
+        elif self.data_hub:
+            self.market_stream = data_hub.DataHubClient(self.data_hub, settings['trader_interval'],
+                                                        self.candle_store, self.order_books)
         else:
-            base_indicators.update({ind: [[val[0], val[1]] for val in indicators[ind] if val[0] > end_time]})
-
-    return (base_indicators)
-
-
-def api_error_check(data):
-    ## Check if specified bot exists.
-    current_trader = None
-    for trader in core_object.trader_objects:
-        if trader.print_pair == data['market']:
-            current_trader = trader
-            break
-    return (current_trader)
-
-
-def web_updater():
-    # Web updater use to update live via socket.
-    lastHash = None
-
-    while True:
-        if core_object.coreState == 'RUN':
-            ## Get trader data and hash it to find out if there have been any changes.
-            traderData = core_object.get_trader_data()
-            currHash = hashlib.md5(str(traderData).encode())
-
-            if lastHash != currHash:
-                ## Update any new changes via socket.
-                lastHash = currHash
-                total_bulk_data = []
-                for trader in traderData:
-                    bulk_data = {}
-                    bulk_data.update({'market': trader['market']})
-                    bulk_data.update({'trade_recorder': trader['trade_recorder']})
-                    bulk_data.update({'wallet_pair': trader['wallet_pair']})
-
-                    bulk_data.update(trader['custom_conditions'])
-                    bulk_data.update(trader['market_activity'])
-                    bulk_data.update(trader['market_prices'])
-                    bulk_data.update(trader['state_data'])
-                    total_bulk_data.append(bulk_data)
-
-                SOCKET_IO.emit('current_traders_data', {'data': total_bulk_data})
-                time.sleep(.8)
+            self.market_stream = local_stream
 
+        ## Setup the optional trade/book ticker streams (batched into arrays for the strategies).
+        self.tick_stream = None
+        if settings['tick_streams']:
+            if self.data_hub:
+                logging.warning('[BotCore] Tick streams are not available through a data hub, skipping them.')
+            else:
+                self.tick_stream = tick_stream.TickStream(self.market_stream, self.snapshots, settings['tick_batch_ms'])
 
-class BotCore():
+        ## Setup the indicator service shared by all traders.
+        self.indicator_service = indicator_service.IndicatorService()
 
-    def __init__(self, settings, logs_dir, cache_dir):
-        # Initilization for the bot core managment object.
-        logging.info('[BotCore] Initilizing the BotCore object.')
+        ## Markets whose chart indicators are subscribed and the time they were last requested.
+        self.chart_requests = {}
 
-        ## Setup binance REST and socket API.
-        self.rest_api = rest_master.Binance_REST(settings['public_key'], settings['private_key'])
-        self.socket_api = socket_master.Binance_SOCK()
+        ## Indicators computed over candles that were later backfilled are recomputed from the changed candles.
+        self.candle_store.add_splice_listener(self.indicator_service.invalidate)
 
         ## Setup the logs/cache dir locations.
         self.logs_dir = logs_dir
@@ -240,6 +136,11 @@ class BotCore():
         self.run_type = settings['run_type']
         self.market_type = settings['market_type']
         self.update_bnb_balance = settings['update_bnb_balance']
+        self.fee_asset = settings['fee_asset']
+        self.fee_balance_threshold = settings['fee_balance_threshold']
+        self.fee_top_up_quantity = settings['fee_top_up_quantity']
+        self.max_exposure = settings['max_exposure']
+        self.max_open_positions = settings['max_open_positions']
 
         ## Setup max candle/depth setting.
         self.max_candles = settings['max_candles']
@@ -252,8 +153,31 @@ class BotCore():
         self.base_currency = settings['trading_currency']
         self.candle_Interval = settings['trader_interval']
 
+        ## Setup the capital allocator (only real trading is limited by the wallet balance).
+        self.capital_allocator = capital_allocator.CapitalAllocator(
+            self.quote_asset, wallet_service=self.wallet_service if self.run_type == 'REAL' else None,
+            max_exposure=self.max_exposure, max_positions=self.max_open_positions)
+
+        ## Test orders rest in the trigger engine and are filled by the candle update that crosses them.
+        self.trigger_engine = None
+        if self.run_type == 'TEST':
+            self.trigger_engine = trigger_engine.TriggerEngine()
+            self.candle_store.add_price_listener(self.trigger_engine.on_price)
+
+            ## With tick streams test orders are filled by every trade rather than each candle update.
+            if self.tick_stream:
+                self.tick_stream.add_batch_listener(lambda symbol, batch: self.trigger_engine.on_prices(
+                    symbol, batch.trades[:, tick_stream.TRADE_PRICE]))
+
         ## Initilize base trader settings.
         self.trader_objects = []
+        self.rule_engines = {}
+
+        ## Setup the strategies (loaded from the strategies dir and assigned per market).
+        self.strategy_registry = strategy_registry.StrategyRegistry(settings['strategies_dir'])
+        self.strategy_registry.add_reload_listener(self._on_strategy_reload)
+        self.default_strategy = settings['strategy']
+        self.market_strategies = settings['market_strategies']
         self.trading_markets = settings['trading_markets']
 
         ## Initilize core state
@@ -263,6 +187,7 @@ class BotCore():
         # Start the core object.
         logging.info('[BotCore] Starting the BotCore object.')
         self.coreState = 'SETUP'
+        self.start_time = time.time()
 
         ## check markets
         found_markets = []
@@ -296,12 +221,21 @@ class BotCore():
             # This is used to get the markets minimal notation.
             mN = float(market['filters'][3]['minNotional'])
 
-            # Put all rules into a json object to pass to the trader.
-            market_rules = {'LOT_SIZE': lS, 'TICK_SIZE': tS, 'MINIMUM_NOTATION': mN}
+            # Put all rules into a json object to pass to the trader (TICK_VALUE is the raw tick used to skip sub-tick amendments).
+            market_rules = {'LOT_SIZE': lS, 'TICK_SIZE': tS, 'TICK_VALUE': float(market['filters'][0]['tickSize']),
+                            'STEP_VALUE': float(market['filters'][2]['stepSize']), 'MINIMUM_NOTATION': mN}
 
             # Initilize trader objecta dn also set-up its inital required data.
             traderObject = trader.BaseTrader(market['quoteAsset'], market['baseAsset'], self.rest_api,
-                                             socket_api=self.socket_api)
+                                             socket_api=self.socket_api, order_books=self.order_books,
+                                             indicator_service=self.indicator_service,
+                                             candle_interval=self.candle_Interval,
+                                             candle_store=self.candle_store, snapshots=self.snapshots,
+                                             wallet_service=self.wallet_service,
+                                             capital_allocator=self.capital_allocator,
+                                             trigger_engine=self.trigger_engine,
+                                             replay=self.replay_dir != None,
+                                             pass_condition=self.trader_pass_condition)
             traderObject.setup_initial_values(self.market_type, self.run_type, market_rules)
             self.trader_objects.append(traderObject)
 
@@ -310,33 +244,83 @@ class BotCore():
             no_market_text = ''
             for market in [market for market in self.trading_markets if market not in found_markets]:
                 no_market_text += str(market) + ', '
-            logging.warning('Following pairs dont exist: {}'.format(no_market_text[:-2]))
+            logging.warning('Following pairs dont exist: %s', no_market_text[:-2])
 
         ## Show markets that dont support the market type.
         if len(not_supported) > 0:
             not_support_text = ''
             for market in not_supported:
                 not_support_text += ' ' + str(market)
-            logging.warning('[BotCore] Following market pairs are not supported for {}: {}'.format(self.market_type,
-                                                                                                   not_support_text))
+            logging.warning('[BotCore] Following market pairs are not supported for %s: %s',
+                            self.market_type, not_support_text)
 
         valid_tading_markets = [market for market in found_markets if market not in not_supported]
 
-        ## setup the binance socket.
+        ## Assign each market its strategy.
+        for trader_ in self.trader_objects:
+            strategy_name = self.market_strategies.get(trader_.print_pair, self.default_strategy)
+            strategy = self.strategy_registry.get(strategy_name)
+
+            if strategy == None:
+                logging.warning('[BotCore] Strategy %s could not be loaded for %s, using default.',
+                                strategy_name, trader_.print_pair)
+                strategy_name = strategy_registry.DEFAULT_STRATEGY
+                strategy = self.strategy_registry.get(strategy_name)
+
+            trader_.strategy_name = strategy_name
+            trader_.strategy = strategy
+
+        for strategy_name in set([trader_.strategy_name for trader_ in self.trader_objects]):
+            self._setup_rule_engine(strategy_name)
+
+        ## setup the market streams (candles and depth are maintained locally).
         for market in valid_tading_markets:
-            self.socket_api.set_candle_stream(symbol=market, interval=self.candle_Interval)
-            self.socket_api.set_manual_depth_stream(symbol=market, update_speed='1000ms')
+            m_split = market.split('-')
+            symbol = m_split[1] + m_split[0]
 
-        if self.run_type == 'REAL':
-            self.socket_api.set_userDataStream(self.rest_api, self.market_type)
+            self.snapshots.add_symbol(symbol, m_split[1], m_split[0])
+            self.wallet_service.subscribe(m_split[1], self.snapshots.on_wallet_change)
+            self.candle_store.add_symbol(symbol)
+            self.order_books.add_symbol(symbol)
+
+            if self.tick_stream:
+                self.tick_stream.add_symbol(symbol)
 
-        self.socket_api.BASE_CANDLE_LIMIT = self.max_candles
-        self.socket_api.BASE_DEPTH_LIMIT = self.max_depth
+            if self.data_hub:
+                self.market_stream.add_symbol(symbol)
 
-        self.socket_api.build_query()
-        self.socket_api.set_live_and_historic_combo(self.rest_api)
+        self.wallet_service.subscribe(self.quote_asset, self.snapshots.on_wallet_change)
 
-        self.socket_api.start()
+        ## setup the binance socket for the user data stream.
+        if self.run_type == 'REAL':
+            self.socket_api.set_userDataStream(self.rest_api, self.market_type)
+            self.socket_api.build_query()
+            self.socket_api.start()
+
+            ## Account updates are applied once to the wallet service, execution reports go to the snapshots.
+            self.user_data_events.subscribe('outboundAccountPosition', self.wallet_service.on_account_position)
+            self.user_data_events.subscribe('executionReport', self.snapshots.on_execution_report)
+
+            ## Setup the fee balance manager (kept up to date by the user data events).
+            if self.update_bnb_balance and self.fee_asset != self.quote_asset:
+                self.fee_manager = fee_manager.FeeBalanceManager(self.rest_api, self.market_type, self.fee_asset,
+                                                                 self.quote_asset, self.fee_balance_threshold,
+                                                                 self.fee_top_up_quantity)
+                self.wallet_service.subscribe(self.fee_asset, self.fee_manager.on_balance_change)
+                self.user_data_events.subscribe('executionReport', self.fee_manager.on_execution_report)
+
+        if self.recorder:
+            self.recorder.start()
+
+        ## History is loaded concurrently in the background, each trader starts once its own market is ready.
+        if not (self.data_hub or self.replay_dir):
+            self.order_books.start()
+            self.candle_store.start()
+            self.candle_store.load_histories([market.split('-')[1] + market.split('-')[0]
+                                              for market in valid_tading_markets])
+        if self.tick_stream:
+            self.tick_stream.start()
+        self.market_stream.start()
 
         # Load the wallets.
         if self.run_type == 'REAL':
@@ -356,12 +340,26 @@ class BotCore():
         else:
             current_tokens = {self.quote_asset: [float(self.base_currency), 0.0]}
 
-        # Load cached data
+        self.wallet_service.load(current_tokens)
+        if self.fee_manager:
+            self.fee_manager.on_balance_change(self.fee_asset, self.wallet_service.balances.get(self.fee_asset,
+                                                                                               [0.0, 0.0]))
+
+        # Load cached data (replays never resume from or overwrite the live trader cache).
         cached_traders_data = None
-        if os.path.exists(self.cache_dir + CAHCE_FILES):
+        if not self.replay_dir and os.path.exists(self.cache_dir + CAHCE_FILES):
             with open(self.cache_dir + CAHCE_FILES, 'r') as f:
                 cached_traders_data = json.load(f)['data']
 
+        ## Replays always compute their indicators from the recorded candles.
+        indicator_cache_path = self.cache_dir + INDICATOR_CACHE_FILE
+        if not self.replay_dir and os.path.exists(indicator_cache_path):
+            try:
+                with open(indicator_cache_path, 'r') as f:
+                    self.indicator_service.restore_states(json.load(f)['data'])
+            except (ValueError, KeyError):
+                logging.warning('[BotCore] Unable to read the indicator state cache, indicators will be recomputed.')
+
         ## Setup the trader objects and start them.
         logging.info('[BotCore] Starting the trader objects.')
         for trader_ in self.trader_objects:
@@ -374,28 +372,27 @@ class BotCore():
                     if (m_split[1] + m_split[0]) == currSymbol:
                         trader_.configuration = cached_trader['configuration']
                         trader_.custom_conditional_data = cached_trader['custom_conditions']
-                        trader_.market_activity = cached_trader['market_activity']
+                        trader_.market_activity.update(cached_trader['market_activity'])
                         trader_.trade_recorder = cached_trader['trade_recorder']
-                        trader_.state_data = cached_trader['state_data']
+                        trader_.state_data.update(cached_trader['state_data'])
 
-            wallet_pair = {}
+                        ## Resumed positions still hold their capital.
+                        if trader_.market_activity['order_side'] == 'SELL':
+                            self.capital_allocator.hold(trader_.print_pair, float(self.base_currency))
 
-            if trader_.quote_asset in current_tokens:
-                wallet_pair.update({trader_.quote_asset: current_tokens[trader_.quote_asset]})
-
-            if trader_.base_asset in current_tokens:
-                wallet_pair.update({trader_.base_asset: current_tokens[trader_.base_asset]})
-
-            trader_.start(self.base_currency, wallet_pair)
+            trader_.start(self.base_currency, self.wallet_service.get_pair(trader_.base_asset, trader_.quote_asset))
 
         logging.debug('[BotCore] Starting trader manager')
         TM_thread = threading.Thread(target=self._trader_manager)
         TM_thread.start()
 
-        if self.update_bnb_balance:
-            logging.debug('[BotCore] Starting BNB manager')
-            BNB_thread = threading.Thread(target=self._bnb_manager)
-            BNB_thread.start()
+        if self.run_type == 'REAL':
+            logging.debug('[BotCore] Starting user data events')
+            self.user_data_events.start()
+
+        logging.debug('[BotCore] Starting strategy manager thread.')
+        SM_thread = threading.Thread(target=self._strategy_manager)
+        SM_thread.start()
 
         logging.debug('[BotCore] Starting connection manager thread.')
         CM_thread = threading.Thread(target=self._connection_manager)
@@ -409,76 +406,148 @@ class BotCore():
         self.coreState = 'RUN'
 
     def _trader_manager(self):
-        ''' '''
+        ''' This grants the capital requested by the markets in a single ranked pass each tick. '''
+        warmed_up = False
+
+        while self.coreState != 'STOP':
+            ## Competing BUY requests are granted in ranked order.
+            self.capital_allocator.allocate()
+
+            if not warmed_up and all([trader_.first_decision_time != None for trader_ in self.trader_objects]):
+                warmed_up = True
+                logging.info('[BotCore] All %s markets warmed up in %.2fs.',
+                             len(self.trader_objects), time.time() - self.start_time)
+            time.sleep(ALLOCATION_INTERVAL)
+
+    def _wait_for_traders(self):
+        ''' Wait until every running trader has handled the latest snapshot for its market (used by replays). '''
+        with self.trader_pass_condition:
+            for trader_ in self.trader_objects:
+                symbol = trader_.configuration['symbol']
+                self.trader_pass_condition.wait_for(
+                    lambda: trader_.state_data['runtime_state'] in [None, 'STOP'] or
+                    trader_.snapshot_version == self.snapshots.get(symbol).version)
+
+    def _strategy_manager(self):
+        ''' This checks for changed strategy files and hot-reloads them (and drops chart indicators no longer viewed). '''
         while self.coreState != 'STOP':
-            pass
+            time.sleep(STRATEGY_RELOAD_INTERVAL)
+            self.strategy_registry.check_reload()
 
-    def _bnb_manager(self):
-        ''' This will manage BNB balance and update if there is low BNB in account. '''
-        last_wallet_update_time = 0
+            for market, request_time in list(self.chart_requests.items()):
+                if time.time() - request_time > CHART_SUBSCRIPTION_SECONDS:
+                    self.chart_requests.pop(market, None)
+                    self.indicator_service.unsubscribe(('chart', market))
 
-        while self.coreState != 'STOP':
-            socket_buffer_global = self.socket_api.socketBuffer
+    def _on_strategy_reload(self, strategy_name, strategy):
+        ''' Swap in a reloaded strategy for its markets (candle/socket state is untouched). '''
+        for trader_ in self.trader_objects:
+            if trader_.strategy_name == strategy_name:
+                trader_.strategy = strategy
+        self._setup_rule_engine(strategy_name)
+
+    def _setup_rule_engine(self, strategy_name):
+        ''' Compile any rules declared by a strategy so all of its markets share the compiled rules. '''
+        strategy = self.strategy_registry.get(strategy_name)
+        traders = [trader_ for trader_ in self.trader_objects if trader_.strategy_name == strategy_name]
+        engine = None
 
-            # If outbound postion is seen then wallet has updated.
-            if 'outboundAccountPosition' in socket_buffer_global:
-                if last_wallet_update_time != socket_buffer_global['outboundAccountPosition']['E']:
-                    last_wallet_update_time = socket_buffer_global['outboundAccountPosition']['E']
+        if any(hasattr(strategy, attr_name) for attr_name in rule_engine.RULE_SET_NAMES):
+            engine = rule_engine.RuleEngine(strategy, [trader_.configuration['symbol'] for trader_ in traders])
 
-                    for wallet in socket_buffer_global['outboundAccountPosition']['B']:
-                        if wallet['a'] == 'BNB':
-                            if float(wallet['f']) < 0.01:
-                                bnb_order = self.rest_api.place_order(self.market_type, symbol='BNBBTC', side='BUY',
-                                                                      type='MARKET', quantity=0.1)
-            time.sleep(2)
+        for trader_ in traders:
+            trader_.rule_engine = engine
+        self.rule_engines.update({strategy_name: engine})
 
     def _file_manager(self):
         ''' This section is responsible for activly updating the traders cache files. '''
+        cached_versions = {}
+
         while self.coreState != 'STOP':
             time.sleep(15)
 
-            traders_data = self.get_trader_data()
-            if os.path.exists(self.cache_dir):
+            ## The cache is only rewritten if any of the traders have changed since the last write.
+            if os.path.exists(self.cache_dir) and not self.replay_dir and \
+                    self.get_changed_trader_data(cached_versions):
+                traders_data = self.get_trader_data()
                 file_path = '{0}{1}'.format(self.cache_dir, CAHCE_FILES)
                 with open(file_path, 'w') as f:
                     json.dump({'lastUpdateTime': time.time(), 'data': traders_data}, f)
 
+                ## Written to a temp file first so a restart never reads a partly written state.
+                file_path = '{0}{1}'.format(self.cache_dir, INDICATOR_CACHE_FILE)
+                with open(file_path + '.tmp', 'w') as f:
+                    json.dump({'lastUpdateTime': time.time(), 'data': self.indicator_service.export_states()}, f)
+                os.replace(file_path + '.tmp', file_path)
+
     def _connection_manager(self):
-        ''' This section is responsible for re-testing connectiongs in the event of a disconnect. '''
-        update_time = 0
-        retryCounter = 1
+        '''
+        This section is responsible for re-testing connectiongs in the event of a disconnect.
+        -> Only the market streams that have gone quiet are resubscribed, the socket is only reconnected if all are.
+        -> Missed candles are backfilled by the candle store when it sees the gap in the stream.
+        '''
+        last_socket_restart = 0
         time.sleep(20)
 
         while self.coreState != 'STOP':
             time.sleep(1)
             if self.coreState != 'RUN':
                 continue
-            if self.socket_api.last_data_recv_time != update_time:
-                update_time = self.socket_api.last_data_recv_time
-            else:
-                if (update_time + (15 * retryCounter)) < time.time():
-                    retryCounter += 1
-                    try:
-                        print(self.rest_api.test_ping())
-                    except Exception as e:
-                        logging.warning('[BotCore] Connection issue: {0}.'.format(e))
-                        continue
-
-                    logging.info('[BotCore] Connection issue resolved.')
-                    if not (self.socket_api.socketRunning):
-                        logging.info('[BotCore] Attempting socket restart.')
-                        self.socket_api.start()
+
+            if self.run_type == 'REAL' and not (self.socket_api.socketRunning):
+                if last_socket_restart + STALE_STREAM_SECONDS < time.time():
+                    last_socket_restart = time.time()
+                    logging.info('[BotCore] Attempting user data socket restart.')
+                    self.socket_api.start()
+
+            ## Data hub/replay connections are managed by the client/replay themselves.
+            if not isinstance(self.market_stream, market_stream.MarketStream):
+                continue
+
+            stale_streams = self.market_stream.stale_streams(STALE_STREAM_SECONDS)
+            if not stale_streams:
+                continue
+
+            if not self.market_stream.socketRunning or len(stale_streams) == len(self.market_stream.handlers):
+                logging.warning('[BotCore] No market data recieved, reconnecting market stream.')
+                self.market_stream.restart()
+            elif self.market_stream.resubscribe(stale_streams):
+                logging.info('[BotCore] Resubscribed %s stale streams.', len(stale_streams))
 
     def get_trader_data(self):
         ''' This can be called to return data for each of the active traders. '''
         rData = [_trader.get_trader_data() for _trader in self.trader_objects]
         return (rData)
 
+    def get_changed_trader_data(self, versions):
+        ''' Data of only the traders whose state changed since the versions given ({market:version}, updated). '''
+        rData = []
+        for _trader in self.trader_objects:
+            version = _trader.get_state_version()
+            if versions.get(_trader.print_pair) != version:
+                versions[_trader.print_pair] = version
+                rData.append(_trader.get_trader_data())
+        return (rData)
+
     def get_trader_indicators(self, market):
         ''' This can be called to return the indicators that are used by the traders (Will be used to display web UI activity.) '''
         for _trader in self.trader_objects:
             if _trader.print_pair == market:
-                indicator_data = _trader.indicators
+                ## Indicators are shared with the trader so build a new top level dict rather than modify them.
+                indicator_data = dict(_trader.indicators)
+
+                ## Declared/chart only indicators are computed over the full candles only when a chart is requested.
+                strategy = _trader.strategy
+                if hasattr(strategy, 'INDICATORS') or hasattr(strategy, 'CHART_INDICATORS'):
+                    sock_symbol = str(_trader.base_asset) + str(_trader.quote_asset)
+                    chart_view = self.indicator_service.view(sock_symbol, self.candle_Interval,
+                                                             self.candle_store.get_candles(sock_symbol),
+                                                             subscriber=('chart', market))
+                    self.chart_requests[market] = time.time()
+                    indicator_data.update(chart_view.get_declared(getattr(strategy, 'INDICATORS', {})))
+                    indicator_data.update(chart_view.get_declared(getattr(strategy, 'CHART_INDICATORS', {})))
+                    chart_view.close()
+
                 indicator_data.update({'order': {'buy': [], 'sell': []}})
                 indicator_data['order']['buy'] = [[order[0], order[1]] for order in _trader.trade_recorder if
                                                   order[4] == 'BUY']
@@ -491,26 +560,29 @@ class BotCore():
         for _trader in self.trader_objects:
             if _trader.print_pair == market:
                 sock_symbol = str(_trader.base_asset) + str(_trader.quote_asset)
-                return (self.socket_api.get_live_candles(sock_symbol))
+                return (self.candle_store.get_candles(sock_symbol))
 
 
 def start(settings, logs_dir, cache_dir):
-    global core_object, host_ip, host_port
+    global core_object
 
     if core_object == None:
         core_object = BotCore(settings, logs_dir, cache_dir)
         core_object.start()
 
-    logging.info('[BotCore] Starting traders in {0} mode, market type is {1}.'.format(settings['run_type'],
-                                                                                      settings['market_type']))
-    log = logging.getLogger('werkzeug')
-    log.setLevel(logging.ERROR)
+    logging.info('[BotCore] Starting traders in %s mode, market type is %s.',
+                 settings['run_type'], settings['market_type'])
+
+    if settings['metrics_port']:
+        from . import metrics
+        metrics.start(core_object, settings['host_ip'], settings['metrics_port'])
 
-    host_ip = settings['host_ip']
-    host_port = settings['host_port']
+    if settings['headless']:
+        ## The web stack is never imported, the core runs until it is stopped.
+        logging.info('[BotCore] Running headless.')
+        while core_object.coreState != 'STOP':
+            time.sleep(HEADLESS_CHECK_INTERVAL)
+        return
 
-    SOCKET_IO.run(APP,
-                  host=settings['host_ip'],
-                  port=settings['host_port'],
-                  debug=True,
-                  use_reloader=False)
+    from . import web_app
+    web_app.start(core_object, settings)
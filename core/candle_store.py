@@ -0,0 +1,380 @@
+#! /usr/bin/env python3
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import public_api
+
+## Max candles that can be requested from the REST klines endpoint at once.
+MAX_KLINES_LIMIT = 1000
+
+## Number of symbols whose history is loaded at the same time (requests are paced by the public api weight limit).
+HISTORY_WORKERS = 8
+
+## Times an empty history is requested again before the symbol is given up on (e.g. delisted or not trading).
+HISTORY_EMPTY_RETRIES = 5
+
+## Length of each supported interval in seconds.
+INTERVAL_SECONDS = {
+    '1m': 60, '3m': 180, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '2h': 7200, '4h': 14400, '6h': 21600, '8h': 28800, '12h': 43200,
+    '1d': 86400, '3d': 259200, '1w': 604800}
+
+## Offset of the period open times from the epoch for intervals that are not aligned to it in seconds (weeks open on
+## monday, the epoch was a thursday). Timeframes seeded from their own history take the open times it has.
+INTERVAL_OFFSETS = {'1w': 345600}
+
+
+class CandleBuffer(object):
+    '''
+    Candles for a single symbol/interval held newest first ([[time, open, high, low, close, volume], ...]).
+    Every update replaces the list (copy on write) so readers holding the old list always see a consistent set.
+    '''
+
+    def __init__(self, max_candles):
+        self.max_candles = max_candles
+        self.candles = []
+
+    def load(self, candles):
+        self.candles = candles[:self.max_candles]
+
+    def update(self, candle):
+        ''' Update the live candle or push a new one, returns True if a new candle was opened. '''
+        candles = self.candles
+
+        if candles and candles[0][0] == candle[0]:
+            self.candles = [candle] + candles[1:]
+            return (False)
+
+        if candles and candles[0][0] > candle[0]:
+            ## Older than the live candle (e.g. seen during a history load) so ignore it.
+            return (False)
+
+        self.candles = [candle] + candles[:self.max_candles - 1]
+        return (True)
+
+    def splice(self, candles):
+        ''' Merge a range of candles (newest first) into the buffer replacing those with the same open times. '''
+        newest_time = candles[0][0]
+        oldest_time = candles[-1][0]
+
+        ## Candles outside the range are kept (a newer live candle may have arrived while the range was fetched).
+        merged = {candle[0]: candle for candle in self.candles if candle[0] < oldest_time or candle[0] >= newest_time}
+        for candle in candles:
+            if not candle[0] in merged:
+                merged[candle[0]] = candle
+
+        self.candles = sorted(merged.values(), key=lambda candle: candle[0], reverse=True)[:self.max_candles]
+
+
+class CandleAggregator(object):
+    '''
+    Builds higher timeframe candles from base interval candles as they update.
+    -> Closed base candles within the current period are folded into a running open/high/low/volume.
+    -> The live base candle is merged on top of that on each update so no base history needs to be kept.
+    -> The older candles come from the timeframes own history (see rebuild), without one only the periods fully
+       covered by the base candles exist (e.g. 1000 1m candles give 16 1h candles).
+    '''
+
+    def __init__(self, interval, max_candles):
+        self.interval = interval
+        self.period_ms = INTERVAL_SECONDS[interval] * 1000
+        self.anchor = INTERVAL_OFFSETS.get(interval, 0) * 1000
+        self.buffer = CandleBuffer(max_candles)
+
+        self.period_time = None
+        self.closed = None
+        self.live_base = None
+
+    def period_of(self, time):
+        ''' Open time of the period a time is in. '''
+        return (time - ((time - self.anchor) % self.period_ms))
+
+    def rebuild(self, history, base_candles):
+        '''
+        Set the candles from a history of this timeframe and the base candles (both newest first).
+        -> Every period fully covered by the base candles is built from them, older ones are taken from the history.
+        -> If the base candles do not reach back to the start of the current period its history candle is carried on
+           (the volume of the base candle that was live when it was fetched is then counted twice until it closes).
+        '''
+        if history:
+            self.anchor = history[0][0] % self.period_ms
+
+        self.period_time = None
+        self.closed = None
+        self.live_base = None
+
+        if not base_candles:
+            self.buffer.load(history)
+            return
+
+        ## The oldest period is usually only partly covered by the base candles so start from the first full one.
+        start_time = self.period_of(base_candles[-1][0])
+        if start_time != base_candles[-1][0]:
+            start_time += self.period_ms
+
+        history = [candle for candle in history if candle[0] < start_time]
+        self.buffer.load(history)
+
+        if history and history[0][0] == self.period_of(base_candles[0][0]):
+            self.period_time = history[0][0]
+            self.closed = list(history[0])
+
+        for candle in reversed(base_candles):
+            if candle[0] >= start_time:
+                self.add_base(candle)
+
+    def add_base(self, candle):
+        ## A base candle with a new open time means the previous base candle has closed.
+        if self.live_base != None and candle[0] != self.live_base[0]:
+            if self.period_of(self.live_base[0]) == self.period_time:
+                self.closed = self._merge(self.closed, self.live_base)
+
+        self.live_base = candle
+        period_time = self.period_of(candle[0])
+
+        if period_time != self.period_time:
+            self.period_time = period_time
+            self.closed = None
+
+        current = self._merge(self.closed, candle)
+        self.buffer.update([period_time, current[1], current[2], current[3], current[4], current[5]])
+
+    def _merge(self, first, second):
+        if first == None:
+            return (list(second))
+        return ([first[0], first[1], max(first[2], second[2]), min(first[3], second[3]), second[4],
+                 first[5] + second[5]])
+
+
+class CandleStore(object):
+    '''
+    Candles for all traded markets built from a single kline stream per market.
+    -> Extra timeframes are aggregated locally from the base stream (no extra sockets), their history is fetched
+       once with the base history so each holds up to max_candles (fed in histories without them only hold the
+       periods covered by the base candles).
+    -> Memory is bounded by max_candles for every symbol/timeframe.
+    -> If a snapshot hub is given the candles are published to it on every update (once the history is set).
+    -> Candles missed while a stream was down are backfilled over REST and spliced in (splice listeners are called
+       with (symbol, splice time) so anything built from the candles can be recomputed from there).
+    -> Price listeners are called with (symbol, close) on every live candle update (e.g. to fill test orders).
+    '''
+
+    def __init__(self, market_stream, interval, max_candles, timeframes=None, snapshots=None, recorder=None):
+        self.market_stream = market_stream
+        self.snapshots = snapshots
+        self.recorder = recorder
+        self.interval = interval
+        self.max_candles = max_candles
+        self.timeframes = []
+
+        base_seconds = INTERVAL_SECONDS[interval]
+        for timeframe in (timeframes or []):
+            if not timeframe in INTERVAL_SECONDS or INTERVAL_SECONDS[timeframe] <= base_seconds or (
+                    INTERVAL_SECONDS[timeframe] % base_seconds != 0):
+                logging.warning('[CandleStore] Timeframe %s is not a multiple of %s, skipping it.', timeframe, interval)
+                continue
+            self.timeframes.append(timeframe)
+
+        self.buffers = {}
+        self.aggregators = {}
+
+        ## If the closing update of each live candle was seen (if not the candle is backfilled once it is replaced).
+        self.live_closed = {}
+        self.history_loaded = set()
+        self.splice_listeners = []
+        self.price_listeners = []
+        self.backfill_from = {}
+        self.backfill_queue = queue.Queue()
+        self.backfill_lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    def start(self):
+        ''' Start the backfill worker. '''
+        threading.Thread(target=self._backfill_worker).start()
+
+    def add_splice_listener(self, listener):
+        self.splice_listeners.append(listener)
+
+    def add_price_listener(self, listener):
+        self.price_listeners.append(listener)
+
+    def add_symbol(self, symbol):
+        ''' Setup the candle buffers for a symbol and subscribe to its kline stream. '''
+        self.buffers.update({symbol: CandleBuffer(self.max_candles)})
+        self.aggregators.update(
+            {symbol: {timeframe: CandleAggregator(timeframe, self.max_candles) for timeframe in self.timeframes}})
+
+        ## Without a market stream the candles are fed in (e.g. by a data hub client).
+        if self.market_stream != None:
+            stream = '{0}@kline_{1}'.format(symbol.lower(), self.interval)
+            self.market_stream.subscribe(stream, lambda event, symbol=symbol: self._on_kline_event(symbol, event))
+
+    def load_history(self, symbol):
+        ''' Load the candle history for a symbol and each of its aggregated timeframes. '''
+        candles = public_api.get_klines(symbol, self.interval, limit=self.max_candles)
+        timeframe_candles = {timeframe: public_api.get_klines(symbol, timeframe, limit=self.max_candles) for
+                             timeframe in self.timeframes} if candles else {}
+
+        if self.recorder:
+            self.recorder.record('history', {'symbol': symbol, 'candles': candles,
+                                             'timeframe_candles': timeframe_candles})
+        self.set_history(symbol, candles, timeframe_candles)
+        return (len(candles) > 0)
+
+    def load_histories(self, symbols):
+        '''
+        Load the history for several symbols concurrently, each is published as soon as it is loaded.
+        -> Returns the futures straight away (one per symbol) so callers can choose whether to wait.
+        '''
+        executor = ThreadPoolExecutor(max_workers=HISTORY_WORKERS)
+        futures = [executor.submit(self._load_history_retry, symbol) for symbol in symbols]
+        executor.shutdown(wait=False)
+        return (futures)
+
+    def set_history(self, symbol, candles, timeframe_candles=None):
+        ''' Set the candle history of a symbol (and optionally of its timeframes as {timeframe:candles, ...}). '''
+        timeframe_candles = timeframe_candles or {}
+
+        with self.update_lock:
+            self.buffers[symbol].load(candles)
+            self.live_closed[symbol] = False
+            self.history_loaded.add(symbol)
+            self._rebuild_timeframes(symbol, {timeframe: timeframe_candles.get(timeframe, []) for timeframe in
+                                              self.timeframes})
+            self._publish(symbol)
+
+    def splice(self, symbol, candles):
+        ''' Splice a range of candles (newest first) into the history of a symbol. '''
+        if not candles:
+            return
+
+        with self.update_lock:
+            self.buffers[symbol].splice(candles)
+            self._rebuild_timeframes(symbol)
+            self._publish(symbol)
+
+        logging.info('[CandleStore] Spliced %s candles into %s from %s.', len(candles), symbol, candles[-1][0])
+        for listener in self.splice_listeners:
+            try:
+                listener(symbol, candles[-1][0])
+            except Exception:
+                logging.exception('[CandleStore] Splice listener failed for %s.', symbol)
+
+    def request_backfill(self, symbol, start_time):
+        ''' Queue a backfill of the candles of a symbol from start_time (open time in ms) to now. '''
+        with self.backfill_lock:
+            if symbol in self.backfill_from:
+                self.backfill_from[symbol] = min(self.backfill_from[symbol], start_time)
+                return
+            self.backfill_from[symbol] = start_time
+        self.backfill_queue.put(symbol)
+
+    def get_candles(self, symbol, interval=None):
+        ''' Candles endpoint used by the traders (base interval unless another timeframe is requested). '''
+        if interval == None or interval == self.interval:
+            return (self.buffers[symbol].candles if symbol in self.buffers else [])
+        return (self.aggregators[symbol][interval].buffer.candles)
+
+    def get_timeframes(self, symbol):
+        ''' All extra timeframe candles for a symbol. '''
+        return ({timeframe: aggregator.buffer.candles for timeframe, aggregator in self.aggregators[symbol].items()})
+
+    def _on_kline_event(self, symbol, event):
+        kline = event['k']
+        candle = [kline['t'], float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']),
+                  float(kline['v'])]
+
+        ## A new candle has opened, check nothing was missed since the last one.
+        candles = self.buffers[symbol].candles
+        if candles and candle[0] > candles[0][0]:
+            period_ms = INTERVAL_SECONDS[self.interval] * 1000
+
+            if not self.live_closed.get(symbol, True):
+                ## The closing update of the last candle was missed so it is backfilled too.
+                self.request_backfill(symbol, candles[0][0])
+            elif candle[0] > candles[0][0] + period_ms:
+                self.request_backfill(symbol, candles[0][0] + period_ms)
+
+        self.live_closed[symbol] = kline['x']
+        self.add_candle(symbol, candle)
+
+    def add_candle(self, symbol, candle):
+        ''' Update the live candle of a symbol (or open a new one). '''
+        with self.update_lock:
+            self.buffers[symbol].update(candle)
+
+            for aggregator in self.aggregators[symbol].values():
+                aggregator.add_base(candle)
+
+            ## Called before publishing so a trader handling the new snapshot already sees anything it triggered.
+            for listener in self.price_listeners:
+                listener(symbol, candle[4])
+
+            self._publish(symbol)
+
+    def _load_history_retry(self, symbol):
+        empty_tries = 0
+        while True:
+            try:
+                if self.load_history(symbol):
+                    return (True)
+
+                empty_tries += 1
+                if empty_tries > HISTORY_EMPTY_RETRIES:
+                    logging.warning('[CandleStore] No candle history returned for %s, giving up.', symbol)
+                    return (False)
+            except Exception as error:
+                logging.warning('[CandleStore] Failed to load history for %s: %s', symbol, error)
+            time.sleep(1)
+
+    def _rebuild_timeframes(self, symbol, histories=None):
+        ## Rebuilt from the base candles on top of the given histories (or the candles already held on a splice).
+        candles = self.buffers[symbol].candles
+        aggregators = {timeframe: CandleAggregator(timeframe, self.max_candles) for timeframe in self.timeframes}
+        for timeframe, aggregator in aggregators.items():
+            if histories != None:
+                history = histories[timeframe]
+            else:
+                history = self.aggregators[symbol][timeframe].buffer.candles
+            aggregator.rebuild(history, candles)
+        self.aggregators[symbol] = aggregators
+
+    def _backfill_worker(self):
+        period_ms = INTERVAL_SECONDS[self.interval] * 1000
+
+        while True:
+            symbol = self.backfill_queue.get()
+            with self.backfill_lock:
+                start_time = self.backfill_from.pop(symbol)
+
+            ## Only the missing range is requested (limited to the candles that can be held).
+            missing = int(((time.time() * 1000) - start_time) / period_ms) + 1
+            limit = min(missing, self.max_candles, MAX_KLINES_LIMIT)
+            if missing > limit:
+                start_time = int((time.time() * 1000) - ((limit - 1) * period_ms))
+                start_time -= start_time % period_ms
+
+            try:
+                candles = public_api.get_klines(symbol, self.interval, limit=limit, startTime=start_time)
+            except Exception as error:
+                logging.warning('[CandleStore] Backfill failed for %s: %s', symbol, error)
+                time.sleep(1)
+                self.request_backfill(symbol, start_time)
+                continue
+
+            ## An error splicing one symbol must not stop the worker backfilling the rest.
+            try:
+                if self.recorder:
+                    self.recorder.record('splice', {'symbol': symbol, 'candles': candles})
+                self.splice(symbol, candles)
+            except Exception:
+                logging.exception('[CandleStore] Unable to splice the backfill for %s.', symbol)
+
+    def _publish(self, symbol):
+        ## Live candles can arrive before the history is loaded, traders only see them once it is.
+        if self.snapshots != None and symbol in self.history_loaded:
+            self.snapshots.publish(symbol, candles=self.buffers[symbol].candles,
+                                   timeframe_candles=self.get_timeframes(symbol))
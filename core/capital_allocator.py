@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+import time
+import logging
+import threading
+
+## Results of a capital request.
+ALLOCATION_GRANTED = 'GRANTED'
+ALLOCATION_PENDING = 'PENDING'
+ALLOCATION_DENIED = 'DENIED'
+
+
+class CapitalAllocator(object):
+    '''
+    Allocates the quote capital used by the traders BUY orders across all markets.
+    -> Capital is allocated per market from the BUY request until its position is closed (or the BUY is dropped).
+    -> Allocations are limited by the total exposure, the number of open positions and (if given) the wallet balance.
+    -> A request that fits with no other requests waiting is granted straight away, competing requests are queued
+       and granted by score (then age) each time allocate() is called.
+    -> Owners renew their request on every pass until the BUY is placed, one that is not renewed is dropped with
+       expire() (a queued request or a grant not used by its next pass).
+    -> Margin SHORT entries are requested the same as LONG BUYs so the limits cover both.
+    '''
+
+    def __init__(self, quote_asset, wallet_service=None, max_exposure=None, max_positions=None):
+        self.quote_asset = quote_asset
+        self.wallet_service = wallet_service
+        self.max_exposure = max_exposure
+        self.max_positions = max_positions
+
+        self.allocations = {}
+        self.pending = {}
+        self.allocation_lock = threading.Lock()
+
+    def request(self, owner, amount, score=0):
+        ''' Request capital for a BUY, returns ALLOCATION_GRANTED, ALLOCATION_PENDING or ALLOCATION_DENIED. '''
+        with self.allocation_lock:
+            if owner in self.allocations:
+                return (ALLOCATION_GRANTED)
+
+            ## Not enough balance for the order even without any competition (other owners reservations only queue it).
+            if self.wallet_service and self.wallet_service.free(self.quote_asset) < amount:
+                self.pending.pop(owner, None)
+                return (ALLOCATION_DENIED)
+
+            request_time = self.pending[owner][1] if owner in self.pending else time.time()
+            self.pending[owner] = (score, request_time, amount)
+
+            if len(self.pending) == 1 and self._fits(owner, amount) and self._grant(owner):
+                return (ALLOCATION_GRANTED)
+
+        return (ALLOCATION_PENDING)
+
+    def allocate(self):
+        ''' Grant the queued requests that fit in order of score then age. '''
+        if not self.pending:
+            return
+
+        with self.allocation_lock:
+            for owner, (score, request_time, amount) in sorted(self.pending.items(),
+                                                               key=lambda item: (-item[1][0], item[1][1])):
+                if self._fits(owner, amount):
+                    self._grant(owner)
+
+    def hold(self, owner, amount):
+        ''' Allocate capital to a position that is already open (e.g. resumed from the cache). '''
+        with self.allocation_lock:
+            self.pending.pop(owner, None)
+            self.allocations[owner] = amount
+
+    def placed(self, owner):
+        ''' The BUY was accepted so its wallet reservation is dropped once the account shows the quote as locked. '''
+        if self.wallet_service:
+            self.wallet_service.placed(self.quote_asset, owner)
+
+    def filled(self, owner):
+        ''' The BUY has filled so the balance is already spent, the allocation is held until release. '''
+        if self.wallet_service:
+            self.wallet_service.release(self.quote_asset, owner)
+
+    def release(self, owner):
+        ''' Drop any allocation or queued request held by an owner. '''
+        with self.allocation_lock:
+            self.pending.pop(owner, None)
+            self.allocations.pop(owner, None)
+
+        if self.wallet_service:
+            self.wallet_service.release(self.quote_asset, owner)
+
+    def expire(self, owner):
+        ''' Drop the request or unused allocation of an owner that did not renew it (its BUY was not placed). '''
+        if owner in self.pending or owner in self.allocations:
+            self.release(owner)
+
+    def exposure(self):
+        return (sum(self.allocations.values()))
+
+    def _fits(self, owner, amount):
+        if self.max_positions and len(self.allocations) >= self.max_positions:
+            return (False)
+
+        if self.max_exposure and self.exposure() + amount > self.max_exposure:
+            return (False)
+
+        if self.wallet_service and self.wallet_service.available(self.quote_asset, owner) < amount:
+            return (False)
+        return (True)
+
+    def _grant(self, owner):
+        amount = self.pending[owner][2]
+
+        ## The balance can be reserved by another owner since it was checked, the request then stays queued.
+        if self.wallet_service and not self.wallet_service.reserve(self.quote_asset, owner, amount):
+            return (False)
+
+        self.pending.pop(owner)
+        self.allocations[owner] = amount
+
+        logging.debug('[CapitalAllocator] Allocated %s %s to %s (exposure %s).',
+                      amount, self.quote_asset, owner, self.exposure())
+        return (True)
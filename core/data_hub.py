@@ -0,0 +1,319 @@
+#! /usr/bin/env python3
+'''
+Market data hub shared by multiple bot instances on the same machine.
+
+The hub holds the binance market streams, candles and order books once and publishes them to any
+number of local clients over a unix socket as JSON lines:
+
+    client -> hub   {'type':'subscribe', 'interval':'15m', 'symbols':['ETHBTC', ...]}
+    hub -> client   {'type':'history', 'interval':'15m', 'symbol':'ETHBTC', 'candles':[[time, o, h, l, c, v], ...]}
+                    {'type':'kline', 'interval':'15m', 'symbol':'ETHBTC', 'candle':[time, o, h, l, c, v]}
+                    {'type':'depth', 'symbol':'ETHBTC', 'depth':{'a':[[price, qty], ...], 'b':[...]}}
+                    {'type':'depth_diff', 'symbol':'ETHBTC', 'a':[[price, qty], ...], 'b':[...]}
+                    {'type':'splice', 'interval':'15m', 'symbol':'ETHBTC', 'candles':[[time, o, h, l, c, v], ...]}
+
+A client is sent the full depth once on subscribing and then only the levels that changed (qty 0 removes a level).
+'''
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+from concurrent.futures import wait
+
+from . import order_book
+from . import candle_store
+from . import market_stream
+
+## Max messages queued for a client before it is dropped (a client that can not keep up must not stall the hub).
+CLIENT_QUEUE_SIZE = 10000
+
+
+class _HubPublisher(object):
+    '''
+    Takes the place of the snapshot hub for the hubs candle store/order books and forwards updates to clients.
+    -> Depth is forwarded as the levels changed since the last depth sent for the symbol (see send_depth).
+    '''
+
+    def __init__(self, server, interval=None):
+        self.server = server
+        self.interval = interval
+        self.last_depths = {}
+        self.depth_lock = threading.Lock()
+
+    def publish(self, symbol, **changes):
+        if 'candles' in changes and changes['candles']:
+            self.server.broadcast(('kline', self.interval, symbol), {
+                'type': 'kline', 'interval': self.interval, 'symbol': symbol, 'candle': changes['candles'][0]})
+
+        if 'depth' in changes:
+            with self.depth_lock:
+                new_depth = {side: dict(levels) for side, levels in changes['depth'].items()}
+                last_depth = self.last_depths.get(symbol, {'a': {}, 'b': {}})
+                self.last_depths[symbol] = new_depth
+
+                diff = {side: [[price, qty] for price, qty in new_depth[side].items() if
+                               last_depth[side].get(price) != qty] +
+                              [[price, 0] for price in last_depth[side] if not price in new_depth[side]]
+                        for side in ('a', 'b')}
+
+                if diff['a'] or diff['b']:
+                    self.server.broadcast(('depth', symbol), {'type': 'depth_diff', 'symbol': symbol,
+                                                              'a': diff['a'], 'b': diff['b']})
+
+    def send_depth(self, client, symbol):
+        ''' Send the full depth last forwarded for a symbol (in order with the diffs that follow it). '''
+        with self.depth_lock:
+            client.topics.add(('depth', symbol))
+            if symbol in self.last_depths:
+                depth = {side: [[price, qty] for price, qty in levels.items()] for side, levels in
+                         self.last_depths[symbol].items()}
+                client.send(self.server._encode({'type': 'depth', 'symbol': symbol, 'depth': depth}))
+
+
+class _HubConnection(object):
+    ''' A connected client, messages are sent from its own queue so a slow client only holds itself up. '''
+
+    def __init__(self, server, conn):
+        self.server = server
+        self.conn = conn
+        self.topics = set()
+        self.send_queue = queue.Queue(CLIENT_QUEUE_SIZE)
+        self.running = True
+
+    def start(self):
+        threading.Thread(target=self._reader).start()
+        threading.Thread(target=self._writer).start()
+
+    def send(self, data):
+        try:
+            self.send_queue.put_nowait(data)
+        except queue.Full:
+            logging.warning('[DataHub] Client is not keeping up, dropping it.')
+            self.close()
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.server.remove_client(self)
+
+        ## The socket is shut first so a writer blocked sending to a stalled client is released.
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+        ## Never block here (the queue may be full), anything still queued is dropped to make room for the stop.
+        while True:
+            try:
+                self.send_queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self.send_queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _reader(self):
+        try:
+            for line in self.conn.makefile('r'):
+                message = json.loads(line)
+                if message['type'] == 'subscribe':
+                    self.server.subscribe(self, message['interval'], message['symbols'])
+        except (OSError, ValueError, KeyError) as error:
+            logging.debug('[DataHub] Client read failed: %s', error)
+        self.close()
+
+    def _writer(self):
+        while True:
+            data = self.send_queue.get()
+            if data == None:
+                break
+
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                self.close()
+                break
+
+
+class DataHubServer(object):
+    '''
+    Standalone process holding the market data for all local bot instances.
+    -> Each symbol/interval is only streamed and stored once however many clients use it.
+    -> New clients are sent the candle history and current depth then every update for their symbols.
+    '''
+
+    def __init__(self, socket_path, max_candles, max_depth):
+        self.socket_path = socket_path
+        self.max_candles = max_candles
+
+        self.market_stream = market_stream.MarketStream()
+        self.depth_publisher = _HubPublisher(self)
+        self.order_books = order_book.OrderBookManager(self.market_stream, max_depth,
+                                                       snapshots=self.depth_publisher)
+        self.candle_stores = {}
+
+        self.clients = []
+        self.client_lock = threading.Lock()
+        self.subscribe_lock = threading.Lock()
+
+    def start(self):
+        ''' Start serving clients (blocks). '''
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.socket_path)
+        server_socket.listen()
+
+        self.order_books.start()
+        logging.info('[DataHub] Serving market data on %s.', self.socket_path)
+
+        while True:
+            conn, address = server_socket.accept()
+            client = _HubConnection(self, conn)
+
+            with self.client_lock:
+                self.clients = self.clients + [client]
+            client.start()
+
+    def subscribe(self, client, interval, symbols):
+        ''' Add any new symbols/interval to the hub then send the client their current state. '''
+        with self.subscribe_lock:
+            if not interval in self.candle_stores:
+                self.candle_stores[interval] = candle_store.CandleStore(self.market_stream, interval,
+                                                                        self.max_candles,
+                                                                        snapshots=_HubPublisher(self, interval))
+                self.candle_stores[interval].add_splice_listener(
+                    lambda symbol, since, interval=interval: self._on_splice(interval, symbol, since))
+                self.candle_stores[interval].start()
+            store = self.candle_stores[interval]
+            current_streams = set(self.market_stream.handlers)
+
+            new_symbols = [symbol for symbol in symbols if not symbol in store.buffers]
+            for symbol in new_symbols:
+                store.add_symbol(symbol)
+            wait(store.load_histories(new_symbols))
+
+            for symbol in symbols:
+                if not symbol in self.order_books.books:
+                    self.order_books.add_symbol(symbol)
+
+            ## New streams are subscribed on the open socket (the books sync on their first event).
+            new_streams = [stream for stream in self.market_stream.handlers if not stream in current_streams]
+            if new_streams:
+                logging.info('[DataHub] Now streaming %s streams.', len(self.market_stream.handlers))
+                self.market_stream.subscribe_live(new_streams)
+
+        for symbol in symbols:
+            client.topics.add(('kline', interval, symbol))
+            client.send(self._encode({'type': 'history', 'interval': interval, 'symbol': symbol,
+                                      'candles': store.get_candles(symbol)}))
+            self.depth_publisher.send_depth(client, symbol)
+
+    def broadcast(self, topic, message):
+        ''' Send a message to every client using the topic (encoded once for all of them). '''
+        data = None
+        for client in self.clients:
+            if topic in client.topics:
+                if data == None:
+                    data = self._encode(message)
+                client.send(data)
+
+    def _on_splice(self, interval, symbol, since):
+        ''' Forward backfilled candles so clients fill the same gap. '''
+        candles = [candle for candle in self.candle_stores[interval].get_candles(symbol) if candle[0] >= since]
+        self.broadcast(('kline', interval, symbol), {'type': 'splice', 'interval': interval, 'symbol': symbol,
+                                                     'candles': candles[::-1]})
+
+    def remove_client(self, client):
+        with self.client_lock:
+            if client in self.clients:
+                self.clients = [other for other in self.clients if other != client]
+
+    def _encode(self, message):
+        return ((json.dumps(message) + '\n').encode())
+
+
+class DataHubClient(object):
+    '''
+    Feeds a bot instances candle store and order books from a data hub in place of its own market streams.
+    -> Keeps the same last_data_recv_time/socketRunning as the market stream for the connection manager.
+    -> Reconnects and resubscribes (getting the full state again) if the hub connection drops.
+    '''
+
+    def __init__(self, socket_path, interval, candle_store, order_books):
+        self.socket_path = socket_path
+        self.interval = interval
+        self.candle_store = candle_store
+        self.order_books = order_books
+
+        self.symbols = []
+        self.sock = None
+        self.socketRunning = False
+        self.stop_requested = False
+        self.last_data_recv_time = 0
+
+    def add_symbol(self, symbol):
+        self.symbols.append(symbol)
+
+    def start(self):
+        self.stop_requested = False
+        threading.Thread(target=self._run).start()
+
+    def stop(self):
+        self.stop_requested = True
+        if self.sock:
+            self.sock.close()
+
+    def _run(self):
+        while not self.stop_requested:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.socket_path)
+                self.sock.sendall((json.dumps({'type': 'subscribe', 'interval': self.interval,
+                                               'symbols': self.symbols}) + '\n').encode())
+                self.socketRunning = True
+                logging.info('[DataHubClient] Connected to the data hub at %s.', self.socket_path)
+
+                for line in self.sock.makefile('r'):
+                    self.last_data_recv_time = time.time()
+
+                    ## A bad message is skipped so it can not stop the market data for every other symbol.
+                    try:
+                        self._on_message(json.loads(line))
+                    except Exception:
+                        logging.exception('[DataHubClient] Unable to handle data hub message: %.200s', line)
+
+            except (OSError, ValueError) as error:
+                logging.warning('[DataHubClient] Data hub connection failed: %s', error)
+
+            self.socketRunning = False
+            if not self.stop_requested:
+                time.sleep(1)
+
+    def _on_message(self, message):
+        if message['type'] == 'kline':
+            self.candle_store.add_candle(message['symbol'], message['candle'])
+
+        elif message['type'] == 'depth':
+            self.order_books.set_depth(message['symbol'], message['depth'])
+
+        elif message['type'] == 'depth_diff':
+            self.order_books.update_depth(message['symbol'], message)
+
+        elif message['type'] == 'history':
+            self.candle_store.set_history(message['symbol'], message['candles'])
+
+        elif message['type'] == 'splice':
+            self.candle_store.splice(message['symbol'], message['candles'])
+
+
+def start(settings):
+    ''' Run the data hub (from run.py hub). '''
+    DataHubServer(settings['data_hub'], settings['max_candles'], settings['max_depth']).start()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+import time
+import logging
+import threading
+from collections import deque
+
+## Window of recent fills used to project the fee usage.
+FEE_PROJECTION_WINDOW = 3600
+
+## How far ahead (in seconds) the fee usage is projected when checking the balance.
+FEE_LEAD_TIME = 900
+
+## Minimum time between top up orders.
+TOP_UP_DEBOUNCE = 60
+
+## Time after which a top up that was never seen on the account is no longer treated as pending.
+TOP_UP_PENDING_TIMEOUT = 120
+
+
+class FeeBalanceManager(object):
+    '''
+    Keeps the fee asset (e.g. BNB) topped up using the user data stream events.
+    -> The balance is taken from the wallet service and fees are tracked from executionReport fills.
+    -> A top up is placed when the balance minus the fees projected over FEE_LEAD_TIME falls below the threshold.
+    -> Only one top up can be pending at a time and top ups are at least TOP_UP_DEBOUNCE seconds apart.
+    '''
+
+    def __init__(self, rest_api, market_type, fee_asset, quote_asset, threshold, quantity):
+        self.rest_api = rest_api
+        self.market_type = market_type
+        self.fee_asset = fee_asset
+        self.symbol = '{0}{1}'.format(fee_asset, quote_asset)
+        self.threshold = threshold
+        self.quantity = quantity
+
+        self.balance = None
+        self.recent_fees = deque()
+
+        self.pending_order = None
+        self.pending_balance = None
+        self.last_top_up_time = 0
+        self.check_lock = threading.Lock()
+
+    def on_balance_change(self, asset, balance):
+        ''' Wallet service subscriber for the fee asset. '''
+        self.balance = balance[0]
+
+        ## The top up is done once the balance has risen above where it was when it was placed.
+        if self.pending_order != None and self.balance > self.pending_balance:
+            logging.info('[FeeBalanceManager] Top up of %s %s completed.', self.quantity, self.fee_asset)
+            self.pending_order = None
+
+        self.check_balance()
+
+    def on_execution_report(self, event):
+        ''' Handle an executionReport event, fills paid in the fee asset are used for the projection. '''
+        if event['s'] == self.symbol and event['i'] == self.pending_order and event['X'] in ['REJECTED', 'EXPIRED']:
+            self.pending_order = None
+            return
+
+        if event['x'] == 'TRADE' and event['N'] == self.fee_asset:
+            self.recent_fees.append((time.time(), float(event['n'])))
+
+            ## Account updates follow fills but project from the last known balance in the meantime.
+            if self.balance != None:
+                self.balance -= float(event['n'])
+            self.check_balance()
+
+    def projected_usage(self):
+        ''' Fees expected to be used over FEE_LEAD_TIME based on the fills in the last FEE_PROJECTION_WINDOW. '''
+        current_time = time.time()
+        while self.recent_fees and self.recent_fees[0][0] < current_time - FEE_PROJECTION_WINDOW:
+            self.recent_fees.popleft()
+
+        used_fees = sum([fee for fee_time, fee in self.recent_fees])
+        return ((used_fees / FEE_PROJECTION_WINDOW) * FEE_LEAD_TIME)
+
+    def check_balance(self):
+        ''' Top up the fee asset if the projected balance is below the threshold. '''
+        if self.balance == None:
+            return
+
+        with self.check_lock:
+            current_time = time.time()
+
+            if self.pending_order != None:
+                if current_time - self.last_top_up_time < TOP_UP_PENDING_TIMEOUT:
+                    return
+                logging.warning('[FeeBalanceManager] Top up order %s was not seen, clearing.', self.pending_order)
+                self.pending_order = None
+
+            if current_time - self.last_top_up_time < TOP_UP_DEBOUNCE:
+                return
+
+            if (self.balance - self.projected_usage()) >= self.threshold:
+                return
+
+            logging.info('[FeeBalanceManager] %s balance low (%s), buying %s.',
+                         self.fee_asset, self.balance, self.quantity)
+            self.last_top_up_time = current_time
+
+            try:
+                order = self.rest_api.place_order(self.market_type, symbol=self.symbol, side='BUY', type='MARKET',
+                                                  quantity=self.quantity)
+            except Exception as e:
+                logging.warning('[FeeBalanceManager] Top up order failed: %s.', e)
+                return
+
+            if 'code' in order:
+                logging.warning('[FeeBalanceManager] Top up order failed: %s.', order)
+                return
+
+            self.pending_order = order.get('orderId', True)
+            self.pending_balance = self.balance
@@ -0,0 +1,251 @@
+#! /usr/bin/env python3
+import math
+import logging
+import threading
+import patterns
+import technical_indicators as TI
+
+from . import kernels
+from . import indicator_state
+
+## Indicators that keep state between updates (created per key and updated incrementally).
+STATEFUL_INDICATORS = {
+    'patterns': patterns.PatternScanner,
+    'ema': indicator_state.EMAState,
+    'macd': indicator_state.MACDState
+}
+
+## Indicators computed by the array kernels (kernel(closes oldest first, *params)), the same as the backtests use.
+KERNEL_INDICATORS = {
+    'sma': kernels.sma,
+    'rma': kernels.rma,
+    'rsi': kernels.rsi
+}
+
+## Number of periods an exponential average is given to settle before its values are used.
+EMA_WARMUP_FACTOR = 5
+
+## Candles needed before the first usable value of an indicator (from its params).
+INDICATOR_WARMUP = {
+    'sma': lambda params: params[0],
+    'ema': lambda params: params[0] * EMA_WARMUP_FACTOR,
+    'rma': lambda params: params[0] * EMA_WARMUP_FACTOR,
+    'rsi': lambda params: (params[0] if params else 14) * EMA_WARMUP_FACTOR,
+    'macd': lambda params: ((params[1] if len(params) > 1 else 26) + (params[2] if len(params) > 2 else 9)) *
+                           EMA_WARMUP_FACTOR
+}
+
+
+def required_candles(indicator, lookback):
+    '''
+    Candles needed to compute an indicator (indicator, *params) for the last lookback values.
+    Returns None (all candles) for indicators without a known warmup or if no lookback is given.
+    '''
+    if lookback == None or not indicator[0] in INDICATOR_WARMUP:
+        return (None)
+    return (INDICATOR_WARMUP[indicator[0]](indicator[1:]) + lookback)
+
+
+def _candle_stamp(candles):
+    ''' Identifies a state of the candles (time/close of the live candle and the number of candles). '''
+    return ((candles[0][0], candles[0][4], len(candles)) if candles else None)
+
+
+class IndicatorService(object):
+    '''
+    Central indicator computation shared by all traders/charts.
+    -> Each series is keyed by (symbol, interval, indicator, params, limit) and computed once per candle update.
+    -> Results are shared by reference so consumers must treat them as read only.
+    -> Series are evicted once no subscriber is using them.
+    '''
+
+    def __init__(self):
+        self.cache = {}
+        self.states = {}
+        self.subscriptions = {}
+        self.subscriber_keys = {}
+        self.sub_lock = threading.Lock()
+
+    def get(self, symbol, interval, candles, name, params=(), limit=None, stamp=None, close_prices=None,
+            time_values=None):
+        '''
+        Get an indicator series computing it only if the candles have changed since the last call.
+        If limit is given only the newest limit candles are used.
+        '''
+        key = (symbol, interval, name, params, limit)
+        stamp = stamp if stamp != None else _candle_stamp(candles)
+
+        cached = self.cache.get(key)
+        if cached != None and cached[0] == stamp:
+            return (cached[1])
+
+        if limit != None:
+            candles = candles[:limit]
+            if close_prices != None:
+                time_values = time_values[:limit]
+                close_prices = close_prices[:limit]
+
+        if name in STATEFUL_INDICATORS:
+            if not key in self.states:
+                self.states[key] = STATEFUL_INDICATORS[name](*params)
+            result = self.states[key].update(candles)
+            self.cache[key] = (stamp, result)
+            return (result)
+
+        if close_prices == None:
+            time_values = [candle[0] for candle in candles]
+            close_prices = [candle[4] for candle in candles]
+
+        if name in KERNEL_INDICATORS:
+            values = KERNEL_INDICATORS[name](close_prices[::-1], *params)[::-1].tolist()
+            result = [[time, value] for time, value in zip(time_values, values) if not math.isnan(value)]
+        else:
+            indicator_function = getattr(TI, 'get_{0}'.format(name.upper()))
+            result = indicator_function(close_prices, *params, time_values=time_values, map_time=True)
+
+        self.cache[key] = (stamp, result)
+        return (result)
+
+    def view(self, symbol, interval, candles, subscriber=None, used_keys=None):
+        ''' Get a view bound to the current candles of a market (views can share a used_keys set). '''
+        return (IndicatorView(self, symbol, interval, candles, subscriber, used_keys))
+
+    def set_subscriptions(self, subscriber, keys):
+        ''' Set the keys a subscriber is using, any keys no longer used by anyone are evicted. '''
+        with self.sub_lock:
+            old_keys = self.subscriber_keys.get(subscriber, set())
+            if old_keys == keys:
+                return
+
+            for key in keys - old_keys:
+                self.subscriptions.setdefault(key, set()).add(subscriber)
+
+            for key in old_keys - keys:
+                self._remove_subscription(key, subscriber)
+
+            self.subscriber_keys[subscriber] = keys
+
+    def unsubscribe(self, subscriber):
+        ''' Remove all subscriptions held by a subscriber. '''
+        with self.sub_lock:
+            for key in self.subscriber_keys.pop(subscriber, set()):
+                self._remove_subscription(key, subscriber)
+
+    def invalidate(self, symbol, since=None):
+        '''
+        Drop any cached series for a symbol so they are recomputed on next use.
+        If since (candle open time) is given stateful indicators that support it are rewound to there instead.
+        -> Called from the backfill thread so it works over copies of the keys/states the traders may be adding to.
+        '''
+        for key in [key for key in list(self.cache) if key[0] == symbol]:
+            self.cache.pop(key, None)
+
+        for key, state in [(key, state) for key, state in list(self.states.items()) if key[0] == symbol]:
+            if since != None and hasattr(state, 'rewind'):
+                state.rewind(since)
+            else:
+                self.states.pop(key, None)
+
+    def export_states(self):
+        '''
+        Running state of the stateful indicators that support it as a JSON safe list.
+        -> Each entry is {'key':[symbol, interval, name, params, limit], 'state':{...}}.
+        '''
+        states = []
+        for key, state in list(self.states.items()):
+            if hasattr(state, 'export_state'):
+                states.append({'key': [key[0], key[1], key[2], list(key[3]), key[4]], 'state': state.export_state()})
+        return (states)
+
+    def restore_states(self, states):
+        ''' Restore states from export_states, they are rolled forward over any newer candles on their next use. '''
+        restored = 0
+        for entry in states:
+            symbol, interval, name, params, limit = entry['key']
+            key = (symbol, interval, name, tuple(params), limit)
+
+            if not name in STATEFUL_INDICATORS or key in self.states:
+                continue
+
+            try:
+                state = STATEFUL_INDICATORS[name](*key[3])
+                state.load_state(entry['state'])
+            except Exception:
+                logging.warning('[IndicatorService] Unable to restore indicator state %s.', key, exc_info=True)
+                continue
+
+            self.states[key] = state
+            restored += 1
+
+        logging.info('[IndicatorService] Restored %s indicator states.', restored)
+
+    def _remove_subscription(self, key, subscriber):
+        key_subscribers = self.subscriptions.get(key)
+        if key_subscribers == None:
+            return
+
+        key_subscribers.discard(subscriber)
+        if len(key_subscribers) == 0:
+            del self.subscriptions[key]
+            self.cache.pop(key, None)
+            self.states.pop(key, None)
+            logging.debug('[IndicatorService] Evicted unused indicator %s.', key)
+
+
+class IndicatorView(object):
+    ''' Indicator access for a single market update, tracks which series were used to keep subscriptions current. '''
+
+    def __init__(self, service, symbol, interval, candles, subscriber=None, used_keys=None):
+        self.service = service
+        self.symbol = symbol
+        self.interval = interval
+        self.candles = candles
+        self.subscriber = subscriber
+
+        self.stamp = _candle_stamp(candles)
+        self.used_keys = used_keys if used_keys != None else set()
+        self._time_values = None
+        self._close_prices = None
+
+    def get(self, name, *params, limit=None):
+        ''' Get an indicator e.g. get('ema', 200) or get('macd'), limit restricts it to the newest limit candles. '''
+        key = (self.symbol, self.interval, name, params, limit)
+        self.used_keys.add(key)
+
+        cached = self.service.cache.get(key)
+        if cached != None and cached[0] == self.stamp:
+            return (cached[1])
+
+        ## Price lists are only built once per view and only if something needs computing.
+        if self._close_prices == None:
+            self._time_values = [candle[0] for candle in self.candles]
+            self._close_prices = [candle[4] for candle in self.candles]
+
+        return (self.service.get(self.symbol, self.interval, self.candles, name, params, limit=limit,
+                                 stamp=self.stamp, close_prices=self._close_prices, time_values=self._time_values))
+
+    def get_declared(self, declared, lookback=None):
+        '''
+        Get the indicators declared by a strategy as {name:(indicator, *params), ...}.
+        Names with a '.' are nested e.g. 'ema.ema200':('ema', 200) gives {'ema':{'ema200':[...]}}.
+        If lookback (number of recent values used) is given each indicator is only computed over the candles it needs.
+        '''
+        indicators = {}
+        for name, indicator in declared.items():
+            series = self.get(indicator[0], *indicator[1:], limit=required_candles(indicator, lookback))
+
+            if isinstance(series, dict):
+                ## Stateful indicators (e.g. patterns) give a set of series.
+                indicators.update(series)
+            elif '.' in name:
+                group, sub_name = name.split('.', 1)
+                indicators.setdefault(group, {}).update({sub_name: series})
+            else:
+                indicators.update({name: series})
+
+        return (indicators)
+
+    def close(self):
+        ''' Update the subscriber with the series used during this view. '''
+        if self.subscriber != None:
+            self.service.set_subscriptions(self.subscriber, self.used_keys)
@@ -0,0 +1,251 @@
+#! /usr/bin/env python3
+'''
+Incremental indicators that keep their running state between updates (and across restarts).
+
+Each update only folds in the closed candles newer than the last one processed, the live candle (candles[0]) is
+computed from the running state without being committed. Series are returned like the technical indicators module
+newest first ([[time, value], ...] with a dict value for MACD).
+
+Cold starts (nothing folded in yet) over BULK_FOLD_MIN or more closed candles are folded in one go by the array
+kernels, giving the same state as folding them one at a time.
+
+The state can be exported to a JSON safe dict (export_state) and loaded back (load_state), a loaded state is rolled
+forward over only the candles newer than it on the next update.
+'''
+import threading
+from collections import deque
+
+from . import kernels
+
+## Closed candles needed on a cold start before they are folded in by the array kernels.
+BULK_FOLD_MIN = 64
+
+
+class _EMA(object):
+    ''' Running exponential average seeded with the simple average of the first period values. '''
+
+    def __init__(self, period):
+        self.period = period
+        self.multiplier = 2 / (period + 1)
+        self.value = None
+        self.seed = []
+
+    def commit(self, price):
+        if self.value == None:
+            self.seed.append(price)
+            if len(self.seed) == self.period:
+                self.value = sum(self.seed) / self.period
+                self.seed = []
+        else:
+            self.value = ((price - self.value) * self.multiplier) + self.value
+        return (self.value)
+
+    def peek(self, price):
+        ''' Value the average would have with price added (without adding it). '''
+        if self.value == None:
+            if len(self.seed) + 1 < self.period:
+                return (None)
+            return ((sum(self.seed) + price) / self.period)
+        return (((price - self.value) * self.multiplier) + self.value)
+
+    def export_state(self):
+        return ({'value': self.value, 'seed': list(self.seed)})
+
+    def load_state(self, state):
+        self.value = state['value']
+        self.seed = list(state['seed'])
+
+
+class IncrementalIndicator(object):
+    '''
+    Base for the incremental indicators, subclasses implement reset, _commit(price) and _peek(price) returning the
+    value for a price (or None while warming up) and _restore(value) to set the running state from a series value.
+    -> Subclasses can implement _fold_bulk(times, closes) to fold in a cold start at once (returns False if it can't).
+    '''
+
+    def __init__(self):
+        self.last_time = None
+        self.series = deque()
+        self.state_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.last_time = None
+        self.series = deque()
+
+    def update(self, candles):
+        ''' Fold in the newly closed candles and return the series including the live candle. '''
+        if not candles:
+            return ([])
+
+        with self.state_lock:
+            return (self._update(candles))
+
+    def _update(self, candles):
+        ## The state can only be rolled forward if the candles still reach back to it.
+        if self.last_time != None and (candles[-1][0] > self.last_time or self.last_time >= candles[0][0]):
+            self.reset()
+
+        index = 1
+        while index < len(candles) and (self.last_time == None or candles[index][0] > self.last_time):
+            index += 1
+
+        closed = candles[index - 1:0:-1]
+        if self.last_time == None and len(closed) >= BULK_FOLD_MIN and \
+                self._fold_bulk([candle[0] for candle in closed], [candle[4] for candle in closed]):
+            self.last_time = closed[-1][0]
+            closed = []
+
+        for candle in closed:
+            value = self._commit(candle[4])
+            self.last_time = candle[0]
+            if value != None:
+                self.series.appendleft([candle[0], value])
+
+        ## Only as much history as there are candles is kept.
+        while len(self.series) >= len(candles):
+            self.series.pop()
+
+        live_value = self._peek(candles[0][4])
+        return (([[candles[0][0], live_value]] if live_value != None else []) + list(self.series))
+
+    def _fold_bulk(self, times, closes):
+        return (False)
+
+    def rewind(self, since):
+        ''' Drop everything from since (candle open time) so those candles are folded in again on the next update. '''
+        with self.state_lock:
+            self._rewind(since)
+
+    def _rewind(self, since):
+        while self.series and self.series[0][0] >= since:
+            self.series.popleft()
+
+        if not self.series:
+            self.reset()
+            return
+
+        self.last_time = self.series[0][0]
+        self._restore(self.series[0][1])
+
+    def export_state(self):
+        ''' JSON safe copy of the running state (taken between updates so it is always consistent). '''
+        with self.state_lock:
+            return (self._export_state())
+
+    def _export_state(self):
+        return ({'last_time': self.last_time, 'series': list(self.series)})
+
+    def load_state(self, state):
+        self.last_time = state['last_time']
+        self.series = deque(state['series'])
+
+
+class EMAState(IncrementalIndicator):
+    ''' Exponential moving average e.g. EMAState(200). '''
+
+    def __init__(self, period):
+        self.period = period
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.ema = _EMA(self.period)
+
+    def _commit(self, price):
+        return (self.ema.commit(price))
+
+    def _peek(self, price):
+        return (self.ema.peek(price))
+
+    def _restore(self, value):
+        self.ema.value = value
+        self.ema.seed = []
+
+    def _fold_bulk(self, times, closes):
+        if len(closes) < self.period:
+            return (False)
+
+        start = self.period - 1
+        values = kernels.ema(closes, self.period).tolist()
+        self.series.extendleft([time, value] for time, value in zip(times[start:], values[start:]))
+        self._restore(values[-1])
+        return (True)
+
+    def _export_state(self):
+        state = super()._export_state()
+        state.update({'ema': self.ema.export_state()})
+        return (state)
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.ema.load_state(state['ema'])
+
+
+class MACDState(IncrementalIndicator):
+    ''' MACD with values as {'fast', 'slow', 'macd', 'signal', 'hist'} e.g. MACDState(12, 26, 9). '''
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.periods = (fast, slow, signal)
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.fast = _EMA(self.periods[0])
+        self.slow = _EMA(self.periods[1])
+        self.signal = _EMA(self.periods[2])
+
+    def _commit(self, price):
+        fast = self.fast.commit(price)
+        slow = self.slow.commit(price)
+        if slow == None:
+            return (None)
+
+        signal = self.signal.commit(fast - slow)
+        return (self._value(fast, slow, signal))
+
+    def _peek(self, price):
+        fast = self.fast.peek(price)
+        slow = self.slow.peek(price)
+        if slow == None:
+            return (None)
+
+        return (self._value(fast, slow, self.signal.peek(fast - slow)))
+
+    def _value(self, fast, slow, signal):
+        if signal == None:
+            return (None)
+        macd = fast - slow
+        return ({'fast': fast, 'slow': slow, 'macd': macd, 'signal': signal, 'hist': macd - signal})
+
+    def _restore(self, value):
+        for ema, name in [(self.fast, 'fast'), (self.slow, 'slow'), (self.signal, 'signal')]:
+            ema.value = value[name]
+            ema.seed = []
+
+    def _fold_bulk(self, times, closes):
+        start = self.periods[1] + self.periods[2] - 2
+        if len(closes) <= start:
+            return (False)
+
+        fast = kernels.ema(closes, self.periods[0])
+        slow = kernels.ema(closes, self.periods[1])
+        signal_line = kernels.macd(closes, *self.periods)[1]
+
+        columns = zip(times[start:], fast[start:].tolist(), slow[start:].tolist(), signal_line[start:].tolist())
+        for time, fast_value, slow_value, signal_value in columns:
+            self.series.appendleft([time, self._value(fast_value, slow_value, signal_value)])
+        self._restore(self.series[0][1])
+        return (True)
+
+    def _export_state(self):
+        state = super()._export_state()
+        state.update({'fast': self.fast.export_state(), 'slow': self.slow.export_state(),
+                      'signal': self.signal.export_state()})
+        return (state)
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.fast.load_state(state['fast'])
+        self.slow.load_state(state['slow'])
+        self.signal.load_state(state['signal'])
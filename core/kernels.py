@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+'''
+Array in/array out indicator and swing point kernels for bulk computation (backtests, sweeps, cold starts).
+
+Values are float arrays oldest first, outputs are the same length with NaN until the first value:
+    ema(values, period)                 = Exponential average (2/(period+1)) seeded with the SMA of the first period.
+    sma(values, period)                 = Simple average of the last period values.
+    rma(values, period)                 = Wilder's average (1/period) seeded with the SMA of the first period.
+    macd(values, fast, slow, signal)    = (macd, signal, hist), the signal is an ema of the macd from its first value.
+    rsi(values, period)                 = Wilder's RSI (0-100) seeded from the first period changes.
+    swing_points(highs, lows, window)   = (high indexes, low indexes) the same as patterns.find_swing_points.
+
+If numba is installed the kernels are JIT compiled loops (compiled on first use and cached), otherwise they run as
+vectorised numpy (the exponential averages are solved in closed form over blocks short enough to stay in range).
+'''
+import math
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+## If the JIT compiled kernels are used.
+JIT_ENABLED = numba != None
+
+## Max growth allowed of the decay powers within one block of the numpy exponential average.
+NUMPY_BLOCK_RANGE = 1e150
+
+
+def _recursive_average_loop(values, alpha, start, seed):
+    ## out[start] = seed, then out[i] = out[i - 1] + alpha * (values[i] - out[i - 1]).
+    out = np.full(len(values), np.nan)
+    out[start] = seed
+    last = seed
+    for index in range(start + 1, len(values)):
+        last = last + alpha * (values[index] - last)
+        out[index] = last
+    return (out)
+
+
+def _recursive_average_numpy(values, alpha, start, seed):
+    out = np.full(len(values), np.nan)
+    out[start] = seed
+    decay = 1.0 - alpha
+
+    if decay <= 0.0:
+        out[start + 1:] = values[start + 1:]
+        return (out)
+
+    ## Over a block y[i] = decay^(i+1) * y[-1] + alpha * decay^i * cumsum(x[j] / decay^j).
+    block_size = max(int(math.log(NUMPY_BLOCK_RANGE) / -math.log(decay)), 1)
+    powers = decay ** np.arange(block_size + 1)
+    inverse_powers = 1.0 / powers[:block_size]
+
+    last = seed
+    for block_start in range(start + 1, len(values), block_size):
+        block = values[block_start:block_start + block_size]
+        size = len(block)
+        scaled_sums = np.cumsum(block * inverse_powers[:size])
+        block_out = (powers[1:size + 1] * last) + (alpha * powers[:size] * scaled_sums)
+        out[block_start:block_start + size] = block_out
+        last = block_out[-1]
+    return (out)
+
+
+def _swing_points_loop(highs, lows, window):
+    ## A centre is a swing if nothing before it in the window is as extreme and nothing after it is more extreme.
+    size = len(highs)
+    high_flags = np.zeros(size, dtype=np.bool_)
+    low_flags = np.zeros(size, dtype=np.bool_)
+
+    for centre in range(window, size - window):
+        high = highs[centre]
+        is_high = True
+        for index in range(centre - window, centre + window + 1):
+            if (index < centre and highs[index] >= high) or (index > centre and highs[index] > high):
+                is_high = False
+                break
+        high_flags[centre] = is_high
+
+        low = lows[centre]
+        is_low = True
+        for index in range(centre - window, centre + window + 1):
+            if (index < centre and lows[index] <= low) or (index > centre and lows[index] < low):
+                is_low = False
+                break
+        low_flags[centre] = is_low
+
+    return (high_flags, low_flags)
+
+
+def _swing_points_numpy(highs, lows, window):
+    span = (window * 2) + 1
+    high_flags = np.zeros(len(highs), dtype=bool)
+    low_flags = np.zeros(len(lows), dtype=bool)
+
+    high_flags[window:len(highs) - window] = sliding_window_view(highs, span).argmax(axis=1) == window
+    low_flags[window:len(lows) - window] = sliding_window_view(lows, span).argmin(axis=1) == window
+    return (high_flags, low_flags)
+
+
+if JIT_ENABLED:
+    _recursive_average = numba.njit(cache=True)(_recursive_average_loop)
+    _swing_points = numba.njit(cache=True)(_swing_points_loop)
+else:
+    _recursive_average = _recursive_average_numpy
+    _swing_points = _swing_points_numpy
+    logging.debug('[Kernels] numba is not installed, using the numpy kernels.')
+
+
+def _as_array(values):
+    return (np.ascontiguousarray(values, dtype=np.float64))
+
+
+def ema(values, period):
+    values = _as_array(values)
+    if len(values) < period:
+        return (np.full(len(values), np.nan))
+    return (_recursive_average(values, 2.0 / (period + 1), period - 1, float(values[:period].mean())))
+
+
+def rma(values, period):
+    values = _as_array(values)
+    if len(values) < period:
+        return (np.full(len(values), np.nan))
+    return (_recursive_average(values, 1.0 / period, period - 1, float(values[:period].mean())))
+
+
+def sma(values, period):
+    values = _as_array(values)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return (out)
+
+    sums = np.cumsum(values)
+    out[period - 1] = sums[period - 1]
+    out[period:] = sums[period:] - sums[:-period]
+    out[period - 1:] /= period
+    return (out)
+
+
+def macd(values, fast=12, slow=26, signal=9):
+    values = _as_array(values)
+    macd_line = ema(values, fast) - ema(values, slow)
+
+    signal_line = np.full(len(values), np.nan)
+    if len(values) >= slow:
+        signal_line[slow - 1:] = ema(macd_line[slow - 1:], signal)
+    return (macd_line, signal_line, macd_line - signal_line)
+
+
+def rsi(values, period=14):
+    values = _as_array(values)
+    out = np.full(len(values), np.nan)
+    if len(values) <= period:
+        return (out)
+
+    changes = np.diff(values)
+    average_gain = rma(np.maximum(changes, 0.0), period)
+    average_loss = rma(np.maximum(-changes, 0.0), period)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[1:] = 100.0 - (100.0 / (1.0 + (average_gain / average_loss)))
+    out[1:][average_loss == 0.0] = 100.0
+    out[:period] = np.nan
+    return (out)
+
+
+def swing_points(highs, lows, window):
+    highs = _as_array(highs)
+    lows = _as_array(lows)
+    if len(highs) < (window * 2) + 1:
+        return (np.empty(0, dtype=int), np.empty(0, dtype=int))
+
+    high_flags, low_flags = _swing_points(highs, lows, window)
+    return (np.flatnonzero(high_flags), np.flatnonzero(low_flags))
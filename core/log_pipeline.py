@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+'''
+Non-blocking logging for the trading threads.
+
+Every record is put on a queue by the calling thread and handled by a single background writer:
+    -> Messages are only formatted by the writer (log with lazy %s args, never pre-formatted strings), records with
+       mutable args (lists, dicts, objects) are formatted when queued so later changes to them are not logged.
+    -> The writer is stopped at exit so every queued record is written.
+    -> Records from market loggers (get_market_logger) are also written as JSON lines to a rotating file per market
+       (<logs_dir>/markets/<market>.jsonl).
+    -> Repeats of the same message (template and args) for the same market below WARNING are limited to
+       RATE_LIMIT_COUNT per RATE_LIMIT_SECONDS.
+'''
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+## Max size of each market log file before it is rotated and the number of rotated files kept.
+MARKET_LOG_MAX_BYTES = 5 * 1024 * 1024
+MARKET_LOG_BACKUPS = 3
+
+## Max repeats of a message (per market) within the window, the rest are dropped and counted.
+RATE_LIMIT_SECONDS = 60
+RATE_LIMIT_COUNT = 5
+
+## Arg types left for the writer to format (anything else is formatted when the record is queued).
+IMMUTABLE_ARG_TYPES = (str, int, float, bool, bytes, type(None))
+
+## Listener for the queued records (None until setup).
+LISTENER = None
+
+
+class _NonFormattingQueueHandler(QueueHandler):
+    '''
+    Queues the record as is, the default handler formats the message in the calling thread.
+    -> Records with mutable args are the exception as the caller may change them before the writer gets to them.
+    '''
+
+    def prepare(self, record):
+        args = record.args.values() if isinstance(record.args, dict) else (record.args or ())
+        if not all(isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return (record)
+
+
+class _RateLimitFilter(logging.Filter):
+    '''
+    Drops repeats of a message below WARNING, the dropped count is added to the next one let through.
+    -> Records are grouped by market, message template and args.
+    -> Windows that have ended are pruned once per RATE_LIMIT_SECONDS so the seen messages do not grow unbounded.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.seen = {}
+        self.last_prune_time = time.time()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return (True)
+
+        current_time = time.time()
+        if current_time - self.last_prune_time >= RATE_LIMIT_SECONDS:
+            self._prune(current_time)
+
+        key = (getattr(record, 'market', None), record.msg, str(record.args))
+        window_start, count, dropped = self.seen.get(key, (current_time, 0, 0))
+
+        if current_time - window_start >= RATE_LIMIT_SECONDS:
+            window_start, count = current_time, 0
+
+        if count >= RATE_LIMIT_COUNT:
+            self.seen[key] = (window_start, count, dropped + 1)
+            return (False)
+
+        record.suppressed = dropped
+        self.seen[key] = (window_start, count + 1, 0)
+        return (True)
+
+    def _prune(self, current_time):
+        self.seen = {key: value for key, value in self.seen.items() if current_time - value[0] < RATE_LIMIT_SECONDS}
+        self.last_prune_time = current_time
+
+
+class _Listener(QueueListener):
+    ''' Applies the rate limit once per record before it is passed to the handlers. '''
+
+    def __init__(self, record_queue, *handlers):
+        super().__init__(record_queue, *handlers, respect_handler_level=True)
+        self.rate_limit = _RateLimitFilter()
+
+    def handle(self, record):
+        if self.rate_limit.filter(record):
+            super().handle(record)
+
+
+class _JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {'time': record.created, 'level': record.levelname, 'market': getattr(record, 'market', None),
+                'thread': record.threadName, 'message': record.getMessage()}
+
+        if getattr(record, 'suppressed', 0):
+            data.update({'suppressed': record.suppressed})
+        if record.exc_info:
+            data.update({'exception': self.formatException(record.exc_info)})
+        return (json.dumps(data, default=str))
+
+
+class _MarketFileHandler(logging.Handler):
+    ''' Routes market records to a rotating JSON lines file per market (opened on first use). '''
+
+    def __init__(self, market_dir):
+        super().__init__()
+        self.market_dir = market_dir
+        self.handlers = {}
+        self.json_formatter = _JsonFormatter()
+
+        if not os.path.exists(market_dir):
+            os.makedirs(market_dir, exist_ok=True)
+
+    def emit(self, record):
+        market = getattr(record, 'market', None)
+        if market == None:
+            return
+
+        if not market in self.handlers:
+            handler = RotatingFileHandler(os.path.join(self.market_dir, '{0}.jsonl'.format(market)),
+                                          maxBytes=MARKET_LOG_MAX_BYTES, backupCount=MARKET_LOG_BACKUPS)
+            handler.setFormatter(self.json_formatter)
+            self.handlers[market] = handler
+        self.handlers[market].handle(record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+def setup(logs_dir):
+    '''
+    Move the handlers already on the root logger (e.g. from basicConfig) behind the queue and add the market files.
+    -> Safe to call more than once, only the first call sets up the pipeline.
+    '''
+    global LISTENER
+    if LISTENER != None:
+        return
+
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    handlers.append(_MarketFileHandler(os.path.join(logs_dir, 'markets')))
+
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+
+    ## The queue is unbounded so a slow disk can never block a trading thread.
+    record_queue = queue.SimpleQueue()
+    root_logger.addHandler(_NonFormattingQueueHandler(record_queue))
+
+    LISTENER = _Listener(record_queue, *handlers)
+    LISTENER.start()
+    atexit.register(stop)
+
+
+def stop():
+    ''' Flush any queued records and stop the writer. '''
+    global LISTENER
+    if LISTENER != None:
+        LISTENER.stop()
+        LISTENER = None
+
+
+def get_market_logger(market, name='trader'):
+    ''' Logger for a market, its records carry the market so they are also written to the markets own file. '''
+    return (logging.LoggerAdapter(logging.getLogger(name), {'market': market}))
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+'''
+Immutable per-symbol market data shared with the trader threads.
+
+MarketSnapshot fields:
+    version             = Increases each time a new snapshot is published for the symbol.
+    candles             = Base interval candles (newest first).
+    timeframe_candles   = {timeframe:candles, ...} for the extra timeframes.
+    depth               = {'a':[[price, qty], ...], 'b':[...]} or None until the book is synced.
+    book_top            = (best bid, best ask) or None until the book is synced.
+    execution_report    = Last executionReport event seen for the symbol.
+    ticks               = Recent tick_stream.TickBatch's oldest first (trades/book ticker arrays with a sequence
+                          number) or None if tick streams are off.
+
+Wallets are not part of the snapshot (traders hold their pair from the wallet service) but a change
+to either asset of a symbol publishes a new version so its trader sees it.
+'''
+import threading
+from collections import namedtuple
+
+MarketSnapshot = namedtuple('MarketSnapshot', ['symbol', 'version', 'candles', 'timeframe_candles', 'depth',
+                                               'book_top', 'execution_report', 'ticks'])
+
+
+class SnapshotHub(object):
+    '''
+    Publishes a new MarketSnapshot for a symbol each time any of its data changes.
+    -> Writers build a new snapshot from the current one and swap it in, the old snapshot is never modified.
+    -> Readers just take the current snapshot (no locks or copies) and can compare versions to skip unchanged data.
+    -> Published values must not be modified after publishing (candle lists are replaced rather than updated).
+    '''
+
+    def __init__(self):
+        self.snapshots = {}
+        self.symbol_assets = {}
+        self.publish_lock = threading.Lock()
+
+    def add_symbol(self, symbol, base_asset, quote_asset):
+        self.symbol_assets.update({symbol: (base_asset, quote_asset)})
+        self.snapshots.update({symbol: MarketSnapshot(symbol, 0, [], {}, None, None, None, None)})
+
+    def get(self, symbol):
+        ''' The current snapshot for a symbol (None if the symbol is not being tracked). '''
+        return (self.snapshots.get(symbol))
+
+    def publish(self, symbol, **changes):
+        ''' Publish a new snapshot with the given fields changed. '''
+        with self.publish_lock:
+            current = self.snapshots[symbol]
+            self.snapshots[symbol] = current._replace(version=current.version + 1, **changes)
+
+    def on_execution_report(self, event):
+        ''' User data handler for executionReport events. '''
+        if event['s'] in self.snapshots:
+            self.publish(event['s'], execution_report=event)
+
+    def on_wallet_change(self, asset, balance):
+        ''' Wallet service subscriber, publishes a new version for every symbol using the asset. '''
+        for symbol, assets in self.symbol_assets.items():
+            if asset in assets:
+                self.publish(symbol)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+import json
+import time
+import logging
+import threading
+import websocket
+
+## Base url used for binance combined streams.
+BASE_STREAM_URL = 'wss://stream.binance.com:9443/stream?streams='
+
+
+class MarketStream(object):
+    '''
+    Combined stream socket for market data streams handled locally by the core.
+    -> Handlers are registered per stream name (e.g. ethbtc@depth@100ms) and are called with the data of each message.
+    -> Reconnect listeners are called each time the socket (re)opens so local state can be resynced.
+    -> Streams added after starting are subscribed on the open socket with subscribe_live() (or restart()).
+    -> Single streams that go quiet can be resubscribed without dropping the other streams.
+    '''
+
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.handlers = {}
+        self.reconnect_listeners = []
+
+        self.ws = None
+        self.request_id = 0
+        self.started = False
+        self.socketRunning = False
+        self.stop_requested = False
+
+        ## Last time any data was recieved and the last time per stream.
+        self.last_data_recv_time = 0
+        self.stream_recv_times = {}
+
+    def subscribe(self, stream, handler):
+        ''' Register a handler for a stream (after starting it is sent with subscribe_live() or restart()). '''
+        self.handlers.update({stream: handler})
+        self.stream_recv_times.update({stream: 0})
+
+    def add_reconnect_listener(self, listener):
+        ''' Register a callback that is called each time the socket opens. '''
+        self.reconnect_listeners.append(listener)
+
+    def start(self):
+        ''' Start the socket in its own thread. '''
+        if len(self.handlers) == 0:
+            return
+
+        self.started = True
+        self.stop_requested = False
+        threading.Thread(target=self._run).start()
+
+    def restart(self):
+        ''' Reconnect with the current set of streams (starts the socket if it is not running yet). '''
+        self._reset_recv_times()
+        if not self.started:
+            self.start()
+        elif self.ws:
+            self.ws.close()
+
+    def subscribe_live(self, streams):
+        '''
+        Subscribe streams registered after starting on the open socket without dropping the others.
+        -> Starts the socket if it is not started, a socket that is down picks them up when it reconnects.
+        '''
+        if not self.started:
+            self.start()
+            return
+
+        self._reset_recv_times(streams)
+        if self.ws and self.socketRunning:
+            self.request_id += 1
+            self.ws.send(json.dumps({'method': 'SUBSCRIBE', 'params': streams, 'id': self.request_id}))
+
+    def stale_streams(self, max_age):
+        ''' Streams that have not recieved any data for max_age seconds. '''
+        stale_time = time.time() - max_age
+        return ([stream for stream, recv_time in self.stream_recv_times.items() if recv_time < stale_time])
+
+    def resubscribe(self, streams):
+        ''' Unsubscribe and subscribe streams again on the open socket, returns False if the socket is not open. '''
+        if not (self.ws and self.socketRunning):
+            return (False)
+
+        for method in ['UNSUBSCRIBE', 'SUBSCRIBE']:
+            self.request_id += 1
+            self.ws.send(json.dumps({'method': method, 'params': streams, 'id': self.request_id}))
+
+        self._reset_recv_times(streams)
+        return (True)
+
+    def _reset_recv_times(self, streams=None):
+        ## Give (re)connected streams time to recieve data before they count as stale.
+        recv_time = time.time()
+        for stream in (streams if streams != None else list(self.stream_recv_times)):
+            self.stream_recv_times[stream] = recv_time
+
+    def stop(self):
+        ''' Stop the socket. '''
+        self.stop_requested = True
+        self.started = False
+        if self.ws:
+            self.ws.close()
+
+    def _run(self):
+        ''' Keep the socket running, reconnecting if it drops. '''
+        while not self.stop_requested:
+            url = BASE_STREAM_URL + '/'.join(self.handlers)
+            self.ws = websocket.WebSocketApp(url,
+                                             on_open=self._on_open,
+                                             on_message=self._on_message,
+                                             on_error=self._on_error,
+                                             on_close=self._on_close)
+            self.ws.run_forever()
+            self.socketRunning = False
+
+            if not self.stop_requested:
+                logging.warning('[MarketStream] Socket closed, reconnecting.')
+                time.sleep(1)
+
+    def _on_open(self, ws):
+        logging.info('[MarketStream] Socket opened with %s streams.', len(self.handlers))
+        self.socketRunning = True
+        self._reset_recv_times()
+
+        for listener in self.reconnect_listeners:
+            listener()
+
+    def _on_message(self, ws, message):
+        if self.recorder:
+            self.recorder.record('stream', message)
+
+        msg = json.loads(message)
+
+        if not 'stream' in msg:
+            return
+
+        recv_time = time.time()
+        self.last_data_recv_time = recv_time
+        self.stream_recv_times[msg['stream']] = recv_time
+
+        handler = self.handlers.get(msg['stream'])
+        if handler:
+            try:
+                handler(msg['data'])
+            except Exception:
+                logging.exception('[MarketStream] Handler failed for %s.', msg['stream'])
+
+    def _on_error(self, ws, error):
+        logging.warning('[MarketStream] Socket error: %s', error)
+
+    def _on_close(self, ws, *args):
+        self.socketRunning = False
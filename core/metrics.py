@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+'''
+Minimal metrics endpoint for a running bot core (usable without the web UI).
+
+GET /metrics returns the current values in the prometheus text format:
+    trader_runtime_state{market="BTC-ETH",state="RUN"} 1
+    trader_first_decision_seconds{market="BTC-ETH"} 1.25
+    capital_exposure 0.004
+    capital_open_positions 2
+    market_data_age_seconds 0.31
+'''
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def collect(core):
+    ''' Build the metrics text for a core object. '''
+    lines = []
+
+    for trader_ in core.trader_objects:
+        lines.append('trader_runtime_state{{market="{0}",state="{1}"}} 1'.format(
+            trader_.print_pair, trader_.state_data['runtime_state']))
+        if trader_.first_decision_time != None:
+            lines.append('trader_first_decision_seconds{{market="{0}"}} {1}'.format(
+                trader_.print_pair, trader_.first_decision_time))
+
+    lines.append('capital_exposure {0}'.format(core.capital_allocator.exposure()))
+    lines.append('capital_open_positions {0}'.format(len(core.capital_allocator.allocations)))
+
+    if core.market_stream.last_data_recv_time:
+        lines.append('market_data_age_seconds {0}'.format(time.time() - core.market_stream.last_data_recv_time))
+
+    return ('\n'.join(lines) + '\n')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = collect(self.server.core).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        ## Scrapes are not logged.
+        pass
+
+
+def start(core, host, port):
+    ''' Serve the metrics for a core object in a background thread. '''
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.core = core
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info('[Metrics] Serving metrics on http://%s:%s/metrics.', host, port)
+    return (server)
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+'''
+Signed order calls the binance_api REST object does not provide, added on a wrapper around it.
+
+    cancel_replace_order(trading_type, **params)    = Cancel an order and place its replacement in one request
+                                                      (SPOT only, POST /api/v3/order/cancelReplace). Returns the
+                                                      binance response, failures are {'code', 'msg', 'data'} where
+                                                      data has the cancelResult/newOrderResponse of each half.
+
+Every other attribute is taken from the wrapped binance_api object (it is used first if it has the call itself).
+'''
+import hmac
+import time
+import hashlib
+import logging
+from urllib.parse import urlencode
+
+import requests
+
+from . import public_api
+
+## Request weight of a cancel-replace.
+CANCEL_REPLACE_WEIGHT = 1
+
+## Time a signed request is valid for once sent (ms).
+RECV_WINDOW = 5000
+
+
+class OrderAPI(object):
+    def __init__(self, rest_api, public_key, private_key):
+        self.rest_api = rest_api
+        self.public_key = public_key
+        self.private_key = private_key
+
+    def __getattr__(self, name):
+        return (getattr(self.rest_api, name))
+
+    def cancel_replace_order(self, trading_type, **params):
+        if hasattr(self.rest_api, 'cancel_replace_order'):
+            return (self.rest_api.cancel_replace_order(trading_type, **params))
+
+        if trading_type != 'SPOT':
+            return ({'code': -1, 'msg': 'Cancel-replace is only available for SPOT orders.'})
+
+        return (self._signed_post('/api/v3/order/cancelReplace', params, CANCEL_REPLACE_WEIGHT))
+
+    def _signed_post(self, path, params, weight):
+        params = dict(params, recvWindow=RECV_WINDOW, timestamp=int(time.time() * 1000))
+        query = urlencode(params)
+        signature = hmac.new(self.private_key.encode(), query.encode(), hashlib.sha256).hexdigest()
+
+        public_api.WEIGHT_LIMITER.acquire(weight)
+        try:
+            response = public_api.SESSION.post('{0}{1}?{2}&signature={3}'.format(public_api.BASE_REST_URL, path, query,
+                                                                               signature),
+                                               headers={'X-MBX-APIKEY': self.public_key}, timeout=10)
+        except requests.RequestException as error:
+            logging.warning('[OrderAPI] %s request failed: %s', path, error)
+            return ({'code': -1, 'msg': str(error)})
+        public_api.WEIGHT_LIMITER.update(response)
+
+        data = response.json()
+        if 'code' in data:
+            logging.warning('[OrderAPI] %s returned error: %s', path, data)
+        return (data)
@@ -0,0 +1,327 @@
+#! /usr/bin/env python3
+import time
+import queue
+import logging
+import threading
+from bisect import bisect_left
+
+from . import public_api
+
+## Update speed used for the diff depth streams.
+DEPTH_UPDATE_SPEED = '100ms'
+
+## Depth requested for the REST snapshot used to sync a book, None uses the cheapest limit covering max_depth
+## (100 levels at weight 5 for the default max_depth, 1000 levels cost 50 so a resync of many books takes minutes).
+SNAPSHOT_LIMIT = None
+
+## Max levels kept per side (levels furthest from the top are trimmed).
+MAX_BOOK_LEVELS = 1000
+
+## Number of books that can be resynced at the same time (requests are paced by the public api weight limit).
+RESYNC_WORKERS = 8
+
+## Books for every symbol being maintained (keyed by symbol e.g. ETHBTC).
+LOCAL_BOOKS = {}
+
+
+def get_book(symbol):
+    ''' Get the local book for a symbol, accepts both ETHBTC and BTC-ETH formats. '''
+    if '-' in symbol:
+        quote, base = symbol.split('-')
+        symbol = base + quote
+    return (LOCAL_BOOKS.get(symbol))
+
+
+class LocalOrderBook(object):
+    '''
+    Order book for a single symbol built from a snapshot and kept up to date from diff depth events.
+
+    Price levels are held in sorted arrays with the best price at the end of each side:
+        bids are stored by ascending price and asks by ascending negative price,
+    this keeps best bid/ask reads O(1) and most updates (near the top of the book) cheap.
+    '''
+
+    def __init__(self, symbol, max_levels=MAX_BOOK_LEVELS):
+        self.symbol = symbol
+        self.max_levels = max_levels
+
+        self.bid_keys = []
+        self.bid_quantities = []
+        self.ask_keys = []
+        self.ask_quantities = []
+
+        ## Sequence tracking.
+        self.last_update_id = None
+        self.synced = False
+        self.last_event_time = 0
+
+    def is_ready(self):
+        return (self.last_update_id != None and len(self.bid_keys) > 0 and len(self.ask_keys) > 0)
+
+    def apply_snapshot(self, snapshot):
+        ''' Replace the book with a REST snapshot (lists are swapped in whole so readers never see a partial book). '''
+        bids = sorted([[float(price), float(qty)] for price, qty in snapshot['bids']])
+        asks = sorted([[-float(price), float(qty)] for price, qty in snapshot['asks']])
+
+        self.bid_keys, self.bid_quantities = [b[0] for b in bids], [b[1] for b in bids]
+        self.ask_keys, self.ask_quantities = [a[0] for a in asks], [a[1] for a in asks]
+
+        self.last_update_id = snapshot['lastUpdateId']
+        self.synced = False
+
+    def apply_diff(self, event):
+        '''
+        Apply a diff depth event.
+        Returns False if the event does not follow on from the book and a resync is required.
+        '''
+        if event['u'] <= self.last_update_id:
+            ## Event is already contained within the book.
+            return (True)
+
+        if not self.synced:
+            if event['U'] > self.last_update_id + 1:
+                return (False)
+            self.synced = True
+        elif event['U'] != self.last_update_id + 1:
+            return (False)
+
+        for price, qty in event['b']:
+            self._set_level(self.bid_keys, self.bid_quantities, float(price), float(qty))
+
+        for price, qty in event['a']:
+            self._set_level(self.ask_keys, self.ask_quantities, -float(price), float(qty))
+
+        self._trim(self.bid_keys, self.bid_quantities)
+        self._trim(self.ask_keys, self.ask_quantities)
+
+        self.last_update_id = event['u']
+        self.last_event_time = event['E']
+        return (True)
+
+    def apply_levels(self, bids, asks):
+        ''' Set changed levels ([[price, qty], ...], qty 0 removes the level) outside of the sequenced diffs. '''
+        for price, qty in bids:
+            self._set_level(self.bid_keys, self.bid_quantities, float(price), float(qty))
+
+        for price, qty in asks:
+            self._set_level(self.ask_keys, self.ask_quantities, -float(price), float(qty))
+
+    def _set_level(self, keys, quantities, key, qty):
+        index = bisect_left(keys, key)
+
+        if index < len(keys) and keys[index] == key:
+            if qty == 0:
+                del keys[index]
+                del quantities[index]
+            else:
+                quantities[index] = qty
+        elif qty != 0:
+            keys.insert(index, key)
+            quantities.insert(index, qty)
+
+    def _trim(self, keys, quantities):
+        ## The worst levels are always at the front of each side.
+        extra = len(keys) - self.max_levels
+        if extra > 0:
+            del keys[:extra]
+            del quantities[:extra]
+
+    def best_bid(self):
+        return (self.bid_keys[-1] if self.bid_keys else None)
+
+    def best_ask(self):
+        return (-self.ask_keys[-1] if self.ask_keys else None)
+
+    def mid_price(self):
+        if not (self.bid_keys and self.ask_keys):
+            return (None)
+        return ((self.bid_keys[-1] - self.ask_keys[-1]) / 2)
+
+    def spread(self):
+        if not (self.bid_keys and self.ask_keys):
+            return (None)
+        return (-self.ask_keys[-1] - self.bid_keys[-1])
+
+    def get_depth(self, limit):
+        ''' Return the top levels in the same layout as the socket depth ({'a':[[price, qty], ...], 'b':[...]}). '''
+        bids = [[price, qty] for price, qty in zip(self.bid_keys[-limit:], self.bid_quantities[-limit:])]
+        asks = [[-key, qty] for key, qty in zip(self.ask_keys[-limit:], self.ask_quantities[-limit:])]
+        bids.reverse()
+        asks.reverse()
+        return ({'a': asks, 'b': bids})
+
+    def vwap(self, side, quantity):
+        '''
+        Average fill price for a market order of quantity (BUY consumes asks, SELL consumes bids).
+        Returns None if the book does not hold enough quantity.
+        '''
+        if side == 'BUY':
+            keys, quantities, sign = self.ask_keys, self.ask_quantities, -1
+        else:
+            keys, quantities, sign = self.bid_keys, self.bid_quantities, 1
+
+        remaining = quantity
+        cost = 0.0
+        for index in range(len(keys) - 1, -1, -1):
+            fill = quantities[index] if quantities[index] < remaining else remaining
+            cost += fill * keys[index] * sign
+            remaining -= fill
+            if remaining <= 0:
+                return (cost / quantity)
+        return (None)
+
+    def depth_within(self, percent):
+        ''' Total quantity on each side within percent of the best price. '''
+        depth = {'b': 0.0, 'a': 0.0}
+
+        if self.bid_keys:
+            floor_price = self.bid_keys[-1] * (1 - (percent / 100))
+            depth['b'] = sum(self.bid_quantities[bisect_left(self.bid_keys, floor_price):])
+
+        if self.ask_keys:
+            ceiling_key = self.ask_keys[-1] * (1 + (percent / 100))
+            depth['a'] = sum(self.ask_quantities[bisect_left(self.ask_keys, ceiling_key):])
+
+        return (depth)
+
+    def imbalance(self, levels=10):
+        ''' Volume imbalance of the top levels between -1 (all asks) and 1 (all bids). '''
+        bid_volume = sum(self.bid_quantities[-levels:])
+        ask_volume = sum(self.ask_quantities[-levels:])
+        total_volume = bid_volume + ask_volume
+        return ((bid_volume - ask_volume) / total_volume if total_volume else 0.0)
+
+
+class OrderBookManager(object):
+    '''
+    Maintains local order books for multiple symbols from the diff depth streams.
+    -> Events that arrive before a book is synced are buffered.
+    -> Books are (re)synced from a REST snapshot by a pool of worker threads whenever a sequence gap is seen.
+    -> If a snapshot hub is given the top max_depth levels are published to it on every book change.
+    -> Snapshots only cover the top snapshot_limit levels, deeper levels are only those the diffs have since touched.
+    '''
+
+    def __init__(self, market_stream, max_depth, snapshots=None, recorder=None):
+        self.market_stream = market_stream
+        self.snapshots = snapshots
+        self.recorder = recorder
+        self.max_depth = max_depth
+        self.snapshot_limit = SNAPSHOT_LIMIT if SNAPSHOT_LIMIT else next(
+            (max_limit for max_limit, weight in public_api.DEPTH_WEIGHTS if max_depth <= max_limit),
+            public_api.DEPTH_WEIGHTS[-1][0])
+
+        self.books = {}
+        self.pending_events = {}
+        self.resyncing = set()
+        self.resync_queue = queue.Queue()
+        self.book_lock = threading.Lock()
+
+        ## Without a market stream the books are set from depth fed in (e.g. by a data hub client).
+        if market_stream != None:
+            market_stream.add_reconnect_listener(self.resync_all)
+
+    def add_symbol(self, symbol):
+        ''' Setup a book for a symbol and subscribe to its diff depth stream. '''
+        self.books.update({symbol: LocalOrderBook(symbol)})
+        self.pending_events.update({symbol: []})
+        LOCAL_BOOKS.update({symbol: self.books[symbol]})
+
+        if self.market_stream != None:
+            stream = '{0}@depth@{1}'.format(symbol.lower(), DEPTH_UPDATE_SPEED)
+            self.market_stream.subscribe(stream, lambda event, symbol=symbol: self._on_depth_event(symbol, event))
+
+    def start(self):
+        ''' Start the resync workers. '''
+        for _ in range(RESYNC_WORKERS):
+            threading.Thread(target=self._resync_worker).start()
+
+    def resync_all(self):
+        with self.book_lock:
+            for symbol in self.books:
+                self._request_resync(symbol)
+
+    def get_depth(self, symbol):
+        ''' Depth endpoint used by the traders (None until the book is synced). '''
+        book = self.books.get(symbol)
+        if book == None or not book.is_ready():
+            return (None)
+        return (book.get_depth(self.max_depth))
+
+    def get_book(self, symbol):
+        return (self.books.get(symbol))
+
+    def set_depth(self, symbol, depth):
+        ''' Replace a book with the given levels ({'a':[[price, qty], ...], 'b':[...]}) from another source. '''
+        with self.book_lock:
+            self.books[symbol].apply_snapshot({'lastUpdateId': 0, 'bids': depth['b'], 'asks': depth['a']})
+            self._publish(symbol)
+
+    def update_depth(self, symbol, changes):
+        ''' Apply changed levels ({'a':[[price, qty], ...], 'b':[...]}, qty 0 removes a level) from another source. '''
+        with self.book_lock:
+            self.books[symbol].apply_levels(changes['b'], changes['a'])
+            self._publish(symbol)
+
+    def _on_depth_event(self, symbol, event):
+        with self.book_lock:
+            if symbol in self.resyncing:
+                self.pending_events[symbol].append(event)
+                return
+
+            if self.books[symbol].last_update_id == None or not self.books[symbol].apply_diff(event):
+                logging.debug('[OrderBookManager] Book out of sequence, resyncing. [%s]', symbol)
+                self.pending_events[symbol] = [event]
+                self._request_resync(symbol)
+                return
+
+            self._publish(symbol)
+
+    def _publish(self, symbol):
+        book = self.books[symbol]
+        if self.snapshots != None and book.is_ready():
+            self.snapshots.publish(symbol, depth=book.get_depth(self.max_depth),
+                                   book_top=(book.best_bid(), book.best_ask()))
+
+    def _request_resync(self, symbol):
+        if not symbol in self.resyncing:
+            self.resyncing.add(symbol)
+            self.resync_queue.put(symbol)
+
+    def _resync_worker(self):
+        while True:
+            symbol = self.resync_queue.get()
+
+            try:
+                snapshot = public_api.get_depth(symbol, self.snapshot_limit)
+            except Exception as error:
+                logging.warning('[OrderBookManager] Failed to get snapshot for %s: %s', symbol, error)
+                snapshot = None
+
+            if snapshot == None or not 'lastUpdateId' in snapshot:
+                time.sleep(1)
+                self.resync_queue.put(symbol)
+                continue
+
+            if self.recorder:
+                self.recorder.record('snapshot', {'symbol': symbol, 'snapshot': snapshot})
+
+            if not self.sync_from_snapshot(symbol, snapshot):
+                self.resync_queue.put(symbol)
+
+    def sync_from_snapshot(self, symbol, snapshot):
+        ''' Sync a book from a depth snapshot and the buffered events, False if they do not line up. '''
+        with self.book_lock:
+            book = self.books[symbol]
+            book.apply_snapshot(snapshot)
+
+            ## Replay buffered events, if any of them do not line up then a new snapshot is needed.
+            for event in self.pending_events[symbol]:
+                if not book.apply_diff(event):
+                    ## Buffered events are kept on failure as they may line up with the next snapshot.
+                    return (False)
+
+            self.pending_events[symbol] = []
+            self.resyncing.discard(symbol)
+            self._publish(symbol)
+            logging.debug('[OrderBookManager] Book synced. [%s]', symbol)
+            return (True)
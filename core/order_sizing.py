@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+'''
+Order sizing against the market rules and the current depth.
+
+rules   : The market rules passed to the trader (STEP_VALUE, TICK_VALUE, MINIMUM_NOTATION).
+levels  : Depth side as [[price, quantity], ...] with the best price first.
+
+All walking of the book is done with floats, Decimal is only used for the final rounding so
+quantities/prices are exact multiples of the step/tick and never carry float formatting artifacts.
+'''
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+
+def round_to_step(value, step, rounding=ROUND_DOWN):
+    ''' Round a value to a multiple of step (returns a Decimal). '''
+    step = Decimal(str(step))
+    return ((Decimal(str(value)) / step).to_integral_value(rounding) * step).quantize(step)
+
+
+def format_quantity(quantity, rules):
+    ''' Quantity rounded down to the LOT_SIZE step as a plain string. '''
+    return (format(round_to_step(quantity, rules['STEP_VALUE']).normalize(), 'f'))
+
+
+def format_price(price, rules):
+    ''' Price rounded to the nearest TICK_SIZE as a plain string. '''
+    return (format(round_to_step(price, rules['TICK_VALUE'], ROUND_HALF_UP).normalize(), 'f'))
+
+
+def estimate_fill(levels, notional=None, quantity=None, max_slippage=None):
+    '''
+    Walk a side of the book to estimate the fill for either a notional (quote) amount or a quantity.
+    If max_slippage (fraction e.g. 0.002) is given the fill stops at the level that would exceed it.
+    Returns (quantity, average price, slippage vs the top of book), or None if the book is empty.
+    '''
+    if not levels:
+        return (None)
+
+    top_price = float(levels[0][0])
+    filled_qty = 0.0
+    filled_cost = 0.0
+
+    for price, level_qty in levels:
+        price = float(price)
+        level_qty = float(level_qty)
+
+        if max_slippage != None and abs(price - top_price) / top_price > max_slippage:
+            break
+
+        if notional != None:
+            take_qty = min(level_qty, (notional - filled_cost) / price)
+        else:
+            take_qty = min(level_qty, quantity - filled_qty)
+
+        filled_qty += take_qty
+        filled_cost += take_qty * price
+
+        if (notional != None and filled_cost >= notional) or (quantity != None and filled_qty >= quantity):
+            break
+
+    ## If the visible depth is not enough assume the remainder fills at the last level seen.
+    if max_slippage == None:
+        if notional != None and filled_cost < notional:
+            filled_qty += (notional - filled_cost) / price
+            filled_cost = notional
+        elif quantity != None and filled_qty < quantity:
+            filled_cost += (quantity - filled_qty) * price
+            filled_qty = quantity
+
+    if filled_qty == 0:
+        return (None)
+
+    avg_price = filled_cost / filled_qty
+    return (filled_qty, avg_price, abs(avg_price - top_price) / top_price)
+
+
+def size_order(side, rules, depth, notional=None, quantity=None, price=None, max_slippage=None):
+    '''
+    Size an order.
+    -> BUY orders are sized from a notional amount, SELL orders from a quantity.
+    -> Market orders (no price) are estimated by walking the depth, limit orders use their price.
+    Returns a dict of the quantity (string), the estimated price/slippage and if min notional is met.
+    '''
+    levels = None
+    if depth:
+        levels = depth['a'] if side == 'BUY' else depth['b']
+
+    slippage = 0.0
+    if price != None:
+        est_price = float(price)
+        est_qty = (notional / est_price) if notional != None else quantity
+    else:
+        fill = estimate_fill(levels, notional=notional, quantity=quantity, max_slippage=max_slippage)
+        if fill == None:
+            return (None)
+        est_qty, est_price, slippage = fill
+
+        ## SELL quantities are what is held, only BUY sizes are capped by the slippage.
+        if side == 'SELL':
+            est_qty = quantity
+
+    f_quantity = format_quantity(est_qty, rules)
+
+    return ({
+        'quantity': f_quantity,
+        'price': est_price,
+        'slippage': slippage,
+        'valid': (float(f_quantity) * est_price) >= rules['MINIMUM_NOTATION']})
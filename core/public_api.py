@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+import time
+import logging
+import threading
+import requests
+
+## Base url for the public (unsigned) binance market data endpoints.
+BASE_REST_URL = 'https://api.binance.com'
+
+## Shared session so connections are kept alive between calls.
+SESSION = requests.Session()
+
+## Request weight these calls may use per minute (kept under binance's 6000 so signed calls still have room).
+REQUEST_WEIGHT_BUDGET = 4800
+
+## Weight of a depth request by its limit [(max limit, weight), ...].
+DEPTH_WEIGHTS = [(100, 5), (500, 25), (1000, 50), (5000, 250)]
+
+## Weight of a klines request.
+KLINES_WEIGHT = 2
+
+
+class _WeightLimiter(object):
+    '''
+    Keeps the request weight used within binance's 1 minute window under the budget.
+    -> Callers block until their request fits in the current window (safe to use from many threads).
+    -> The used weight reported by binance is taken over when higher (other calls from the same IP count too).
+    -> After a 429/418 no requests are made until the Retry-After time has passed.
+    '''
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.window = None
+        self.used = 0
+        self.blocked_until = 0
+        self.limit_lock = threading.Lock()
+
+    def acquire(self, weight):
+        while True:
+            with self.limit_lock:
+                current_time = time.time()
+                window = int(current_time // 60)
+                if window != self.window:
+                    self.window = window
+                    self.used = 0
+
+                if current_time >= self.blocked_until:
+                    if self.used + weight <= self.budget:
+                        self.used += weight
+                        return
+                    wait_time = ((window + 1) * 60) - current_time
+                else:
+                    wait_time = self.blocked_until - current_time
+
+            time.sleep(wait_time)
+
+    def update(self, response):
+        used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+
+        with self.limit_lock:
+            if used_weight != None and int(time.time() // 60) == self.window:
+                self.used = max(self.used, int(used_weight))
+
+            if response.status_code in [418, 429]:
+                retry_after = int(response.headers.get('Retry-After', 60))
+                self.blocked_until = time.time() + retry_after
+                logging.warning('[PublicAPI] Request weight limit hit, backing off for %ss.', retry_after)
+
+
+WEIGHT_LIMITER = _WeightLimiter(REQUEST_WEIGHT_BUDGET)
+
+
+def get_depth(symbol, limit=1000):
+    ''' Get a depth snapshot for a symbol (used to sync local order books). '''
+    weight = next((weight for max_limit, weight in DEPTH_WEIGHTS if limit <= max_limit), DEPTH_WEIGHTS[-1][1])
+    return (_public_get('/api/v3/depth', {'symbol': symbol, 'limit': limit}, weight))
+
+
+def get_klines(symbol, interval, limit=500, startTime=None, endTime=None):
+    ''' Get klines for a symbol formatted as candles ([[time, open, high, low, close, volume], ...] newest first). '''
+    params = {'symbol': symbol, 'interval': interval, 'limit': limit}
+    if startTime != None:
+        params.update({'startTime': startTime})
+    if endTime != None:
+        params.update({'endTime': endTime})
+
+    klines = _public_get('/api/v3/klines', params, KLINES_WEIGHT)
+    if 'code' in klines:
+        return ([])
+
+    candles = [[kline[0], float(kline[1]), float(kline[2]), float(kline[3]), float(kline[4]), float(kline[5])] for
+               kline in klines]
+    candles.reverse()
+    return (candles)
+
+
+def _public_get(path, params, weight):
+    ''' Make a GET request against a public binance endpoint and return the json data. '''
+    while True:
+        WEIGHT_LIMITER.acquire(weight)
+        response = SESSION.get(BASE_REST_URL + path, params=params, timeout=10)
+        WEIGHT_LIMITER.update(response)
+
+        ## Rate limited requests are retried once the limiter allows it again.
+        if not response.status_code in [418, 429]:
+            break
+    data = response.json()
+
+    if 'code' in data:
+        logging.warning('[PublicAPI] %s returned error: %s', path, data)
+
+    return (data)
+
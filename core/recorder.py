@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+'''
+Recording and replay of the market data seen by the core.
+
+Records are written as JSON lines [time, source, data] to gzip segment files (<record_dir>/market_<start time>.jsonl.gz):
+    'stream'    = Raw combined stream message (kline/depth events).
+    'history'   = {'symbol':symbol, 'candles':[...], 'timeframe_candles':{timeframe:[...], ...}} candle history
+                  loaded at startup (timeframe_candles is missing from older recordings).
+    'snapshot'  = {'symbol':symbol, 'snapshot':{...}} depth snapshot used to sync a book.
+    'splice'    = {'symbol':symbol, 'candles':[...]} candles backfilled after a stream gap.
+    'user'      = {'type':event type, 'event':{...}} user data event (executionReport, outboundAccountPosition).
+'''
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+## Length of each segment file before a new one is started.
+SEGMENT_SECONDS = 3600
+
+## Max time records are held before being flushed to the segment file.
+FLUSH_INTERVAL = 1
+
+## Max time to wait on exit for the queued records to be written.
+STOP_TIMEOUT = 10
+
+
+class MarketRecorder(object):
+    '''
+    Records inbound market data to compressed append only segment files.
+    -> record() only queues the data, encoding/compression/writing is done by the writer thread.
+    -> Segments are closed and a new one started every SEGMENT_SECONDS so a segment is never rewritten.
+    -> The recorder is stopped on exit so the records still queued are written and the open segment is closed.
+    '''
+
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        self.record_queue = queue.Queue()
+        self.running = False
+        self.writer = None
+
+        if not os.path.exists(record_dir):
+            os.makedirs(record_dir, exist_ok=True)
+
+    def start(self):
+        self.running = True
+        self.writer = threading.Thread(target=self._writer, daemon=True)
+        self.writer.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        ''' Write out the queued records and close the segment (waits up to STOP_TIMEOUT). '''
+        if not self.running:
+            return
+
+        self.running = False
+        self.record_queue.put(None)
+        self.writer.join(STOP_TIMEOUT)
+
+    def record(self, source, data):
+        self.record_queue.put((time.time(), source, data))
+
+    def _writer(self):
+        segment = None
+        segment_start = 0
+        last_flush = time.time()
+
+        while True:
+            try:
+                record = self.record_queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                record = False
+
+            if record == None:
+                break
+
+            if record:
+                if segment == None or record[0] - segment_start >= SEGMENT_SECONDS:
+                    if segment:
+                        segment.close()
+                    segment_start = record[0]
+                    segment_path = os.path.join(self.record_dir, 'market_{0}.jsonl.gz'.format(int(segment_start)))
+                    segment = gzip.open(segment_path, 'at')
+                    logging.info('[MarketRecorder] Recording to %s.', segment_path)
+
+                segment.write(json.dumps(record) + '\n')
+
+            if segment and time.time() - last_flush >= FLUSH_INTERVAL:
+                segment.flush()
+                last_flush = time.time()
+
+        if segment:
+            segment.close()
+
+
+def read_records(record_dir):
+    ''' Read every record from the segments in a record dir in the order they were recorded. '''
+    segment_paths = glob.glob(os.path.join(record_dir, 'market_*.jsonl.gz'))
+    segment_paths.sort(key=lambda path: int(os.path.basename(path).split('_')[1].split('.')[0]))
+
+    for segment_path in segment_paths:
+        with gzip.open(segment_path, 'rt') as segment:
+            for line in segment:
+                try:
+                    yield (json.loads(line))
+                except ValueError:
+                    ## The last line of a segment can be cut short if the recorder was stopped mid write.
+                    logging.warning('[MarketReplay] Skipping a damaged record in %s.', segment_path)
+
+
+class MarketReplay(object):
+    '''
+    Feeds recorded market data back through the core in place of the market stream.
+    -> Stream messages go to the same handlers as live (so candles/books are rebuilt the same way).
+    -> speed is a multiple of the recorded rate (1 = as recorded), 0 replays as fast as possible.
+    -> If a sync function is given it is waited on after each record so every trader sees every update.
+    '''
+
+    def __init__(self, record_dir, speed, candle_store, order_books, snapshots, sync=None):
+        self.record_dir = record_dir
+        self.speed = speed
+        self.candle_store = candle_store
+        self.order_books = order_books
+        self.snapshots = snapshots
+        self.sync = sync
+
+        self.handlers = {}
+        self.stream_recv_times = {}
+        self.reconnect_listeners = []
+
+        self.socketRunning = False
+        self.stop_requested = False
+        self.last_data_recv_time = 0
+
+    def subscribe(self, stream, handler):
+        self.handlers.update({stream: handler})
+        self.stream_recv_times.update({stream: 0})
+
+    def add_reconnect_listener(self, listener):
+        ## Books are synced from the recorded snapshots so there is nothing to resync.
+        pass
+
+    def start(self):
+        self.stop_requested = False
+        threading.Thread(target=self._run).start()
+
+    def restart(self):
+        pass
+
+    def stop(self):
+        self.stop_requested = True
+
+    def _run(self):
+        logging.info('[MarketReplay] Replaying market data from %s.', self.record_dir)
+        self.socketRunning = True
+        first_record_time = None
+        start_time = time.time()
+        replayed = 0
+
+        for record_time, source, data in read_records(self.record_dir):
+            if self.stop_requested:
+                break
+
+            if first_record_time == None:
+                first_record_time = record_time
+
+            if self.speed > 0:
+                wait_time = ((record_time - first_record_time) / self.speed) - (time.time() - start_time)
+                if wait_time > 0:
+                    time.sleep(wait_time)
+
+            self.last_data_recv_time = time.time()
+            self._replay_record(source, data)
+            replayed += 1
+
+            if self.sync:
+                self.sync()
+
+        self.socketRunning = False
+        logging.info('[MarketReplay] Replay finished, %s records in %.2fs.', replayed, time.time() - start_time)
+
+    def _replay_record(self, source, data):
+        if source == 'stream':
+            msg = json.loads(data)
+            handler = self.handlers.get(msg['stream'])
+            if handler:
+                self.stream_recv_times[msg['stream']] = self.last_data_recv_time
+                handler(msg['data'])
+
+        elif source == 'history':
+            if data['symbol'] in self.candle_store.buffers:
+                self.candle_store.set_history(data['symbol'], data['candles'], data.get('timeframe_candles'))
+
+        elif source == 'splice':
+            if data['symbol'] in self.candle_store.buffers:
+                self.candle_store.splice(data['symbol'], data['candles'])
+
+        elif source == 'snapshot':
+            if data['symbol'] in self.order_books.books:
+                self.order_books.sync_from_snapshot(data['symbol'], data['snapshot'])
+
+        elif source == 'user':
+            if data['type'] == 'executionReport':
+                self.snapshots.on_execution_report(data['event'])
@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+'''
+Declarative strategy rules compiled once for all markets (each market evaluates its own row on its update).
+
+Operands:
+    'open', 'high', 'low', 'close', 'volume'    = Candle values.
+    'price', 'buy_price'                        = Last market price (the previous close as the previous value) and
+                                                  the price of the current BUY.
+    'macd.hist', 'ema.ema200'                   = Indicator values as returned by technical_indicators.
+    numbers                                     = Constant values.
+
+Rules:
+    compare(a, op, b)       = a op b where op is one of <, <=, >, >=, ==, !=.
+    crosses_above(a, b)     = a has moved from at or below b to above b.
+    crosses_below(a, b)     = a has moved from at or above b to below b.
+    stop_loss(percent)      = price has fallen percent below the buy price.
+    take_profit(percent)    = price has risen percent above the buy price.
+    any_of(*rules)          = Any of the given rules.
+
+A RuleSet passes when all of its rules pass and gives the order to place, e.g.
+    LONG_ENTRY_RULES = RuleSet([crosses_above('macd.macd', 'macd.signal')],
+        {'side':'BUY', 'description':'Long entry signal', 'order_type':'MARKET'})
+'''
+import logging
+import operator
+import numpy as np
+
+COMPARE_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq,
+                     '!=': operator.ne}
+
+CANDLE_FIELDS = {'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5}
+
+## Names of the rule sets a strategy can declare and the condition they replace.
+RULE_SET_NAMES = {
+    'LONG_ENTRY_RULES': ('LONG', 'BUY'),
+    'LONG_EXIT_RULES': ('LONG', 'SELL'),
+    'SHORT_ENTRY_RULES': ('SHORT', 'BUY'),
+    'SHORT_EXIT_RULES': ('SHORT', 'SELL')}
+
+
+class Rule(object):
+    ''' A single rule, operands are resolved to feature columns when the rule is compiled. '''
+
+    def __init__(self, kind, operands, param=None):
+        self.kind = kind
+        self.operands = operands
+        self.param = param
+
+    def compile(self, column):
+        ''' Return a function of the feature array (markets, features, 2) giving a bool per market. '''
+        if self.kind == 'any':
+            compiled_rules = [rule.compile(column) for rule in self.operands]
+            return (lambda features: np.logical_or.reduce([rule(features) for rule in compiled_rules]))
+
+        values = [_operand_values(operand, column) for operand in self.operands]
+
+        if self.kind == 'compare':
+            compare = COMPARE_OPERATORS[self.param]
+            return (lambda features: compare(values[0](features, 0), values[1](features, 0)))
+
+        elif self.kind == 'crosses_above':
+            return (lambda features: (values[0](features, 1) <= values[1](features, 1)) &
+                                     (values[0](features, 0) > values[1](features, 0)))
+
+        elif self.kind == 'crosses_below':
+            return (lambda features: (values[0](features, 1) >= values[1](features, 1)) &
+                                     (values[0](features, 0) < values[1](features, 0)))
+
+        elif self.kind == 'stop_loss':
+            ratio = 1 - (self.param / 100)
+            return (lambda features: values[0](features, 0) <= values[1](features, 0) * ratio)
+
+        elif self.kind == 'take_profit':
+            ratio = 1 + (self.param / 100)
+            return (lambda features: values[0](features, 0) >= values[1](features, 0) * ratio)
+
+        raise ValueError('Unknown rule type {0}'.format(self.kind))
+
+    def get_operands(self):
+        if self.kind == 'any':
+            return ([operand for rule in self.operands for operand in rule.get_operands()])
+        return ([operand for operand in self.operands if not isinstance(operand, (int, float))])
+
+
+def compare(a, op, b):
+    return (Rule('compare', [a, b], op))
+
+
+def crosses_above(a, b):
+    return (Rule('crosses_above', [a, b]))
+
+
+def crosses_below(a, b):
+    return (Rule('crosses_below', [a, b]))
+
+
+def stop_loss(percent):
+    return (Rule('stop_loss', ['price', 'buy_price'], percent))
+
+
+def take_profit(percent):
+    return (Rule('take_profit', ['price', 'buy_price'], percent))
+
+
+def any_of(*rules):
+    return (Rule('any', list(rules)))
+
+
+class RuleSet(object):
+    def __init__(self, rules, order):
+        self.rules = rules
+        self.order = order
+
+
+def _operand_values(operand, column):
+    if isinstance(operand, (int, float)):
+        return (lambda features, offset: operand)
+    index = column[operand]
+    return (lambda features, offset: features[:, index, offset])
+
+
+def _operand_getter(operand):
+    ''' Build a function that reads an operand value at an offset (0 = current, 1 = previous) for one market. '''
+    if operand in CANDLE_FIELDS:
+        field = CANDLE_FIELDS[operand]
+        return (lambda indicators, candles, prices, position, offset: candles[offset][field])
+
+    if operand == 'price':
+        return (lambda indicators, candles, prices, position, offset:
+                prices['lastPrice'] if offset == 0 else candles[offset][4])
+
+    if operand == 'buy_price':
+        return (lambda indicators, candles, prices, position, offset: position['buy_price'] or np.nan)
+
+    if '.' in operand:
+        name, sub_name = operand.split('.', 1)
+
+        def get_sub_value(indicators, candles, prices, position, offset):
+            indicator = indicators[name]
+            ## Multi depth indicators are {sub_name:[values]} others are [{sub_name:value}, ...]
+            if isinstance(indicator, dict):
+                return (indicator[sub_name][offset])
+            return (indicator[offset][sub_name])
+
+        return (get_sub_value)
+
+    return (lambda indicators, candles, prices, position, offset: indicators[operand][offset])
+
+
+class RuleEngine(object):
+    '''
+    Evaluates the declared rule sets of a strategy for all markets with the same compiled (array) rules.
+    -> Each trader writes the values its rules need into its row of the feature array and the rules are then run
+       over that row in the same call, so a signal is always from the features of that update.
+    '''
+
+    def __init__(self, strategy, symbols):
+        self.rule_sets = {}
+        for attr_name, condition in RULE_SET_NAMES.items():
+            rule_set = getattr(strategy, attr_name, None)
+            if rule_set != None:
+                self.rule_sets.update({condition: rule_set})
+
+        self.rows = {symbol: row for row, symbol in enumerate(symbols)}
+
+        operands = []
+        for rule_set in self.rule_sets.values():
+            for rule in rule_set.rules:
+                for operand in rule.get_operands():
+                    if not operand in operands:
+                        operands.append(operand)
+
+        self.column = {operand: index for index, operand in enumerate(operands)}
+        self.getters = [_operand_getter(operand) for operand in operands]
+        self.features = np.full((len(symbols), len(operands), 2), np.nan)
+
+        self.compiled = {condition: [rule.compile(self.column) for rule in rule_set.rules] for condition, rule_set in
+                         self.rule_sets.items()}
+        self.signals = {condition: np.zeros(len(symbols), dtype=bool) for condition in self.rule_sets}
+
+        logging.info('[RuleEngine] Compiled %s rule sets using %s features for %s markets.',
+                     len(self.rule_sets), len(operands), len(symbols))
+
+    def has_rules(self, market_type, side):
+        return ((market_type, side) in self.rule_sets)
+
+    def update_features(self, symbol, indicators, candles, prices, position):
+        ''' Write the current and previous value of every operand for a market then evaluate its rule sets. '''
+        row_index = self.rows[symbol]
+        row = self.features[row_index]
+
+        for index, getter in enumerate(self.getters):
+            try:
+                row[index, 0] = getter(indicators, candles, prices, position, 0)
+                row[index, 1] = getter(indicators, candles, prices, position, 1)
+            except (KeyError, IndexError, TypeError):
+                row[index] = np.nan
+
+        self._evaluate(slice(row_index, row_index + 1))
+
+    def _evaluate(self, rows):
+        features = self.features[rows]
+        with np.errstate(invalid='ignore'):
+            for condition, rules in self.compiled.items():
+                signal = np.ones(len(features), dtype=bool)
+                for rule in rules:
+                    signal &= rule(features)
+                self.signals[condition][rows] = signal
+
+    def get_order(self, symbol, market_type, side):
+        ''' The order for a market if its rule set currently signals, otherwise WAIT. '''
+        if self.signals[(market_type, side)][self.rows[symbol]]:
+            return (dict(self.rule_sets[(market_type, side)].order))
+        return ({'order_type': 'WAIT'})
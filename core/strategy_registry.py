@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+import os
+import logging
+import threading
+import importlib.util
+import trader_configuration as TC
+
+## Name used for the strategy in trader_configuration.py.
+DEFAULT_STRATEGY = 'default'
+
+
+class StrategyRegistry(object):
+    '''
+    Loads strategy modules and hot-reloads them when their file changes.
+    -> 'default' is trader_configuration.py, any other name is loaded from <strategies_dir>/<name>.py.
+    -> A module that fails to load is reported and the last working version is kept.
+    -> Listeners are called with (name, module) after a strategy has been reloaded.
+    '''
+
+    def __init__(self, strategies_dir):
+        self.strategies_dir = strategies_dir
+        self.modules = {DEFAULT_STRATEGY: TC}
+        self.paths = {DEFAULT_STRATEGY: TC.__file__}
+        self.mtimes = {DEFAULT_STRATEGY: os.path.getmtime(TC.__file__)}
+        self.reload_listeners = []
+        self.load_lock = threading.Lock()
+
+    def get(self, name):
+        ''' Get a strategy module loading it if it has not been loaded yet (None if it can not be loaded). '''
+        if not name in self.modules:
+            path = os.path.join(self.strategies_dir, '{0}.py'.format(name))
+
+            if not os.path.exists(path):
+                logging.warning('[StrategyRegistry] Strategy %s not found at %s.', name, path)
+                return (None)
+
+            with self.load_lock:
+                module = self._load_module(name, path)
+                if module == None:
+                    return (None)
+
+                self.modules.update({name: module})
+                self.paths.update({name: path})
+                self.mtimes.update({name: os.path.getmtime(path)})
+
+        return (self.modules[name])
+
+    def add_reload_listener(self, listener):
+        self.reload_listeners.append(listener)
+
+    def check_reload(self):
+        ''' Reload any strategies whose files have changed since they were loaded. '''
+        for name, path in list(self.paths.items()):
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+
+            if mtime == self.mtimes[name]:
+                continue
+
+            self.mtimes[name] = mtime
+            with self.load_lock:
+                module = self._load_module(name, path)
+
+            if module == None:
+                continue
+
+            self.modules[name] = module
+            logging.info('[StrategyRegistry] Reloaded strategy %s.', name)
+
+            for listener in self.reload_listeners:
+                listener(name, module)
+
+    def _load_module(self, name, path):
+        try:
+            spec = importlib.util.spec_from_file_location('strategy_{0}'.format(name), path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception:
+            logging.exception('[StrategyRegistry] Failed to load strategy %s.', name)
+            return (None)
+
+        logging.info('[StrategyRegistry] Loaded strategy %s from %s.', name, path)
+        return (module)
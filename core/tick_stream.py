@@ -0,0 +1,177 @@
+#! /usr/bin/env python3
+'''
+Tick level market data (aggTrade/bookTicker streams) micro-batched into fixed size arrays.
+
+Each tick is written straight into preallocated float64 arrays (a row per tick) so nothing is kept per tick, every
+batch interval the filled rows are copied out as a TickBatch:
+    trades      = [[trade time, price, quantity, buyer is maker (1/0)], ...] oldest first.
+    book        = [[update id, bid price, bid quantity, ask price, ask quantity], ...] oldest first.
+    time        = Time the batch was published.
+    sequence    = Number of the batch for its symbol (increases by one per batch).
+
+The last TICK_BATCH_HISTORY batches of a symbol are published to the snapshots (oldest first) so a reader can pick
+up every batch since the last one it saw with batches_since().
+'''
+import time
+import logging
+import threading
+import numpy as np
+from collections import namedtuple, deque
+
+TickBatch = namedtuple('TickBatch', ['trades', 'book', 'time', 'sequence'])
+
+## Columns of the trade/book tick arrays.
+TRADE_TIME, TRADE_PRICE, TRADE_QUANTITY, TRADE_BUYER_MAKER = range(4)
+BOOK_UPDATE_ID, BOOK_BID_PRICE, BOOK_BID_QUANTITY, BOOK_ASK_PRICE, BOOK_ASK_QUANTITY = range(5)
+
+## Rows held per symbol for each stream (a full batch is published early rather than growing the arrays).
+TICK_BATCH_SIZE = 4096
+
+## Default interval between batches (in ms).
+DEFAULT_BATCH_MS = 250
+
+## Batches held per symbol for the snapshots (a reader that falls further behind misses the oldest).
+TICK_BATCH_HISTORY = 64
+
+
+def batches_since(batches, sequence=None):
+    ''' Merge the batches newer than sequence (all if None) into one TickBatch, None if there are none. '''
+    new_batches = [batch for batch in batches if sequence == None or batch.sequence > sequence]
+    if not new_batches:
+        return (None)
+
+    if len(new_batches) == 1:
+        return (new_batches[0])
+
+    return (TickBatch(np.concatenate([batch.trades for batch in new_batches]),
+                      np.concatenate([batch.book for batch in new_batches]),
+                      new_batches[-1].time, new_batches[-1].sequence))
+
+
+class _TickBuffer(object):
+    '''
+    Preallocated rows for one symbol/stream, filled by the stream thread and emptied into each batch.
+    -> Rows are held flat (row * columns + column) as plain indexing of a 1d array is the cheapest per tick write.
+    '''
+
+    def __init__(self, columns, size):
+        self.values = np.zeros(size * columns)
+        self.columns = columns
+        self.size = size
+        self.count = 0
+
+    def take(self):
+        ''' Copy out the filled rows (the copy is what is published so the rows can be reused). '''
+        batch = self.values[:self.count * self.columns].reshape(self.count, self.columns).copy()
+        self.count = 0
+        return (batch)
+
+
+class TickStream(object):
+    '''
+    Per market aggTrade/bookTicker streams batched every batch_ms.
+    -> The recent batches are published to the snapshots as ticks (a tuple of TickBatch oldest first).
+    -> Batch listeners are called with (symbol, batch) for each batch holding trades (e.g. to fill test orders).
+    '''
+
+    def __init__(self, market_stream, snapshots, batch_ms=None):
+        self.market_stream = market_stream
+        self.snapshots = snapshots
+        self.batch_interval = (batch_ms if batch_ms else DEFAULT_BATCH_MS) / 1000
+
+        self.trade_buffers = {}
+        self.book_buffers = {}
+        self.sequences = {}
+        self.histories = {}
+        self.batch_listeners = []
+        self.buffer_lock = threading.Lock()
+        self.running = False
+
+    def add_batch_listener(self, listener):
+        self.batch_listeners.append(listener)
+
+    def add_symbol(self, symbol):
+        ''' Setup the tick buffers for a symbol and subscribe to its trade/book ticker streams. '''
+        self.trade_buffers.update({symbol: _TickBuffer(4, TICK_BATCH_SIZE)})
+        self.book_buffers.update({symbol: _TickBuffer(5, TICK_BATCH_SIZE)})
+        self.sequences.update({symbol: 0})
+        self.histories.update({symbol: deque(maxlen=TICK_BATCH_HISTORY)})
+
+        self.market_stream.subscribe('{0}@aggTrade'.format(symbol.lower()),
+                                     lambda event, symbol=symbol: self._on_trade(symbol, event))
+        self.market_stream.subscribe('{0}@bookTicker'.format(symbol.lower()),
+                                     lambda event, symbol=symbol: self._on_book_ticker(symbol, event))
+
+    def start(self):
+        ''' Start publishing the batches in its own thread. '''
+        if self.running:
+            return
+
+        self.running = True
+        threading.Thread(target=self._run).start()
+
+    def stop(self):
+        self.running = False
+
+    def _on_trade(self, symbol, event):
+        with self.buffer_lock:
+            buffer = self.trade_buffers[symbol]
+            values = buffer.values
+            offset = buffer.count * 4
+            values[offset + TRADE_TIME] = event['T']
+            values[offset + TRADE_PRICE] = float(event['p'])
+            values[offset + TRADE_QUANTITY] = float(event['q'])
+            values[offset + TRADE_BUYER_MAKER] = event['m']
+            buffer.count += 1
+
+            if buffer.count < buffer.size:
+                return
+            batch, recent = self._take_batch(symbol)
+        self._publish(symbol, batch, recent)
+
+    def _on_book_ticker(self, symbol, event):
+        with self.buffer_lock:
+            buffer = self.book_buffers[symbol]
+            values = buffer.values
+            offset = buffer.count * 5
+            values[offset + BOOK_UPDATE_ID] = event['u']
+            values[offset + BOOK_BID_PRICE] = float(event['b'])
+            values[offset + BOOK_BID_QUANTITY] = float(event['B'])
+            values[offset + BOOK_ASK_PRICE] = float(event['a'])
+            values[offset + BOOK_ASK_QUANTITY] = float(event['A'])
+            buffer.count += 1
+
+            if buffer.count < buffer.size:
+                return
+            batch, recent = self._take_batch(symbol)
+        self._publish(symbol, batch, recent)
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.batch_interval)
+
+            for symbol in list(self.trade_buffers):
+                with self.buffer_lock:
+                    if not (self.trade_buffers[symbol].count or self.book_buffers[symbol].count):
+                        continue
+                    batch, recent = self._take_batch(symbol)
+                self._publish(symbol, batch, recent)
+
+    def _take_batch(self, symbol):
+        ## Called with the buffer lock held (listeners/snapshots are then called without it).
+        self.sequences[symbol] += 1
+        batch = TickBatch(self.trade_buffers[symbol].take(), self.book_buffers[symbol].take(), time.time(),
+                          self.sequences[symbol])
+        self.histories[symbol].append(batch)
+        return (batch, tuple(self.histories[symbol]))
+
+    def _publish(self, symbol, batch, recent):
+        if len(batch.trades):
+            for listener in self.batch_listeners:
+                try:
+                    listener(symbol, batch)
+                except Exception:
+                    logging.exception('[TickStream] Batch listener failed for %s.', symbol)
+
+        if self.snapshots != None:
+            self.snapshots.publish(symbol, ticks=recent)
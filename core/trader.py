@@ -1,60 +1,51 @@
 #! /usr/bin/env python3
 import os
 import sys
-import copy
 import time
-import logging
+import inspect
 import datetime
 import threading
 import trader_configuration as TC
 
-MULTI_DEPTH_INDICATORS = ['ema', 'sma', 'rma']
+from . import order_sizing
+from . import trader_state
+from . import log_pipeline
+from . import capital_allocator
+from . import trigger_engine
+from . import tick_stream
+
+MULTI_DEPTH_INDICATORS = ['ema', 'sma', 'rma', 'patterns_data_points', 'patterns_data_lines']
 
 # Base commission fee with binance.
 COMMISION_FEE = 0.00075
 
-# Base layout for market pricing.
-BASE_TRADE_PRICE_LAYOUT = {
-    'lastPrice': 0,  # Last price seen for the market.
-    'askPrice': 0,  # Last ask price seen for the market.
-    'bidPrice': 0  # Last bid price seen for the market.
-}
-
-# Base layout for trader state.
-BASE_STATE_LAYOUT = {
-    'base_currency': 0.0,  # The base mac value used as referance.
-    'force_sell': False,  # If the trader should dump all tokens.
-    'runtime_state': None,  # The state that actual trader object is at.
-    'last_update_time': 0  # The last time a full look of the trader was completed.
-}
-
-# Base layout used by the trader.
-BASE_MARKET_LAYOUT = {
-    'can_order': True,  # If the bot is able to trade in the current market.
-    'price': 0.0,  # The price related to BUY.
-    'buy_price': 0.0,  # Buy price of the asset.
-    'stopPrice': 0.0,  # The stopPrice relate
-    'stopLimitPrice': 0.0,  # The stopPrice relate
-    'tokens_holding': 0.0,  # Amount of tokens being held.
-    'order_point': None,  # Used to visulise complex stratergy progression points.
-    'order_id': None,  # The ID that is tied to the placed order.
-    'order_status': 0,  # The type of the order that is placed
-    'order_side': 'BUY',  # The status of the current order.
-    'order_type': 'WAIT',  # Used to show the type of order (SIGNAL/STOP-LOSS/WAIT)
-    'order_description': 0,  # The description of the order.
-    'order_market_type': None,  # The market type of the order placed.
-    'market_status': None  # Last state the market trader is.
-}
-
-# Market extra required data.
-TYPE_MARKET_EXTRA = {
-    'loan_cost': 0,  # Loan cost.
-    'loan_id': None,  # Loan id.
-}
+# Cached optional keyword arguments accepted by strategy functions.
+STRATEGY_FUNCTION_ARGS = {}
+
+# Order types that can be amended in place (cancel-replace) when only the price moves.
+AMENDABLE_ORDER_TYPES = ['LIMIT', 'STOP_LOSS_LIMIT']
+
+# Order issue returned when the sized quantity is not valid for the market (same code binance gives a filter failure).
+INVALID_QUANTITY_ISSUE = {'code': -1013, 'msg': 'Order quantity is below the minimum notional.'}
+
+# Wait between checks for a new market snapshot when nothing has changed.
+SNAPSHOT_WAIT_INTERVAL = 0.05
+
+
+def call_strategy_function(function, *args, **optional_kwargs):
+    ''' Call a strategy function only passing the optional keyword args it accepts (keeps older strategies working). '''
+    if not function in STRATEGY_FUNCTION_ARGS:
+        STRATEGY_FUNCTION_ARGS[function] = set(inspect.signature(function).parameters)
+
+    accepted_args = STRATEGY_FUNCTION_ARGS[function]
+    return (function(*args, **{key: value for key, value in optional_kwargs.items() if key in accepted_args}))
 
 
 class BaseTrader(object):
-    def __init__(self, quote_asset, base_asset, rest_api, socket_api=None, data_if=None):
+    def __init__(self, quote_asset, base_asset, rest_api, socket_api=None, data_if=None, order_books=None,
+                 indicator_service=None, candle_interval=None, candle_store=None, snapshots=None,
+                 wallet_service=None, capital_allocator=None, trigger_engine=None, replay=False,
+                 pass_condition=None):
         # Initilize the main trader object.
         symbol = '{0}{1}'.format(base_asset, quote_asset)
 
@@ -63,49 +54,93 @@ class BaseTrader(object):
         self.quote_asset = quote_asset
         self.base_asset = base_asset
 
-        logging.info('[BaseTrader][{0}] Initilizing trader object and empty attributes.'.format(self.print_pair))
+        ## Records from the trader carry its market (written to the markets own log file).
+        self.logger = log_pipeline.get_market_logger(self.print_pair)
+
+        self.logger.info('[BaseTrader][%s] Initilizing trader object and empty attributes.', self.print_pair)
 
         ## Sets the rest api that will be used by the trader.
         self.rest_api = rest_api
 
         if socket_api == None and data_if == None:
-            logging.critical(
-                '[BaseTrader][{0}] Initilization failed, bot must have either socket_api OR data_if set.'.format(
-                    self.print_pair))
+            self.logger.critical(
+                '[BaseTrader][%s] Initilization failed, bot must have either socket_api OR data_if set.',
+                self.print_pair)
             return
 
         ## Setup socket/data interface.
         self.data_if = None
         self.socket_api = None
+        self.snapshots = None
+        self.snapshot_version = None
+        self.start_time = None
+        self.first_decision_time = None
 
         if socket_api:
             ### Setup socket for live market data trading.
             self.candle_enpoint = socket_api.get_live_candles
             self.depth_endpoint = socket_api.get_live_depths
             self.socket_api = socket_api
+
+            ### Use the locally maintained order books/candles if available.
+            if order_books:
+                self.depth_endpoint = order_books.get_depth
+            if candle_store:
+                self.candle_enpoint = candle_store.get_candles
+            ### Market data is read from the published snapshots if available.
+            self.snapshots = snapshots
         else:
             ### Setup data interface for past historic trading.
             self.data_if = data_if
             self.candle_enpoint = data_if.get_candle_data
             self.depth_endpoint = data_if.get_depth_data
 
+        ## Shared indicator computation and the extra timeframe candles.
+        self.indicator_service = indicator_service
+        self.candle_interval = candle_interval
+        self.candle_store = candle_store
+
+        ## Strategy used by the trader (can be swapped by the core when strategies are reloaded).
+        self.strategy_name = 'default'
+        self.strategy = TC
+
+        ## Shared wallet balances (the wallet pair is then updated by the service) and the portfolio allocator.
+        self.wallet_service = wallet_service
+        self.capital_allocator = capital_allocator
+
+        ## Rule engine used if the strategy declares its conditions as rules (set by the core).
+        self.rule_engine = None
+
+        ## Trigger engine holding the resting test orders (without one test orders are checked against the last price).
+        self.trigger_engine = trigger_engine
+        self.capital_renewed = False
+
+        ## Replays run each pass without pausing and notify the pass condition once a snapshot is handled.
+        self.replay = replay
+        self.pass_condition = pass_condition
+
         ## Setup the default path for the trader by market beeing traded.
         self.orders_log_path = 'logs/order_{0}_log.txt'.format(symbol)
         self.configuration = {}
-        self.market_prices = {}
+        self.market_prices = trader_state.MarketPrices()
+        self.market_depth = None
         self.wallet_pair = None
         self.custom_conditional_data = {}
         self.indicators = {}
-        self.market_activity = {}
+        self.timeframe_candles = {}
+        self.ticks = None
+        self.tick_sequence = None
+        self.invalid_quantity = None
+        self.market_activity = None
         self.trade_recorder = []
-        self.state_data = {}
+        self.state_data = trader_state.StateData()
         self.rules = {}
 
-        logging.debug('[BaseTrader][{0}] Initilized trader object.'.format(self.print_pair))
+        self.logger.debug('[BaseTrader][%s] Initilized trader object.', self.print_pair)
 
     def setup_initial_values(self, trading_type, run_type, filters):
         # Initilize trader values.
-        logging.info('[BaseTrader][{0}] Initilizing trader object attributes with data.'.format(self.print_pair))
+        self.logger.info('[BaseTrader][%s] Initilizing trader object attributes with data.', self.print_pair)
 
         ## Populate required settings.
         self.configuration.update({
@@ -118,14 +153,12 @@ class BaseTrader(object):
         self.rules.update(filters)
 
         ## Initilize default values.
-        self.market_activity.update(copy.deepcopy(BASE_MARKET_LAYOUT))
-        self.market_prices.update(copy.deepcopy(BASE_TRADE_PRICE_LAYOUT))
-        self.state_data.update(copy.deepcopy(BASE_STATE_LAYOUT))
-
         if trading_type == 'MARGIN':
-            self.market_activity.update(copy.deepcopy(TYPE_MARKET_EXTRA))
+            self.market_activity = trader_state.MarginMarketActivity()
+        else:
+            self.market_activity = trader_state.MarketActivity()
 
-        logging.debug('[BaseTrader][{0}] Initilized trader attributes with data.'.format(self.print_pair))
+        self.logger.debug('[BaseTrader][%s] Initilized trader attributes with data.', self.print_pair)
 
     def start(self, MAC, wallet_pair, open_orders=None):
         '''
@@ -135,18 +168,11 @@ class BaseTrader(object):
             If a recent, not closed traded is seen, or leftover currency on the account over the min to place order then set trader to sell automatically.
         
         ->  Start the trader thread. 
-            Once all is good the trader will then start the thread to allow for the market to be monitored.
+            The thread waits for the markets own data so each trader starts as soon as its market is ready.
         '''
-        logging.info('[BaseTrader][{0}] Starting the trader object.'.format(self.print_pair))
-        sock_symbol = self.base_asset + self.quote_asset
-
-        if self.socket_api != None:
-            while True:
-                if self.socket_api.get_live_candles()[sock_symbol] and (
-                        'a' in self.socket_api.get_live_depths()[sock_symbol]):
-                    break
-
-        self.state_data['runtime_state'] = 'SETUP'
+        self.logger.info('[BaseTrader][%s] Starting the trader object.', self.print_pair)
+        self.start_time = time.time()
+        self.state_data['runtime_state'] = None
         self.wallet_pair = wallet_pair
         self.state_data['base_currency'] = float(MAC)
 
@@ -154,17 +180,48 @@ class BaseTrader(object):
         threading.Thread(target=self._main).start()
         return (True)
 
+    def _wait_for_data(self, sock_symbol):
+        ''' Wait until the candles and depth for the market exist, returns False if stopped in the meantime. '''
+        while self.state_data['runtime_state'] != 'STOP':
+            if self.snapshots != None:
+                snapshot = self.snapshots.get(sock_symbol)
+                if snapshot.candles and snapshot.depth:
+                    return (True)
+
+            elif self.socket_api != None:
+                books_data = self.depth_endpoint(sock_symbol)
+                if self.candle_enpoint(sock_symbol) and books_data and 'a' in books_data:
+                    return (True)
+            else:
+                return (True)
+
+            time.sleep(.1)
+        return (False)
+
     def stop(self):
         ''' 
         Stop the trader.
         -> Trader cleanup.
             To gracefully stop the trader and cleanly eliminate the thread as well as market orders.
         '''
-        logging.debug('[BaseTrader][{0}] Stopping trader.'.format(self.print_pair))
+        self.logger.debug('[BaseTrader][%s] Stopping trader.', self.print_pair)
 
         self.state_data['runtime_state'] = 'STOP'
+
+        if self.trigger_engine:
+            self.trigger_engine.cancel(self.print_pair)
+
+        if self.indicator_service:
+            self.indicator_service.unsubscribe(self)
+
+        self._notify_pass()
         return (True)
 
+    def _notify_pass(self):
+        if self.pass_condition != None:
+            with self.pass_condition:
+                self.pass_condition.notify_all()
+
     def _main(self):
         '''
         Main body for the trader loop.
@@ -180,6 +237,14 @@ class BaseTrader(object):
         sock_symbol = self.base_asset + self.quote_asset
         last_wallet_update_time = 0
 
+        if not self._wait_for_data(sock_symbol):
+            return
+        self.state_data['runtime_state'] = 'SETUP'
+
+        ## Resting test orders resumed from the cache are placed with the trigger engine again.
+        if self.market_activity['order_status'] == 'PLACED' and self.market_activity['order_market_type'] != None:
+            self._set_test_triggers(self.market_activity['order_market_type'], self.market_activity)
+
         if self.configuration['trading_type'] == 'SPOT':
             position_types = ['LONG']
         elif self.configuration['trading_type'] == 'MARGIN':
@@ -188,39 +253,93 @@ class BaseTrader(object):
         ## Main trader loop
         while self.state_data['runtime_state'] != 'STOP':
             # Pull required data for the trader.
-            candles = self.candle_enpoint(sock_symbol)
-            books_data = self.depth_endpoint(sock_symbol)
-            self.indicators = TC.technical_indicators(candles)
+            if self.snapshots != None:
+                ## Nothing has changed for the market since the last pass so there is nothing to do.
+                snapshot = self.snapshots.get(sock_symbol)
+                if snapshot.version == self.snapshot_version:
+                    time.sleep(SNAPSHOT_WAIT_INTERVAL)
+                    continue
+
+                candles = snapshot.candles
+                books_data = snapshot.depth
+                self.timeframe_candles = snapshot.timeframe_candles
+
+                ## Strategies are given every tick since the last pass (the batches are merged into one).
+                self.ticks = tick_stream.batches_since(snapshot.ticks, self.tick_sequence) if snapshot.ticks else None
+                if self.ticks != None:
+                    self.tick_sequence = self.ticks.sequence
+            else:
+                candles = self.candle_enpoint(sock_symbol)
+                books_data = self.depth_endpoint(sock_symbol)
+
+                if self.candle_store:
+                    self.timeframe_candles = self.candle_store.get_timeframes(sock_symbol)
+
+            strategy = self.strategy
+
+            if self.indicator_service:
+                ## All views share one set of used series so the subscriptions cover every timeframe.
+                used_keys = set()
+                indicator_view = self.indicator_service.view(sock_symbol, self.candle_interval, candles,
+                                                             used_keys=used_keys)
+                timeframe_views = {timeframe: self.indicator_service.view(sock_symbol, timeframe, tf_candles,
+                                                                          used_keys=used_keys)
+                                   for timeframe, tf_candles in self.timeframe_candles.items()}
+
+                if hasattr(strategy, 'INDICATORS'):
+                    ## Only the indicators declared by the strategy are computed (over only the candles needed).
+                    self.indicators = indicator_view.get_declared(strategy.INDICATORS,
+                                                                  getattr(strategy, 'INDICATOR_LOOKBACK', None))
+                else:
+                    self.indicators = call_strategy_function(strategy.technical_indicators, candles,
+                                                             indicator_view=indicator_view,
+                                                             timeframe_views=timeframe_views)
+                self.indicator_service.set_subscriptions(self, used_keys)
+            else:
+                self.indicators = strategy.technical_indicators(candles)
             indicators = self.strip_timestamps(self.indicators)
 
-            logging.debug('[BaseTrader] Collected trader data. [{0}]'.format(self.print_pair))
+            self.logger.debug('[BaseTrader] Collected trader data. [%s]', self.print_pair)
 
             socket_buffer_symbol = None
-            if self.configuration['run_type'] == 'REAL':
+            if self.configuration['run_type'] == 'REAL' and self.snapshots != None:
+                if snapshot.execution_report != None:
+                    socket_buffer_symbol = {'executionReport': snapshot.execution_report}
+
+            elif self.configuration['run_type'] == 'REAL':
 
                 if sock_symbol in self.socket_api.socketBuffer:
                     socket_buffer_symbol = self.socket_api.socketBuffer[sock_symbol]
 
                 # get the global socket buffer and update the wallets for the used markets.
                 socket_buffer_global = self.socket_api.socketBuffer
-                if 'outboundAccountPosition' in socket_buffer_global:
+                if self.wallet_service == None and 'outboundAccountPosition' in socket_buffer_global:
                     if last_wallet_update_time != socket_buffer_global['outboundAccountPosition']['E']:
                         self.wallet_pair, last_wallet_update_time = self.update_wallets(socket_buffer_global)
 
             # Update martket prices with current data
             if books_data != None:
-                self.market_prices = {
-                    'lastPrice': candles[0][4],
-                    'askPrice': books_data['a'][0][0],
-                    'bidPrice': books_data['b'][0][0]}
+                self.market_depth = books_data
+                self.market_prices.set_prices(candles[0][4], books_data['a'][0][0], books_data['b'][0][0])
+
+            # Update the values used by any declared strategy rules.
+            if self.rule_engine:
+                self.rule_engine.update_features(sock_symbol, indicators, candles, self.market_prices,
+                                                 self.market_activity)
 
             # Check to make sure there is enough crypto to place orders.
             if self.state_data['runtime_state'] == 'PAUSE_INSUFBALANCE':
-                if self.wallet_pair[self.quote_asset][0] > self.state_data['base_currency']:
+                if self.wallet_service:
+                    quote_balance = self.wallet_service.available(self.quote_asset, self.print_pair)
+                else:
+                    quote_balance = self.wallet_pair[self.quote_asset][0]
+
+                if quote_balance > self.state_data['base_currency']:
                     self.state_data['runtime_state'] = 'RUN'
 
             if not self.state_data['runtime_state'] in ['STANDBY', 'FORCE_STANDBY', 'FORCE_PAUSE']:
                 ## Call for custom conditions that can be used for more advanced managemenet of the trader.
+                self.capital_renewed = False
 
                 for market_type in position_types:
                     cp = self.market_activity
@@ -233,14 +352,17 @@ class BaseTrader(object):
                         cp = self._order_status_manager(market_type, cp, socket_buffer_symbol)
 
                     ## For checking custom conditional actions
-                    self.custom_conditional_data, cp = TC.other_conditions(
+                    self.custom_conditional_data, cp = call_strategy_function(
+                        strategy.other_conditions,
                         self.custom_conditional_data,
                         cp,
                         self.trade_recorder,
                         market_type,
                         candles,
                         indicators,
-                        self.configuration['symbol'])
+                        self.configuration['symbol'],
+                        timeframe_candles=self.timeframe_candles,
+                        ticks=self.ticks)
 
                     ## For managing the placement of orders/condition checking.
                     if cp['can_order'] == True and self.state_data['runtime_state'] == 'RUN' and cp[
@@ -248,15 +370,24 @@ class BaseTrader(object):
                         if cp['order_type'] == 'COMPLETE':
                             cp['order_type'] = 'WAIT'
 
-                        tm_data = self._trade_manager(market_type, cp, indicators, candles)
+                        tm_data = self._trade_manager(market_type, cp, indicators, candles, strategy)
                         cp = tm_data if tm_data else cp
 
                     if not cp['market_status']:
                         cp['market_status'] = 'TRADING'
 
-                    self.market_activity = cp
+                    ## Strategies may hand back a plain dict rather than the state they were given.
+                    if cp is not self.market_activity:
+                        self.market_activity.update(cp)
 
-                    time.sleep(.1)
+                    if not self.replay:
+                        time.sleep(.1)
+
+                ## Capital requested/granted on an earlier pass is given back if this pass did not ask for it again.
+                if not self.capital_renewed and self.market_activity['order_side'] == 'BUY' and \
+                        not self.market_activity['order_status'] in ['PLACED', 'LOCKED'] and \
+                        self.capital_allocator != None:
+                    self.capital_allocator.expire(self.print_pair)
 
             current_localtime = time.localtime()
             self.state_data['last_update_time'] = '{0}:{1}:{2}'.format(current_localtime[3], current_localtime[4],
@@ -265,6 +396,16 @@ class BaseTrader(object):
             if self.state_data['runtime_state'] == 'SETUP':
                 self.state_data['runtime_state'] = 'RUN'
 
+            if self.first_decision_time == None:
+                self.first_decision_time = time.time() - self.start_time
+                self.logger.info('[BaseTrader][%s] First decision %.2fs after start.',
+                                 self.print_pair, self.first_decision_time)
+
+            # Mark the snapshot as handled once the full pass is done.
+            if self.snapshots != None:
+                self.snapshot_version = snapshot.version
+                self._notify_pass()
+
     def _order_status_manager(self, market_type, cp, socket_buffer_symbol):
         '''
         This is the manager for all and any active orders.
@@ -304,24 +445,26 @@ class BaseTrader(object):
         ## Monitor trade outcomes.
         if trade_done:
             if self.configuration['run_type'] == 'REAL':
-                print('order seen: ')
-                print(order_seen)
+                self.logger.debug('[BaseTrader] Order seen: %s [%s]', order_seen, self.print_pair)
 
             # Update order recorder.
             self.trade_recorder.append(
                 [time.time(), cp['price'], token_quantity, cp['order_description'], cp['order_side']])
-            logging.info('[BaseTrader] Completed {0} order. [{1}]'.format(cp['order_side'], self.print_pair))
+            self.logger.info('[BaseTrader] Completed %s order. [%s]', cp['order_side'], self.print_pair)
 
             if cp['order_side'] == 'BUY':
                 cp['order_side'] = 'SELL'
                 cp['order_point'] = None
                 cp['buy_price'] = self.trade_recorder[-1][1]
+                if self.capital_allocator:
+                    self.capital_allocator.filled(self.print_pair)
 
             elif cp['order_side'] == 'SELL':
                 cp['order_side'] = 'BUY'
                 cp['buy_price'] = 0.0
                 cp['order_point'] = None
                 cp['order_market_type'] = None
+                self._release_capital()
 
                 # If the trader is trading margin and the runtype is real then repay any loans.
                 if self.configuration['trading_type'] == 'MARGIN':
@@ -360,6 +503,14 @@ class BaseTrader(object):
         trade_done = False
         token_quantity = None
 
+        if self.configuration['run_type'] == 'TEST' and self.trigger_engine:
+            ## The trigger engine fills test orders on the price update that crosses them (MARKET orders fill now).
+            fill = self.trigger_engine.take_fill(self.print_pair)
+            if fill != None:
+                cp['price'] = fill['price']
+            trade_done = True if (fill != None or cp['order_type'] == 'MARKET') else False
+            return (cp, trade_done, cp['tokens_holding'])
+
         if side == 'BUY':
             if self.configuration['run_type'] == 'REAL':
                 if order_seen['S'] == 'BUY' or (market_type == 'SHORT' and order_seen['S'] == 'SELL'):
@@ -415,7 +566,7 @@ class BaseTrader(object):
                 token_quantity = cp['tokens_holding']
         return (cp, trade_done, token_quantity)
 
-    def _trade_manager(self, market_type, cp, indicators, candles):
+    def _trade_manager(self, market_type, cp, indicators, candles, strategy):
         ''' 
         Here both the sell and buy conditions are managed by the trader.
         -> Manager Sell Conditions.
@@ -426,19 +577,27 @@ class BaseTrader(object):
             Place orders on the market with real and assume order placemanet with test.
         '''
         updateOrder = False
+        amendOrder = False
 
         # Set the consitions to look over.
         if cp['order_side'] == 'SELL':
-            current_conditions = TC.long_exit_conditions if market_type == 'LONG' else TC.short_exit_conditions
+            current_conditions = strategy.long_exit_conditions if market_type == 'LONG' else \
+                strategy.short_exit_conditions
         else:
             if self.state_data['runtime_state'] == 'FORCE_PREVENT_BUY' or cp['order_status'] == 'LOCKED':
                 return
-            current_conditions = TC.long_entry_conditions if market_type == 'LONG' else TC.short_entry_conditions
-
-        logging.debug(
-            '[BaseTrader] Checking for {0} {1} condition. [{2}]'.format(cp['order_side'], market_type, self.print_pair))
-        new_order = current_conditions(self.custom_conditional_data, cp, indicators, self.market_prices, candles,
-                                       self.print_pair)
+            current_conditions = strategy.long_entry_conditions if market_type == 'LONG' else \
+                strategy.short_entry_conditions
+
+        self.logger.debug('[BaseTrader] Checking for %s %s condition. [%s]',
+                          cp['order_side'], market_type, self.print_pair)
+        if self.rule_engine and self.rule_engine.has_rules(market_type, cp['order_side']):
+            ## Rules were evaluated when this pass wrote the markets features so just pick up the signal.
+            new_order = self.rule_engine.get_order(self.configuration['symbol'], market_type, cp['order_side'])
+        else:
+            new_order = call_strategy_function(current_conditions, self.custom_conditional_data, cp, indicators,
+                                               self.market_prices, candles, self.print_pair,
+                                               timeframe_candles=self.timeframe_candles, ticks=self.ticks)
 
         # If no order is to be placed just return.
         if not (new_order):
@@ -450,17 +609,24 @@ class BaseTrader(object):
 
             # Format the prices to be used.
             if 'price' in new_order:
-                if 'price' in new_order:
-                    new_order['price'] = '{0:.{1}f}'.format(float(new_order['price']), self.rules['TICK_SIZE'])
+                new_order['price'] = order_sizing.format_price(new_order['price'], self.rules)
                 if 'stopPrice' in new_order:
-                    new_order['stopPrice'] = '{0:.{1}f}'.format(float(new_order['stopPrice']), self.rules['TICK_SIZE'])
-                if float(new_order['price']) != cp['price']:
+                    new_order['stopPrice'] = order_sizing.format_price(new_order['stopPrice'], self.rules)
+                if 'stopLimitPrice' in new_order:
+                    new_order['stopLimitPrice'] = order_sizing.format_price(new_order['stopLimitPrice'], self.rules)
+                # Only update the order if the price has moved by at least one tick (compared as tick rounded prices).
+                if new_order['price'] != order_sizing.format_price(cp['price'], self.rules):
                     updateOrder = True
 
             # If order is to be placed or updated then do so.
             if cp['order_type'] != new_order['order_type'] or updateOrder:
                 order = new_order
 
+                # A price move on a resting order of the same type is amended rather than cancelled and re-placed.
+                if updateOrder and cp['order_status'] == 'PLACED' and cp['order_type'] == new_order['order_type'] and \
+                        new_order['order_type'] in AMENDABLE_ORDER_TYPES:
+                    amendOrder = True
+
         else:
             # Wait will be used to indicate order reset.
             if 'order_point' in new_order:
@@ -471,17 +637,49 @@ class BaseTrader(object):
             cp['order_status'] = None
             cp['order_type'] = 'WAIT'
 
-        if cp['order_id'] != None and (new_order['order_type'] == 'WAIT' or order != None):
+            ## Test orders have no order id so are taken out of the trigger engine here.
+            if self.trigger_engine:
+                self.trigger_engine.cancel(self.print_pair)
+
+        # Orders being replaced are cancelled by _place_order/_amend_order so only cancel here on reset.
+        if cp['order_id'] != None and new_order['order_type'] == 'WAIT':
             cancel_order_results = self._cancel_order(cp['order_id'], cp['order_type'])
             cp['order_id'] = None
 
+        if new_order['order_type'] == 'WAIT' and cp['order_side'] == 'BUY':
+            self._release_capital()
+
         ## Place Market Order.
         if order:
-            order_results = self._place_order(market_type, cp, order)
-            logging.debug('order: {0}\norder result:\n{1}'.format(order, order_results))
+            # Capital for a BUY (long or short entry) is allocated across all markets before anything is sent.
+            if order['side'] == 'BUY':
+                allocation = self._request_capital(order)
+
+                ## The resting order is being replaced either way so it is cancelled rather than left on the book.
+                if allocation != capital_allocator.ALLOCATION_GRANTED and cp['order_status'] == 'PLACED':
+                    if not self._cancel_replaced_order(cp):
+                        return
+
+                if allocation == capital_allocator.ALLOCATION_PENDING:
+                    return
+
+                if allocation == capital_allocator.ALLOCATION_DENIED:
+                    self.logger.info('[BaseTrader] Not enough %s available for BUY. [%s]',
+                                     self.quote_asset, self.print_pair)
+                    self.state_data['runtime_state'] = 'PAUSE_INSUFBALANCE'
+                    return
+
+            if amendOrder:
+                order_results = self._amend_order(market_type, cp, order)
+            else:
+                order_results = self._place_order(market_type, cp, order)
+            self.logger.debug('order: %s\norder result:\n%s', order, order_results)
 
             # If errors are returned for the order then sort them.
             if 'code' in order_results['data']:
+                if order['side'] == 'BUY' and cp['order_id'] == None:
+                    self._release_capital()
+
                 ## used to catch error codes.
                 if order_results['data']['code'] == -2010:
                     self.state_data['runtime_state'] = 'PAUSE_INSUFBALANCE'
@@ -489,9 +687,8 @@ class BaseTrader(object):
                     self.state_data['runtime_state'] = 'CHECK_ORDERS'
                 return
 
-            logging.info('[BaseTrader] {0} Order placed for {1}.'.format(self.print_pair, new_order['order_type']))
-            logging.info(
-                '[BaseTrader] {0} Order placement results:\n{1}'.format(self.print_pair, str(order_results['data'])))
+            self.logger.info('[BaseTrader] %s Order placed for %s.', self.print_pair, new_order['order_type'])
+            self.logger.info('[BaseTrader] %s Order placement results:\n%s', self.print_pair, order_results['data'])
 
             if 'type' in order_results['data']:
                 if order_results['data']['type'] == 'MARKET':
@@ -513,7 +710,9 @@ class BaseTrader(object):
                 order_price = price1
 
             if 'stopPrice' in order:
-                cp['stopPrice'] == ['stopPrice']
+                cp['stopPrice'] = float(order['stopPrice'])
+            if 'stopLimitPrice' in order:
+                cp['stopLimitPrice'] = float(order['stopLimitPrice'])
 
             # Setup the test order quantity and setup margin trade loan.
             if order['side'] == 'BUY':
@@ -533,18 +732,90 @@ class BaseTrader(object):
             cp['price'] = float(order_price)
             cp['order_type'] = new_order['order_type']
             cp['order_status'] = 'PLACED'
+            self._set_test_triggers(market_type, cp)
 
-            logging.info(
-                'update: {0}, type: {1}, status: {2}'.format(updateOrder, new_order['order_type'], cp['order_status']))
+            # The BUYs quote is now locked on the account so it no longer needs reserving past the next update.
+            if order['side'] == 'BUY' and self.capital_allocator != None:
+                self.capital_allocator.placed(self.print_pair)
+
+            self.logger.info('update: %s, type: %s, status: %s',
+                             updateOrder, new_order['order_type'], cp['order_status'])
             return (cp)
 
-    def _place_order(self, market_type, cp, order):
-        ''' place order '''
+    def _set_test_triggers(self, market_type, cp):
+        '''
+        Place a test order with the trigger engine (only used for TEST run types with a trigger engine).
+        -> Long BUYs/short SELLs rest below the price and fill as it falls to the order, long SELLs/short BUYs above.
+        -> STOP_LOSS_LIMIT orders trigger in the opposite direction and OCO orders rest both legs.
+        '''
+        if self.configuration['run_type'] != 'TEST' or self.trigger_engine == None:
+            return
 
-        ## Calculate the quantity amount for the BUY/SELL side for long/short real/test trades.
+        if cp['order_type'] == 'MARKET':
+            self.trigger_engine.cancel(self.print_pair)
+            return
+
+        if (cp['order_side'] == 'BUY') == (market_type == 'LONG'):
+            limit_direction, stop_direction = trigger_engine.TRIGGER_DOWN, trigger_engine.TRIGGER_UP
+        else:
+            limit_direction, stop_direction = trigger_engine.TRIGGER_UP, trigger_engine.TRIGGER_DOWN
+
+        if cp['order_type'] == 'STOP_LOSS_LIMIT':
+            legs = [('STOP', stop_direction, cp['price'], cp['price'])]
+        else:
+            legs = [('LIMIT', limit_direction, cp['price'], cp['price'])]
+
+            if cp['order_type'] == 'OCO_LIMIT' and cp['stopPrice']:
+                stop_limit_price = cp['stopLimitPrice'] if cp['stopLimitPrice'] else cp['stopPrice']
+                legs.append(('STOP', stop_direction, cp['stopPrice'], stop_limit_price))
+
+        self.trigger_engine.place(self.print_pair, self.configuration['symbol'], legs)
+
+    def _cancel_replaced_order(self, cp):
+        ''' Cancel the resting order of a market and reset it to WAIT, returns False if the cancel failed. '''
+        if cp['order_id'] != None:
+            cancel_order_results = self._cancel_order(cp['order_id'], cp['order_type'])
+            if 'code' in cancel_order_results:
+                self.logger.warning('[BaseTrader] Unable to cancel replaced order %s: %s [%s]',
+                                    cp['order_id'], cancel_order_results, self.print_pair)
+                if cancel_order_results['code'] == -2011:
+                    self.state_data['runtime_state'] = 'CHECK_ORDERS'
+                return (False)
+            cp['order_id'] = None
+
+        if self.trigger_engine:
+            self.trigger_engine.cancel(self.print_pair)
+
+        if cp['order_side'] == 'BUY':
+            cp['order_market_type'] = None
+        cp['order_status'] = None
+        cp['order_type'] = 'WAIT'
+        return (True)
+
+    def _request_capital(self, order):
+        ''' Request the quote used by a BUY from the allocator (orders can give a 'score' to rank competing BUYs). '''
+        self.capital_renewed = True
+        if self.capital_allocator == None:
+            return (capital_allocator.ALLOCATION_GRANTED)
+        return (self.capital_allocator.request(self.print_pair, float(self.state_data['base_currency']),
+                                               order['score'] if 'score' in order else 0))
+
+    def _release_capital(self):
+        if self.capital_allocator != None:
+            self.capital_allocator.release(self.print_pair)
+
+    def _get_order_quantity(self, order):
+        '''
+        Calculate the quantity for the BUY/SELL side at the precision of the market.
+        -> BUY market orders are sized by walking the depth (capped by the orders 'max_slippage' if set).
+        -> BUY limit orders are sized from the order price and SELL orders from the last BUY quantity.
+        -> Returns None if the quantity is not valid for the market (below the minimum notional), this is only logged
+           once per side/quantity so a SELL of dust is skipped quietly each pass until the price makes it sellable.
+        '''
+        notional = None
         quantity = None
         if order['side'] == 'BUY':
-            quantity = float(self.state_data['base_currency']) / float(self.market_prices['bidPrice'])
+            notional = float(self.state_data['base_currency'])
 
         elif order['side'] == 'SELL':
             if 'order_prec' in order:
@@ -552,17 +823,47 @@ class BaseTrader(object):
             else:
                 quantity = float(self.trade_recorder[-1][2])
 
+        price = order['price'] if ('price' in order and order['order_type'] != 'MARKET') else None
+        max_slippage = order['max_slippage'] if 'max_slippage' in order else None
+
+        sizing = order_sizing.size_order(order['side'], self.rules, self.market_depth, notional=notional,
+                                         quantity=quantity, price=price, max_slippage=max_slippage)
+
+        ## Without any depth fall back to sizing from the bid price.
+        if sizing == None:
+            sizing = order_sizing.size_order(order['side'], self.rules, None, notional=notional, quantity=quantity,
+                                             price=self.market_prices['bidPrice'])
+
+        if not sizing['valid']:
+            if self.invalid_quantity != (order['side'], sizing['quantity']):
+                self.invalid_quantity = (order['side'], sizing['quantity'])
+                self.logger.warning('[BaseTrader] %s order quantity %s is below the minimum notional, skipping. [%s]',
+                                    order['side'], sizing['quantity'], self.print_pair)
+            return (None)
+
+        self.invalid_quantity = None
+
+        if sizing['slippage'] > 0:
+            self.logger.debug('[BaseTrader] %s order estimated price %.8f, slippage %.2f%%. [%s]',
+                              order['side'], sizing['price'], sizing['slippage'] * 100, self.print_pair)
+
+        return (sizing['quantity'])
+
+    def _place_order(self, market_type, cp, order):
+        ''' place order '''
+
+        ## Calculate the quantity amount for the BUY/SELL side for long/short real/test trades.
+        f_quantity = self._get_order_quantity(order)
+        if f_quantity == None:
+            return ({'action': 'ORDER_ISSUE', 'data': dict(INVALID_QUANTITY_ISSUE)})
+
         if self.configuration['run_type'] == 'REAL' and cp['order_id']:
             cancel_order_results = self._cancel_order(cp['order_id'], cp['order_type'])
             if 'code' in cancel_order_results:
                 return ({'action': 'ORDER_ISSUE', 'data': cancel_order_results})
+            cp['order_id'] = None
 
-        ## Setup the quantity to be the correct precision.
-        if quantity:
-            split_quantity = str(quantity).split('.')
-            f_quantity = float(split_quantity[0] + '.' + split_quantity[1][:self.rules['LOT_SIZE']])
-
-        logging.info('Order: {0}'.format(order))
+        self.logger.info('Order: %s', order)
 
         ## Place orders for both SELL/BUY sides for both TEST/REAL run types.
         if self.configuration['run_type'] == 'REAL':
@@ -580,10 +881,10 @@ class BaseTrader(object):
                     side = 'BUY'
 
             if order['order_type'] == 'OCO_LIMIT':
-                logging.info(
-                    '[BaseTrader] symbol:{0}, side:{1}, type:{2}, quantity:{3} price:{4}, stopPrice:{5}, stopLimitPrice:{6}'.format(
-                        self.print_pair, order['side'], order['order_type'], f_quantity, order['price'],
-                        order['stopPrice'], order['stopLimitPrice']))
+                self.logger.info(
+                    '[BaseTrader] symbol:%s, side:%s, type:%s, quantity:%s price:%s, stopPrice:%s, stopLimitPrice:%s',
+                    self.print_pair, order['side'], order['order_type'], f_quantity, order['price'], order['stopPrice'],
+                    order['stopLimitPrice'])
                 rData.update(
                     self.rest_api.place_order(self.configuration['trading_type'], symbol=self.configuration['symbol'],
                                               side=side, type=order['order_type'], timeInForce='GTC',
@@ -592,21 +893,16 @@ class BaseTrader(object):
                 return ({'action': 'PLACED_MARKET_ORDER', 'data': rData})
 
             elif order['order_type'] == 'MARKET':
-                logging.info(
-                    '[BaseTrader] symbol:{0}, side:{1}, type:{2}, quantity:{3}'.format(self.print_pair, order['side'],
-                                                                                       order['order_type'], f_quantity))
+                self.logger.info('[BaseTrader] symbol:%s, side:%s, type:%s, quantity:%s',
+                                 self.print_pair, order['side'], order['order_type'], f_quantity)
                 rData.update(
                     self.rest_api.place_order(self.configuration['trading_type'], symbol=self.configuration['symbol'],
                                               side=side, type=order['order_type'], quantity=f_quantity))
                 return ({'action': 'PLACED_MARKET_ORDER', 'data': rData})
 
             elif order['order_type'] == 'LIMIT':
-                logging.info(
-                    '[BaseTrader] symbol:{0}, side:{1}, type:{2}, quantity:{3} price:{4}'.format(self.print_pair,
-                                                                                                 order['side'],
-                                                                                                 order['order_type'],
-                                                                                                 f_quantity,
-                                                                                                 order['price']))
+                self.logger.info('[BaseTrader] symbol:%s, side:%s, type:%s, quantity:%s price:%s',
+                                 self.print_pair, order['side'], order['order_type'], f_quantity, order['price'])
                 rData.update(
                     self.rest_api.place_order(self.configuration['trading_type'], symbol=self.configuration['symbol'],
                                               side=side, type=order['order_type'], timeInForce='GTC',
@@ -614,10 +910,9 @@ class BaseTrader(object):
                 return ({'action': 'PLACED_LIMIT_ORDER', 'data': rData})
 
             elif order['order_type'] == 'STOP_LOSS_LIMIT':
-                logging.info(
-                    '[BaseTrader] symbol:{0}, side:{1}, type:{2}, quantity:{3} price:{4}, stopPrice:{5}'.format(
-                        self.print_pair, order['side'], order['order_type'], f_quantity, order['price'],
-                        order['stopPrice']))
+                self.logger.info('[BaseTrader] symbol:%s, side:%s, type:%s, quantity:%s price:%s, stopPrice:%s',
+                                 self.print_pair, order['side'], order['order_type'], f_quantity, order['price'],
+                                 order['stopPrice'])
                 rData.update(
                     self.rest_api.place_order(self.configuration['trading_type'], symbol=self.configuration['symbol'],
                                               side=side, type=order['order_type'], timeInForce='GTC',
@@ -637,6 +932,56 @@ class BaseTrader(object):
 
             return ({'action': 'PLACED_TEST_ORDER', 'data': placed_order})
 
+    def _amend_order(self, market_type, cp, order):
+        '''
+        Amend a resting order with a new price.
+        -> Real SPOT orders use the cancel-replace endpoint (one request, see core/order_api.py).
+        -> Otherwise fall back to a single cancel followed by placing the new order (test orders are re-priced).
+        '''
+        cancel_replace = getattr(self.rest_api, 'cancel_replace_order', None)
+
+        if self.configuration['run_type'] != 'REAL' or cancel_replace == None or cp['order_id'] == None or \
+                self.configuration['trading_type'] != 'SPOT':
+            return (self._place_order(market_type, cp, order))
+
+        f_quantity = self._get_order_quantity(order)
+        if f_quantity == None:
+            return ({'action': 'ORDER_ISSUE', 'data': dict(INVALID_QUANTITY_ISSUE)})
+
+        order_params = {
+            'symbol': self.configuration['symbol'],
+            'side': order['side'],
+            'type': order['order_type'],
+            'timeInForce': 'GTC',
+            'quantity': f_quantity,
+            'price': order['price'],
+            'cancelReplaceMode': 'STOP_ON_FAILURE',
+            'cancelOrderId': cp['order_id']}
+
+        if order['order_type'] == 'STOP_LOSS_LIMIT':
+            order_params.update({'stopPrice': order['stopPrice']})
+
+        self.logger.info('[BaseTrader] symbol:%s, amend order:%s, side:%s, type:%s, quantity:%s price:%s',
+                         self.print_pair, cp['order_id'], order['side'], order['order_type'], f_quantity,
+                         order['price'])
+        amend_result = cancel_replace(self.configuration['trading_type'], **order_params)
+
+        if 'code' in amend_result:
+            amend_data = amend_result['data'] if 'data' in amend_result else {}
+
+            ## If the cancel went through but the new order failed then the old order no longer exists.
+            if 'cancelResult' in amend_data and amend_data['cancelResult'] == 'SUCCESS':
+                cp['order_id'] = None
+                cp['order_status'] = None
+                cp['order_type'] = 'WAIT'
+
+            if 'newOrderResponse' in amend_data and amend_data['newOrderResponse'] and 'code' in amend_data[
+                'newOrderResponse']:
+                return ({'action': 'ORDER_ISSUE', 'data': amend_data['newOrderResponse']})
+            return ({'action': 'ORDER_ISSUE', 'data': amend_result})
+
+        return ({'action': 'AMENDED_ORDER', 'data': amend_result['newOrderResponse']})
+
     def _cancel_order(self, order_id, order_type):
         ''' cancel orders '''
         if self.configuration['run_type'] == 'REAL':
@@ -645,22 +990,30 @@ class BaseTrader(object):
             else:
                 cancel_order_result = self.rest_api.cancel_order(self.configuration['trading_type'],
                                                                  symbol=self.configuration['symbol'], orderId=order_id)
-            logging.debug('[BaseTrader] {0} cancel order results:\n{1}'.format(self.print_pair, cancel_order_result))
+            self.logger.debug('[BaseTrader] %s cancel order results:\n%s', self.print_pair, cancel_order_result)
             return (cancel_order_result)
-        logging.debug('[BaseTrader] {0} cancel order.'.format(self.print_pair))
+        self.logger.debug('[BaseTrader] %s cancel order.', self.print_pair)
         return (True)
 
+    def get_state_version(self):
+        '''
+        Changes whenever the state in get_trader_data is likely to have changed (every pass sets a new update time).
+        -> Lets the dashboard/cache writers skip building the data of traders that have not changed.
+        '''
+        return ((self.market_prices.version, self.market_activity.version, self.state_data.version,
+                 len(self.trade_recorder)))
+
     def get_trader_data(self):
         ''' Access that is availble for the traders details. '''
         trader_data = {
             'market': self.print_pair,
             'configuration': self.configuration,
-            'market_prices': self.market_prices,
+            'market_prices': self.market_prices.to_dict(),
             'wallet_pair': self.wallet_pair,
             'custom_conditions': self.custom_conditional_data,
-            'market_activity': self.market_activity,
+            'market_activity': self.market_activity.to_dict(),
             'trade_recorder': self.trade_recorder,
-            'state_data': self.state_data,
+            'state_data': self.state_data.to_dict(),
             'rules': self.rules
         }
 
@@ -703,5 +1056,5 @@ class BaseTrader(object):
         if not (foundQuote):
             wallet_pair.update({self.quote_asset: [0.0, 0.0]})
 
-        logging.info('[BaseTrader] New account data pulled, wallets updated. [{0}]'.format(self.print_pair))
+        self.logger.info('[BaseTrader] New account data pulled, wallets updated. [%s]', self.print_pair)
         return (wallet_pair, last_wallet_update_time)
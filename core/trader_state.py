@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+
+'''
+Slotted state objects used by the traders in place of deep copied dict layouts.
+
+They keep the dict access used throughout the trader and strategies (state['order_side'], .get, .update, 'x' in
+state) and serialize to the same JSON shape as the old layouts for the cache and web UI.
+'''
+
+
+class TraderState(object):
+    '''
+    Base for the trader state objects, the fields and their defaults are declared by FIELDS on each subclass.
+    -> Values are held in slots (no per instance dict), keys outside FIELDS (e.g. set by a strategy) are kept in extra.
+    -> version counts every assignment that changes a value so the dashboard/cache writers only build the state of
+       traders that changed (see BaseTrader.get_state_version).
+    '''
+
+    FIELDS = {}
+    __slots__ = ('extra', 'version')
+
+    def __init__(self, values=None):
+        for name, default in self.FIELDS.items():
+            object.__setattr__(self, name, default)
+        self.extra = None
+        self.version = 0
+
+        if values:
+            self.update(values)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return (getattr(self, key))
+        if self.extra != None and key in self.extra:
+            return (self.extra[key])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            if getattr(self, key) == value:
+                return
+            object.__setattr__(self, key, value)
+        else:
+            if self.extra == None:
+                self.extra = {}
+            elif key in self.extra and self.extra[key] == value:
+                return
+            self.extra[key] = value
+
+        self.version += 1
+
+    def __contains__(self, key):
+        return (key in self.FIELDS or (self.extra != None and key in self.extra))
+
+    def __iter__(self):
+        return (iter(self.keys()))
+
+    def __len__(self):
+        return (len(self.FIELDS) + (len(self.extra) if self.extra else 0))
+
+    def __eq__(self, other):
+        if isinstance(other, (TraderState, dict)):
+            return (self.to_dict() == dict(other))
+        return (NotImplemented)
+
+    def __repr__(self):
+        return ('{0}({1})'.format(type(self).__name__, self.to_dict()))
+
+    def get(self, key, default=None):
+        return (self[key] if key in self else default)
+
+    def keys(self):
+        return (list(self.FIELDS) + (list(self.extra) if self.extra else []))
+
+    def values(self):
+        return ([self[key] for key in self.keys()])
+
+    def items(self):
+        return ([(key, self[key]) for key in self.keys()])
+
+    def update(self, values=None, **kwargs):
+        for data in (values, kwargs):
+            if data:
+                for key in data.keys():
+                    self[key] = data[key]
+
+    def to_dict(self):
+        ''' Plain dict in the JSON shape used by the cache and web UI. '''
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        if self.extra:
+            data.update(self.extra)
+        return (data)
+
+
+class MarketPrices(TraderState):
+    ''' Pricing for the market (updated in place each pass). '''
+    FIELDS = {
+        'lastPrice': 0,  # Last price seen for the market.
+        'askPrice': 0,  # Last ask price seen for the market.
+        'bidPrice': 0  # Last bid price seen for the market.
+    }
+    __slots__ = tuple(FIELDS)
+
+    def set_prices(self, last_price, ask_price, bid_price):
+        ''' Update all of the prices at once (called every pass so avoids the per key lookups). '''
+        if self.lastPrice != last_price or self.askPrice != ask_price or self.bidPrice != bid_price:
+            self.lastPrice = last_price
+            self.askPrice = ask_price
+            self.bidPrice = bid_price
+            self.version += 1
+
+
+class StateData(TraderState):
+    ''' Runtime state of the trader. '''
+    FIELDS = {
+        'base_currency': 0.0,  # The base mac value used as referance.
+        'force_sell': False,  # If the trader should dump all tokens.
+        'runtime_state': None,  # The state that actual trader object is at.
+        'last_update_time': 0  # The last time a full look of the trader was completed.
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class MarketActivity(TraderState):
+    ''' Order/position state of the trader for the market. '''
+    FIELDS = {
+        'can_order': True,  # If the bot is able to trade in the current market.
+        'price': 0.0,  # The price related to BUY.
+        'buy_price': 0.0,  # Buy price of the asset.
+        'stopPrice': 0.0,  # The stopPrice relate
+        'stopLimitPrice': 0.0,  # The stopPrice relate
+        'tokens_holding': 0.0,  # Amount of tokens being held.
+        'order_point': None,  # Used to visulise complex stratergy progression points.
+        'order_id': None,  # The ID that is tied to the placed order.
+        'order_status': 0,  # The type of the order that is placed
+        'order_side': 'BUY',  # The status of the current order.
+        'order_type': 'WAIT',  # Used to show the type of order (SIGNAL/STOP-LOSS/WAIT)
+        'order_description': 0,  # The description of the order.
+        'order_market_type': None,  # The market type of the order placed.
+        'market_status': None  # Last state the market trader is.
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class MarginMarketActivity(MarketActivity):
+    ''' Market activity with the extra data required for margin trading. '''
+    FIELDS = dict(MarketActivity.FIELDS, **{
+        'loan_cost': 0,  # Loan cost.
+        'loan_id': None,  # Loan id.
+    })
+    __slots__ = ('loan_cost', 'loan_id')
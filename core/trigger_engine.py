@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+import time
+import bisect
+import threading
+
+## Directions a leg is triggered in (the price falling to/below or rising to/above its trigger price).
+TRIGGER_DOWN = 'DOWN'
+TRIGGER_UP = 'UP'
+
+
+class _TriggerSide(object):
+    ''' Legs triggered in one direction for a symbol, sorted by trigger price (parallel lists for bisect). '''
+
+    def __init__(self):
+        self.prices = []
+        self.legs = []
+
+    def add(self, price, leg):
+        index = bisect.bisect_right(self.prices, price)
+        self.prices.insert(index, price)
+        self.legs.insert(index, leg)
+
+    def remove(self, price, leg):
+        index = bisect.bisect_left(self.prices, price)
+        while index < len(self.prices) and self.prices[index] == price:
+            if self.legs[index] is leg:
+                del self.prices[index]
+                del self.legs[index]
+                return
+            index += 1
+
+    def pop_crossed(self, price, direction):
+        ''' Remove and return the legs crossed by a price. '''
+        if direction == TRIGGER_DOWN:
+            index = bisect.bisect_left(self.prices, price)
+            crossed = self.legs[index:]
+            del self.prices[index:]
+            del self.legs[index:]
+        else:
+            index = bisect.bisect_right(self.prices, price)
+            crossed = self.legs[:index]
+            del self.prices[:index]
+            del self.legs[:index]
+        return (crossed)
+
+
+class TriggerEngine(object):
+    '''
+    Simulated resting orders for TEST mode that are filled on the price update that crosses them.
+    -> An order is one or more legs given as (name, direction, trigger price, fill price) e.g. an OCO order has a
+       LIMIT and a STOP leg, filling any leg of an order removes the rest of it.
+    -> Legs are held per symbol in trigger price order so each price update only bisects to the legs it crosses.
+    -> Fills are held as {'price', 'time', 'leg'} until the owner of the order takes them (take_fill).
+    '''
+
+    def __init__(self):
+        self.sides = {}
+        self.orders = {}
+        self.fills = {}
+        self.last_prices = {}
+        self.lock = threading.Lock()
+
+    def place(self, key, symbol, legs):
+        '''
+        Place (or replace) the resting order held under key, any fill of the order it replaces not yet taken is
+        dropped. Legs already crossed by the last price seen for the symbol are filled straight away.
+        '''
+        with self.lock:
+            self._remove_order(key)
+            self.fills.pop(key, None)
+
+            if not symbol in self.sides:
+                self.sides[symbol] = {TRIGGER_DOWN: _TriggerSide(), TRIGGER_UP: _TriggerSide()}
+
+            order_legs = [(key, name, direction, float(trigger_price), float(fill_price))
+                          for name, direction, trigger_price, fill_price in legs]
+            self.orders[key] = (symbol, order_legs)
+
+            for leg in order_legs:
+                self.sides[symbol][leg[2]].add(leg[3], leg)
+
+            if symbol in self.last_prices:
+                self._trigger(symbol, self.last_prices[symbol])
+
+    def cancel(self, key):
+        ''' Remove the resting order held under key (and any fill not yet taken). '''
+        with self.lock:
+            self._remove_order(key)
+            self.fills.pop(key, None)
+
+    def take_fill(self, key):
+        ''' The fill of the order held under key (None if it has not filled), a fill is only returned once. '''
+        if not key in self.fills:
+            return (None)
+
+        with self.lock:
+            return (self.fills.pop(key, None))
+
+    def on_price(self, symbol, price):
+        ''' Price update for a symbol, fills every leg the price has crossed. '''
+        self.last_prices[symbol] = price
+        if not symbol in self.sides:
+            return
+
+        with self.lock:
+            self._trigger(symbol, price)
+
+    def on_prices(self, symbol, prices):
+        ''' Batch of prices for a symbol (oldest first), fills every leg crossed by any of them. '''
+        if not len(prices):
+            return
+
+        self.last_prices[symbol] = float(prices[-1])
+        if not symbol in self.sides:
+            return
+
+        ## Legs only trigger on the low (falling) or high (rising) of the batch.
+        with self.lock:
+            self._trigger(symbol, float(prices.min()))
+            self._trigger(symbol, float(prices.max()))
+
+    def _trigger(self, symbol, price):
+        fill_time = time.time()
+        for direction, side in self.sides[symbol].items():
+            for leg in side.pop_crossed(price, direction):
+                key = leg[0]
+
+                ## Both legs of an OCO order can be crossed by the same update, only the first fills.
+                if not key in self.orders:
+                    continue
+
+                self._remove_order(key)
+                self.fills[key] = {'price': leg[4], 'time': fill_time, 'leg': leg[1]}
+
+    def _remove_order(self, key):
+        order = self.orders.pop(key, None)
+        if order == None:
+            return
+
+        symbol, order_legs = order
+        for leg in order_legs:
+            self.sides[symbol][leg[2]].remove(leg[3], leg)
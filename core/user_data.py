@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+import time
+import logging
+import threading
+
+## Interval between checks of the user data socket buffer for new events.
+USER_DATA_CHECK_INTERVAL = 0.1
+
+
+class UserDataEvents(object):
+    '''
+    Dispatches user data stream events (outboundAccountPosition, executionReport, etc) to subscribers.
+    -> The binance socket keeps the last event of each type in its buffer (execution reports per symbol).
+    -> Each new event (by event time) is passed once to the handlers subscribed to its type.
+    '''
+
+    def __init__(self, socket_api, recorder=None):
+        self.socket_api = socket_api
+        self.recorder = recorder
+        self.handlers = {}
+        self.last_event_times = {}
+        self.running = False
+
+    def subscribe(self, event_type, handler):
+        ''' Register a handler for an event type e.g. subscribe('outboundAccountPosition', handler). '''
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def start(self):
+        ''' Start dispatching events in its own thread. '''
+        if len(self.handlers) == 0 or self.running:
+            return
+
+        self.running = True
+        threading.Thread(target=self._run).start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            socket_buffer = self.socket_api.socketBuffer
+
+            for key, value in list(socket_buffer.items()):
+                if key in self.handlers:
+                    self._dispatch(key, key, value)
+
+                elif isinstance(value, dict):
+                    ## Symbol buffers hold the events for that symbol.
+                    for event_type in self.handlers:
+                        if event_type in value:
+                            self._dispatch((key, event_type), event_type, value[event_type])
+
+            time.sleep(USER_DATA_CHECK_INTERVAL)
+
+    def _dispatch(self, buffer_key, event_type, event):
+        if not isinstance(event, dict) or not 'E' in event:
+            return
+
+        if self.last_event_times.get(buffer_key) == event['E']:
+            return
+        self.last_event_times[buffer_key] = event['E']
+
+        if self.recorder:
+            self.recorder.record('user', {'type': event_type, 'event': event})
+
+        for handler in self.handlers[event_type]:
+            try:
+                handler(event)
+            except Exception:
+                logging.exception('[UserDataEvents] Handler failed for %s.', event_type)
@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+import logging
+import threading
+
+
+class WalletService(object):
+    '''
+    Account balances for all traders held in one asset indexed table ({asset:[free, locked], ...}).
+    -> Account updates are applied once in place so the pairs handed to traders are always current (O(1) reads).
+    -> Traders sharing an asset reserve what their orders will use so they can not overspend it between them.
+    -> Once an order is placed its reservation is only kept until the next account update for the asset (which has
+       the funds moved from free to locked) so they are never taken off the free balance twice.
+    -> Subscribers are called with (asset, balance) when the balance of an asset changes.
+    '''
+
+    def __init__(self):
+        self.balances = {}
+        self.reservations = {}
+        self.subscribers = {}
+        self.reserve_lock = threading.Lock()
+
+    def load(self, balances):
+        ''' Load the starting balances as {asset:[free, locked], ...}. '''
+        for asset, balance in balances.items():
+            self._get_balance(asset)[:] = [float(balance[0]), float(balance[1])]
+
+    def get_pair(self, base_asset, quote_asset):
+        ''' The wallet pair for a trader, the balances are shared by reference and update in place. '''
+        return ({base_asset: self._get_balance(base_asset), quote_asset: self._get_balance(quote_asset)})
+
+    def subscribe(self, asset, callback):
+        self.subscribers.setdefault(asset, []).append(callback)
+
+    def on_account_position(self, event):
+        ''' User data handler for outboundAccountPosition events (only holds the changed assets). '''
+        for wallet in event['B']:
+            balance = self._get_balance(wallet['a'])
+            balance[0] = float(wallet['f'])
+            balance[1] = float(wallet['l'])
+
+            ## The funds of placed orders are now locked on the account so their reservations are done with.
+            with self.reserve_lock:
+                reserved = self.reservations.get(wallet['a'], {})
+                for owner in [owner for owner, reservation in reserved.items() if reservation[1]]:
+                    reserved.pop(owner, None)
+
+            for callback in self.subscribers.get(wallet['a'], []):
+                try:
+                    callback(wallet['a'], balance)
+                except Exception:
+                    logging.exception('[WalletService] Subscriber failed for %s.', wallet['a'])
+
+    def available(self, asset, owner=None):
+        ''' Free balance of an asset not reserved by other owners (locked funds already belong to open orders). '''
+        with self.reserve_lock:
+            return (self._available(asset, owner))
+
+    def free(self, asset):
+        ''' Free balance of an asset ignoring any reservations. '''
+        return (self._get_balance(asset)[0])
+
+    def reserve(self, asset, owner, amount):
+        ''' Reserve an amount of an asset for an owner (replacing its last reservation), False if not available. '''
+        with self.reserve_lock:
+            if self._available(asset, owner) < amount:
+                return (False)
+            self.reservations.setdefault(asset, {}).update({owner: [amount, False]})
+            return (True)
+
+    def placed(self, asset, owner):
+        ''' The order of an owner was accepted, its reservation is dropped by the next account update. '''
+        with self.reserve_lock:
+            reservation = self.reservations.get(asset, {}).get(owner)
+            if reservation != None:
+                reservation[1] = True
+
+    def release(self, asset, owner):
+        ''' Release any reservation an owner holds on an asset. '''
+        with self.reserve_lock:
+            self.reservations.get(asset, {}).pop(owner, None)
+
+    def _available(self, asset, owner):
+        ## Called with the reserve lock held.
+        reserved = self.reservations.get(asset, {})
+        return (self._get_balance(asset)[0] - sum([reservation[0] for key, reservation in reserved.items() if
+                                                   key != owner]))
+
+    def _get_balance(self, asset):
+        if not asset in self.balances:
+            self.balances[asset] = [0.0, 0.0]
+        return (self.balances[asset])
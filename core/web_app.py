@@ -0,0 +1,349 @@
+#! /usr/bin/env python3
+'''
+Web UI (dashboard and REST api) for a running bot core.
+
+Only imported when the web UI is used so headless runs never load or start the web stack, start() attaches it to
+an already started core object.
+
+Server modes (WEB_SERVER setting):
+    'development' = The flask/werkzeug development server (as before).
+    'production'  = An async worker (eventlet, else gevent), each dashboard client is sent updates from its own
+                    bounded queue and clients that fall too far behind are dropped.
+'''
+import os
+import time
+import json
+import logging
+from collections import deque
+from flask_socketio import SocketIO
+from flask import Flask, render_template, url_for, request
+
+MULTI_DEPTH_INDICATORS = ['ema', 'sma', 'rma', 'order', 'patterns_data_points', 'patterns_data_lines']
+
+## Async workers tried in order for the production server.
+PRODUCTION_ASYNC_MODES = ['eventlet', 'gevent']
+
+## Interval between dashboard updates.
+WEB_UPDATE_INTERVAL = 0.8
+
+## Updates queued per client, the oldest are dropped first (each update holds the full dashboard state).
+CLIENT_QUEUE_SIZE = 5
+
+## Messages a client can have waiting on its connection before no more are sent to it.
+CLIENT_BACKLOG_LIMIT = 10
+
+## Time a client can stay over the backlog limit before it is disconnected.
+SLOW_CLIENT_TIMEOUT = 10
+
+# Initilize globals.
+
+## Setup flask app/socket (the socket is attached to the app once the server mode is known).
+APP = Flask(__name__)
+SOCKET_IO = SocketIO()
+async_mode = None
+
+## Initilize base core object.
+core_object = None
+
+started_updater = False
+dashboard_clients = {}
+
+## Initilize IP/port pair globals.
+host_ip = ''
+host_port = ''
+
+@APP.context_processor
+def override_url_for():
+    return (dict(url_for=dated_url_for))
+
+
+def dated_url_for(endpoint, **values):
+    # Override to prevent cached assets being used.
+    if endpoint == 'static':
+        filename = values.get('filename', None)
+        if filename:
+            file_path = os.path.join(APP.root_path,
+                                     endpoint,
+                                     filename)
+            values['q'] = int(os.stat(file_path).st_mtime)
+    return url_for(endpoint, **values)
+
+
+@APP.route('/', methods=['GET'])
+def control_panel():
+    # Base control panel configuration.
+    global started_updater
+
+    ## Web updater used for live updating.
+    if not (started_updater):
+        started_updater = True
+        SOCKET_IO.start_background_task(web_updater)
+
+    ## Set socket ip/port.
+    start_up_data = {
+        'host': {'IP': host_ip, 'Port': host_port},
+        'market_symbols': core_object.trading_markets
+    }
+
+    return (render_template('main_page.html', data=start_up_data))
+
+
+@APP.route('/rest-api/v1/trader_update', methods=['POST'])
+def update_trader():
+    # Base API for managing trader interaction.
+    data = request.get_json()
+
+    ## Check if specified bot exists.
+    current_trader = api_error_check(data)
+
+    if current_trader == None:
+        ## No trader therefore return false.
+        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
+    elif data['action'] == 'start':
+        ## Updating trader status to running.
+        if current_trader.state_data['runtime_state'] == 'FORCE_PAUSE':
+            current_trader.state_data['runtime_state'] = 'RUN'
+    elif data['action'] == 'pause':
+        ## Updating trader status to paused.
+        if current_trader.state_data['runtime_state'] == 'RUN':
+            current_trader.state_data['runtime_state'] = 'FORCE_PAUSE'
+    else:
+        ## If action was not found return false
+        return (json.dumps({'call': False, 'message': 'INVALID_ACTION'}))
+
+    return (json.dumps({'call': True}))
+
+
+@APP.route('/rest-api/v1/get_trader_charting', methods=['GET'])
+def get_trader_charting():
+    # Endpoint to pass trader indicator data.
+    market = request.args.get('market')
+    limit = int(request.args.get('limit'))
+    data = {'market': market}
+
+    ## Check if specified bot exists.
+    current_trader = api_error_check(data)
+
+    if current_trader == None:
+        ## No trader therefore return false.
+        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
+
+    candle_data = core_object.get_trader_candles(current_trader.print_pair)[:limit]
+    indicator_data = run_blocking(core_object.get_trader_indicators, current_trader.print_pair)
+    short_indicator_data = shorten_indicators(indicator_data, candle_data[-1][0])
+
+    return (json.dumps(
+        {'call': True, 'data': {'market': market, 'indicators': short_indicator_data, 'candles': candle_data}}))
+
+
+@APP.route('/rest-api/v1/get_trader_indicators', methods=['GET'])
+def get_trader_indicators():
+    # Endpoint to pass trader indicator data.
+    market = request.args.get('market')
+    limit = int(request.args.get('limit'))
+    data = {'market': market}
+
+    ## Check if specified bot exists.
+    current_trader = api_error_check(data)
+
+    if current_trader == None:
+        ## No trader therefore return false.
+        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
+
+    indicator_data = run_blocking(core_object.get_trader_indicators, current_trader.print_pair)
+
+    return (json.dumps({'call': True, 'data': {'market': market, 'indicators': indicator_data}}))
+
+
+@APP.route('/rest-api/v1/get_trader_candles', methods=['GET'])
+def get_trader_candles():
+    # Endpoint to pass trader candles.
+    market = request.args.get('market')
+    limit = int(request.args.get('limit'))
+    data = {'market': market}
+
+    ## Check if specified bot exists.
+    current_trader = api_error_check(data)
+
+    if current_trader == None:
+        ## No trader therefore return false.
+        return (json.dumps({'call': False, 'message': 'INVALID_TRADER'}))
+
+    candle_data = core_object.get_trader_candles(current_trader.print_pair)[:limit]
+
+    return (json.dumps({'call': True, 'data': {'market': market, 'candles': candle_data}}))
+
+
+@APP.route('/rest-api/v1/test', methods=['GET'])
+def test_rest_call():
+    # API endpoint test
+    return (json.dumps({'call': True, 'message': 'HELLO WORLD!'}))
+
+
+def shorten_indicators(indicators, end_time):
+    base_indicators = {}
+
+    for ind in indicators:
+        if ind in MULTI_DEPTH_INDICATORS:
+            base_indicators.update({ind: {}})
+            for sub_ind in indicators[ind]:
+                base_indicators[ind].update({sub_ind: [[val[0] if ind != 'order' else val[0] * 1000, val[1]] for val in
+                                                       indicators[ind][sub_ind] if
+                                                       (val[0] if ind != 'order' else val[0] * 1000) > end_time]})
+        else:
+            base_indicators.update({ind: [[val[0], val[1]] for val in indicators[ind] if val[0] > end_time]})
+
+    return (base_indicators)
+
+
+def api_error_check(data):
+    ## Check if specified bot exists.
+    current_trader = None
+    for trader in core_object.trader_objects:
+        if trader.print_pair == data['market']:
+            current_trader = trader
+            break
+    return (current_trader)
+
+
+def run_blocking(function, *args):
+    ''' Run a CPU heavy call in a real thread under an async worker so other clients are not held up. '''
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return (tpool.execute(function, *args))
+    elif async_mode == 'gevent':
+        import gevent
+        return (gevent.get_hub().threadpool.apply(function, args))
+    return (function(*args))
+
+
+class DashboardClient(object):
+    '''
+    A connected dashboard, updates are sent from its own bounded queue by its own background task.
+    -> If the queue is full the oldest update is dropped (each update is the full state so only the latest matters).
+    -> Nothing more is sent while the connection has CLIENT_BACKLOG_LIMIT messages waiting, a client that stays
+       over the limit for SLOW_CLIENT_TIMEOUT is disconnected.
+    '''
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.send_queue = deque(maxlen=CLIENT_QUEUE_SIZE)
+        self.connected = True
+
+    def send(self, event, data):
+        self.send_queue.append((event, data))
+
+    def backlog(self):
+        ## Messages waiting on the engineio connection (0 if the server does not expose it).
+        eio_socket = getattr(SOCKET_IO.server, 'eio', None) and SOCKET_IO.server.eio.sockets.get(self.sid)
+        if eio_socket == None or not hasattr(eio_socket, 'queue'):
+            return (0)
+        return (eio_socket.queue.qsize())
+
+    def sender(self):
+        slow_since = None
+
+        while self.connected:
+            if self.backlog() >= CLIENT_BACKLOG_LIMIT:
+                slow_since = slow_since or time.time()
+                if time.time() - slow_since > SLOW_CLIENT_TIMEOUT:
+                    logging.warning('[WebApp] Dashboard client %s is not keeping up, dropping it.', self.sid)
+                    SOCKET_IO.server.disconnect(self.sid)
+                    break
+
+            elif self.send_queue:
+                slow_since = None
+                event, data = self.send_queue.popleft()
+                SOCKET_IO.emit(event, data, room=self.sid)
+                continue
+
+            SOCKET_IO.sleep(0.05)
+
+
+@SOCKET_IO.on('connect')
+def on_connect():
+    client = DashboardClient(request.sid)
+    dashboard_clients[request.sid] = client
+    SOCKET_IO.start_background_task(client.sender)
+
+
+@SOCKET_IO.on('disconnect')
+def on_disconnect():
+    client = dashboard_clients.pop(request.sid, None)
+    if client:
+        client.connected = False
+
+
+def web_updater():
+    # Web updater use to update live via socket.
+    trader_versions = {}
+    trader_bulk_data = {}
+
+    while True:
+        ## The dashboard data is only built while there are clients to send it to.
+        if core_object.coreState == 'RUN' and dashboard_clients:
+            ## Only the traders whose state has changed are rebuilt (the rest are sent as last built).
+            traderData = core_object.get_changed_trader_data(trader_versions)
+
+            if traderData:
+                ## Update any new changes via socket.
+                for trader in traderData:
+                    bulk_data = {}
+                    bulk_data.update({'market': trader['market']})
+                    bulk_data.update({'trade_recorder': trader['trade_recorder']})
+                    bulk_data.update({'wallet_pair': trader['wallet_pair']})
+
+                    bulk_data.update(trader['custom_conditions'])
+                    bulk_data.update(trader['market_activity'])
+                    bulk_data.update(trader['market_prices'])
+                    bulk_data.update(trader['state_data'])
+                    trader_bulk_data[trader['market']] = bulk_data
+
+                total_bulk_data = list(trader_bulk_data.values())
+                for client in list(dashboard_clients.values()):
+                    client.send('current_traders_data', {'data': total_bulk_data})
+
+        SOCKET_IO.sleep(WEB_UPDATE_INTERVAL)
+
+
+def start(core, settings):
+    ''' Attach the web UI to a started core object and serve it (blocks). '''
+    global core_object, host_ip, host_port, async_mode
+    core_object = core
+
+    log = logging.getLogger('werkzeug')
+    log.setLevel(logging.ERROR)
+
+    host_ip = settings['host_ip']
+    host_port = settings['host_port']
+
+    if settings['web_server'] == 'production':
+        async_mode = _find_async_mode()
+        SOCKET_IO.init_app(APP, async_mode=async_mode)
+        logging.info('[WebApp] Serving the web UI with %s on %s:%s.', async_mode, host_ip, host_port)
+
+        SOCKET_IO.run(APP,
+                      host=settings['host_ip'],
+                      port=settings['host_port'],
+                      log_output=False)
+    else:
+        SOCKET_IO.init_app(APP)
+        async_mode = SOCKET_IO.server.async_mode
+
+        SOCKET_IO.run(APP,
+                      host=settings['host_ip'],
+                      port=settings['host_port'],
+                      debug=True,
+                      use_reloader=False)
+
+
+def _find_async_mode():
+    for mode in PRODUCTION_ASYNC_MODES:
+        try:
+            __import__(mode)
+            return (mode)
+        except ImportError:
+            pass
+
+    logging.warning('[WebApp] Neither eventlet or gevent is installed, using threads for the production server.')
+    return ('threading')
@@ -1,62 +1,257 @@
-import numpy as np
-
-'''
-x : Price list
-y : Last comparible value.
-z : Historic comparible value.
-
-# find_high_high
-( x : price list, y : last high, z : historic high value )
-Return highest value seen vs both recent and historically or None.
-
-# find_high
-( x : price list, y : last high )
-Return the highest value seen or None.
-
-# find_low_high
-( x : price list, y : last high, z : historic high value )
-Return highest value seen recently but lower historically or None.
-
-# find_low_low
-( x : price list, y : last low, z : historic low value )
-Return the lowest value seen vs both recent and historically or None.
-
-# find_low
-( x : price list, y : last low )
-Return the lowest value seen or None.
-
-# find_high_low
-( x : price list, y : last low, z : historic low value )
-Return lowest value seen recently but higher historically or None.
-'''
-## High setups
-find_high_high = lambda x, y, z: x.max() if z < x.max() > y else None
-find_high = lambda x, y: x.max() if x.max() > y else None
-find_low_high = lambda x, y, z: x.max() if z > x.max() > y else None
-## Low setup
-find_low_low = lambda x, y, z: x.min() if z > x.min() < y else None
-find_low = lambda x, y: x.min() if x.min() < y else None
-find_high_low = lambda x, y, z: x.min() if z < x.min() < y else None
-
-"""
-Trading patterns.
-
-"""
-
-
-class pattern_W:
-    def __init__(self):
-        self.required_points = 4
-        self.result_points = 1  # Only required for testing to view outcome.
-        self.segment_span = 4
-        self.price_point = 0
-
-    def check_condition(self, point_set):
-        if point_set[3] > point_set[1] > point_set[2] > point_set[0]:
-            print('part 1')
-            if point_set[1] > point_set[2] + ((point_set[3] - point_set[2]) / 2) and (
-                    100 - ((point_set[0] / point_set[2]) * 100)) < 1.2:
-                print('part 2')
-                return (True)
-
-        return (False)
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from core import kernels
+
+'''
+x : Price list
+y : Last comparible value.
+z : Historic comparible value.
+
+# find_high_high
+( x : price list, y : last high, z : historic high value )
+Return highest value seen vs both recent and historically or None.
+
+# find_high
+( x : price list, y : last high )
+Return the highest value seen or None.
+
+# find_low_high
+( x : price list, y : last high, z : historic high value )
+Return highest value seen recently but lower historically or None.
+
+# find_low_low
+( x : price list, y : last low, z : historic low value )
+Return the lowest value seen vs both recent and historically or None.
+
+# find_low
+( x : price list, y : last low )
+Return the lowest value seen or None.
+
+# find_high_low
+( x : price list, y : last low, z : historic low value )
+Return lowest value seen recently but higher historically or None.
+'''
+## High setups
+def find_high_high(x, y, z):
+    x_max = x.max()
+    return (x_max if z < x_max > y else None)
+
+def find_high(x, y):
+    x_max = x.max()
+    return (x_max if x_max > y else None)
+
+def find_low_high(x, y, z):
+    x_max = x.max()
+    return (x_max if z > x_max > y else None)
+
+## Low setup
+def find_low_low(x, y, z):
+    x_min = x.min()
+    return (x_min if z > x_min < y else None)
+
+def find_low(x, y):
+    x_min = x.min()
+    return (x_min if x_min < y else None)
+
+def find_high_low(x, y, z):
+    x_min = x.min()
+    return (x_min if z < x_min < y else None)
+
+
+"""
+Swing points.
+
+"""
+SWING_HIGH = 1
+SWING_LOW = -1
+
+
+def find_swing_points(highs, lows, window):
+    '''
+    Find swing highs/lows over whole price arrays (oldest first) in one pass.
+    A swing high is the highest high of the window candles either side of it (lows likewise).
+    Returns the indexes of the swing highs and swing lows.
+    '''
+    ## The JIT compiled kernel gives the same points in a single early exit pass.
+    if kernels.JIT_ENABLED:
+        return (kernels.swing_points(highs, lows, window))
+
+    span = (window * 2) + 1
+    if len(highs) < span:
+        return (np.empty(0, dtype=int), np.empty(0, dtype=int))
+
+    high_indexes = np.flatnonzero(sliding_window_view(highs, span).argmax(axis=1) == window) + window
+    low_indexes = np.flatnonzero(sliding_window_view(lows, span).argmin(axis=1) == window) + window
+    return (high_indexes, low_indexes)
+
+
+"""
+Trading patterns.
+
+Each pattern is checked against sets of consecutive alternating swing points,
+check_conditions takes an array of point sets (n, required_points) and returns a bool array.
+
+"""
+
+
+class pattern_W:
+    def __init__(self):
+        self.name = 'W'
+        self.required_points = 4
+        self.result_points = 1  # Only required for testing to view outcome.
+        self.segment_span = 4
+        self.price_point = 0
+        self.start_type = SWING_LOW
+
+    def check_condition(self, point_set):
+        if point_set[3] > point_set[1] > point_set[2] > point_set[0]:
+            if point_set[1] > point_set[2] + ((point_set[3] - point_set[2]) / 2) and (
+                    100 - ((point_set[0] / point_set[2]) * 100)) < 1.2:
+                return (True)
+
+        return (False)
+
+    def check_conditions(self, point_sets):
+        p0, p1, p2, p3 = point_sets[:, 0], point_sets[:, 1], point_sets[:, 2], point_sets[:, 3]
+        return ((p3 > p1) & (p1 > p2) & (p2 > p0) &
+                (p1 > p2 + ((p3 - p2) / 2)) &
+                ((100 - ((p0 / p2) * 100)) < 1.2))
+
+
+class pattern_M:
+    def __init__(self):
+        self.name = 'M'
+        self.required_points = 4
+        self.start_type = SWING_HIGH
+
+    def check_condition(self, point_set):
+        return (bool(self.check_conditions(np.array([point_set], dtype=float))[0]))
+
+    def check_conditions(self, point_sets):
+        p0, p1, p2, p3 = point_sets[:, 0], point_sets[:, 1], point_sets[:, 2], point_sets[:, 3]
+        return ((p3 < p1) & (p1 < p2) & (p2 < p0) &
+                (p1 < p2 - ((p2 - p3) / 2)) &
+                (((p0 / p2) * 100) - 100 < 1.2))
+
+
+def scan_pattern(pattern, prices, types):
+    ''' Check every candidate point set of an alternating swing sequence at once, returns the start indexes. '''
+    if len(prices) < pattern.required_points:
+        return (np.empty(0, dtype=int))
+
+    point_sets = sliding_window_view(prices, pattern.required_points)
+    matches = (types[:len(point_sets)] == pattern.start_type) & pattern.check_conditions(point_sets)
+    return (np.flatnonzero(matches))
+
+
+class PatternScanner(object):
+    '''
+    Incremental pattern scanning over a market's candles.
+    -> Only closed candles are scanned and only the candles after the last confirmed swing window are re-checked.
+    -> Swing points are kept as an alternating high/low sequence which the patterns are checked against.
+    -> Results are given as the indicator series 'patterns_data_points' and 'patterns_data_lines'.
+    '''
+
+    def __init__(self, window=5, pattern_types=None):
+        self.window = window
+        self.patterns = pattern_types if pattern_types else [pattern_W(), pattern_M()]
+
+        self.swings = []
+        self.last_times = None
+        self.last_scanned_time = None
+        self.result = {'patterns_data_points': {'swing_high': [], 'swing_low': []}, 'patterns_data_lines': {}}
+
+    def update(self, candles):
+        ''' Update with the current candles (newest first as given to the traders). '''
+        if len(candles) < 2:
+            return (self.result)
+
+        data = np.array(candles[:0:-1], dtype=float)
+        times, highs, lows = data[:, 0], data[:, 2], data[:, 3]
+        self.last_times = times
+
+        ## Only rescan from the last confirmed centre (minus the window needed to confirm the next ones).
+        start = 0
+        if self.last_scanned_time != None:
+            start = max(int(np.searchsorted(times, self.last_scanned_time, side='right')) - self.window, 0)
+
+        if len(times) - start < (self.window * 2) + 1:
+            return (self.result)
+        high_indexes, low_indexes = find_swing_points(highs[start:], lows[start:], self.window)
+
+        new_swings = [(index + start, SWING_HIGH) for index in high_indexes] + [(index + start, SWING_LOW) for index in
+                                                                                low_indexes]
+        new_swings.sort()
+        self.last_scanned_time = times[len(times) - 1 - self.window]
+
+        changed = self._drop_old_swings(times[0])
+        for index, swing_type in new_swings:
+            if self.last_swing_time() != None and times[index] <= self.last_swing_time():
+                continue
+            price = highs[index] if swing_type == SWING_HIGH else lows[index]
+            changed = self._add_swing(times[index], price, swing_type) or changed
+
+        if changed:
+            self._build_result()
+        return (self.result)
+
+    def rewind(self, since):
+        ''' Forget anything that depends on candles from since (open time) so it is rescanned on the next update. '''
+        if self.last_times is None:
+            return
+
+        ## Swings up to window candles before the changed candles are confirmed using them.
+        cut_index = max(int(np.searchsorted(self.last_times, since)) - self.window, 0)
+        if cut_index == 0:
+            self.swings = []
+            self.last_scanned_time = None
+        else:
+            cut_time = self.last_times[cut_index]
+            self.swings = [swing for swing in self.swings if swing[0] < cut_time]
+            if self.last_scanned_time != None:
+                self.last_scanned_time = min(self.last_scanned_time, self.last_times[cut_index - 1])
+
+        self._build_result()
+
+    def last_swing_time(self):
+        return (self.swings[-1][0] if self.swings else None)
+
+    def _add_swing(self, time, price, swing_type):
+        ## Keep the sequence alternating, a repeat of the same type only replaces the last if more extreme.
+        if self.swings and self.swings[-1][2] == swing_type:
+            last_price = self.swings[-1][1]
+            if (swing_type == SWING_HIGH and price <= last_price) or (swing_type == SWING_LOW and price >= last_price):
+                return (False)
+            self.swings[-1] = (time, price, swing_type)
+            return (True)
+
+        self.swings.append((time, price, swing_type))
+        return (True)
+
+    def _drop_old_swings(self, oldest_time):
+        drop = 0
+        while drop < len(self.swings) and self.swings[drop][0] < oldest_time:
+            drop += 1
+        if drop:
+            del self.swings[:drop]
+        return (drop > 0)
+
+    def _build_result(self):
+        swing_times = np.array([swing[0] for swing in self.swings])
+        swing_prices = np.array([swing[1] for swing in self.swings], dtype=float)
+        swing_types = np.array([swing[2] for swing in self.swings])
+
+        points = {'swing_high': [], 'swing_low': []}
+        for time, price, swing_type in reversed(self.swings):
+            points['swing_high' if swing_type == SWING_HIGH else 'swing_low'].append([int(time), float(price)])
+
+        lines = {}
+        for pattern in self.patterns:
+            for count, start in enumerate(scan_pattern(pattern, swing_prices, swing_types)[::-1]):
+                end = start + pattern.required_points
+                lines['{0} {1}'.format(pattern.name, count + 1)] = [[int(time), float(price)] for time, price in
+                                                                    zip(swing_times[start:end][::-1],
+                                                                        swing_prices[start:end][::-1])]
+
+        self.result = {'patterns_data_points': points, 'patterns_data_lines': lines}
@@ -1,7 +1,9 @@
 #! /usr/bin/env python3
 import os
+import sys
 import logging
 from core import botCore
+from core import log_pipeline
 
 ## Setup    
 cwd = os.getcwd()
@@ -29,19 +31,57 @@ MARKET_TYPE=SPOT
 # Automatically update the BNB balance when low (for trading fees, only applicable to real trading)
 UPDATE_BNB_BALANCE=True
 
+# Asset used to pay the trading fees, the balance it is kept above and the quantity bought each top up (default if left blank is BNB, 0.01, 0.1).
+FEE_ASSET=
+FEE_BALANCE_THRESHOLD=
+FEE_TOP_UP_QUANTITY=
+
 # Interval used for the trader (1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d).
 TRADER_INTERVAL=15m
 
+# Extra timeframes built from the trader interval candles seperate with a , (must be multiples of the trader interval e.g. 1h,4h).
+TRADER_TIMEFRAMES=
+
 # The currency max the trader will use (in BTC) also note this scales up with the number of markets i.e. 2 pairs each market will have 0.0015 as their trading currency pair.
 TRADING_CURRENCY=0.002
 
+# Max total currency (in BTC) held across all markets and the max number of open positions at once (no limit if left blank).
+MAX_EXPOSURE=
+MAX_OPEN_POSITIONS=
+
 # The markets that will be traded (currently only BTC markets) seperate markets with a , for multi market trading.
 TRADING_MARKETS=BTC-ETH,BTC-LTC
 
+# Strategy used for the markets (default is trader_configuration.py, other names are loaded from the strategies dir).
+STRATEGY=default
+
+# Strategy to use for specific markets as market:strategy seperated with a , (e.g. BTC-ETH:macd_cross,BTC-LTC:default).
+MARKET_STRATEGIES=
+
+# Directory the strategy files are loaded from (changed files are reloaded while running).
+STRATEGIES_DIR=
+
+# Unix socket of a shared market data hub (start it with 'python run.py hub'), if left blank market data is streamed directly.
+DATA_HUB=
+
+# Directory to record all inbound market data to for replays (not recorded if left blank).
+RECORD_DIR=
+
 # Configuration for the webapp (default if left blank is IP=127.0.0.1, Port=5000)
 HOST_IP=
 HOST_PORT=
 
+# Server used for the webapp, development or production (production needs eventlet or gevent installed, default if left blank is development).
+WEB_SERVER=
+
+# Run without the web UI (True/False) and the port for a minimal metrics endpoint at /metrics (not served if left blank).
+HEADLESS=False
+METRICS_PORT=
+
+# Stream every trade/best bid and ask per market batched for the strategies (True/False) and the batch interval in ms (default if left blank is 250).
+TICK_STREAMS=False
+TICK_BATCH_MS=
+
 # Configuration for the candle range and depth range (default if left bank is candles=500, Depth=50)
 MAX_CANDLES=
 MAX_DEPTH=
@@ -53,7 +93,13 @@ def settings_reader():
 
     ## Setup settings file object with initial default variables.
     settings_file_data = {'public_key': '', 'private_key': '', 'host_ip': '127.0.0.1', 'host_port': 5000,
-                          'max_candles': 500, 'max_depth': 50}
+                          'max_candles': 500, 'max_depth': 50, 'trader_timeframes': [],
+                          'strategy': 'default', 'market_strategies': {}, 'strategies_dir': 'strategies/',
+                          'update_bnb_balance': True, 'fee_asset': 'BNB', 'fee_balance_threshold': 0.01,
+                          'fee_top_up_quantity': 0.1, 'max_exposure': None, 'max_open_positions': None,
+                          'data_hub': None, 'record_dir': None, 'replay_dir': None, 'replay_speed': 1.0,
+                          'web_server': 'development', 'headless': False, 'metrics_port': None,
+                          'tick_streams': False, 'tick_batch_ms': None}
 
     ## Read the settings file and extract the fields.
     with open(SETTINGS_FILE_NAME, 'r') as f:
@@ -78,16 +124,66 @@ def settings_reader():
             elif key == 'MARKET_TYPE':
                 data = data.upper()
 
+            elif key == 'UPDATE_BNB_BALANCE':
+                data = True if data.upper() == 'TRUE' else False
+
+            elif key == 'FEE_ASSET':
+                data = data.upper()
+
+            elif key == 'FEE_BALANCE_THRESHOLD':
+                data = float(data)
+
+            elif key == 'FEE_TOP_UP_QUANTITY':
+                data = float(data)
+
             elif key == 'TRADING_MARKETS':
                 data = data.replace(' ', '')
                 data = data.split(',') if ',' in data else [data]
 
+            elif key == 'TRADER_TIMEFRAMES':
+                data = data.replace(' ', '')
+                data = data.split(',') if ',' in data else [data]
+
+            elif key == 'MARKET_STRATEGIES':
+                ## Malformed entries are reported and skipped (those markets use the default STRATEGY).
+                market_strategies = {}
+                for market_strategy in data.replace(' ', '').split(','):
+                    market_split = market_strategy.split(':')
+                    if len(market_split) != 2 or not (market_split[0] and market_split[1]):
+                        if market_strategy:
+                            logger.error('Ignoring malformed MARKET_STRATEGIES entry "%s" (expected market:strategy).',
+                                         market_strategy)
+                        continue
+                    market_strategies.update({market_split[0]: market_split[1]})
+                data = market_strategies
+
+            elif key == 'MAX_EXPOSURE':
+                data = float(data)
+
+            elif key == 'MAX_OPEN_POSITIONS':
+                data = int(data)
+
             elif key == 'HOST_IP':
                 default_ip = '127.0.0.1'
 
             elif key == 'HOST_PORT':
                 data = int(data)
 
+            elif key == 'WEB_SERVER':
+                data = data.lower()
+
+            elif key == 'HEADLESS':
+                data = True if data.upper() == 'TRUE' else False
+
+            elif key == 'METRICS_PORT':
+                data = int(data)
+
+            elif key == 'TICK_STREAMS':
+                data = True if data.upper() == 'TRUE' else False
+
+            elif key == 'TICK_BATCH_MS':
+                data = int(data)
+
             elif key == 'MAX_CANDLES':
                 data = int(data)
 
@@ -107,10 +203,26 @@ if __name__ == '__main__':
     if not (os.path.exists(CACHE_DIR)):
         os.makedirs(CACHE_DIR, exist_ok=True)
 
+    ## Log records are written by a background thread (console and a JSON log per market).
+    log_pipeline.setup(LOGS_DIR)
+
     ## Load settings/create settings file.
     if os.path.exists(SETTINGS_FILE_NAME):
         settings = settings_reader()
-        botCore.start(settings, LOGS_DIR, CACHE_DIR)
+
+        if len(sys.argv) > 1 and sys.argv[1] == 'hub':
+            ## Run only the shared market data hub for other instances to connect to.
+            from core import data_hub
+            settings['data_hub'] = settings['data_hub'] or CACHE_DIR + 'data_hub.sock'
+            data_hub.start(settings)
+        elif len(sys.argv) > 2 and sys.argv[1] == 'replay':
+            ## Replay recorded market data (python run.py replay <record dir> [speed, 0 is max speed]) in test mode.
+            settings['replay_dir'] = sys.argv[2]
+            settings['replay_speed'] = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+            settings['run_type'] = 'TEST'
+            botCore.start(settings, LOGS_DIR, CACHE_DIR)
+        else:
+            botCore.start(settings, LOGS_DIR, CACHE_DIR)
     else:
         with open(SETTINGS_FILE_NAME, 'w') as f:
             f.write(DEFAULT_SETTINGS_DATA)
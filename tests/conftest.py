@@ -0,0 +1,5 @@
+import os
+import sys
+
+## The tests import the bot modules from the repository root (core/, patterns.py).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
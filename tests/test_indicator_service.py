@@ -0,0 +1,41 @@
+'''
+The series served by the indicator service (array kernels for sma/rma/rsi, indicator_state for ema/macd) against
+the technical_indicators module they replaced, compared once past the warmup where the seeding no longer shows.
+'''
+import numpy as np
+import pytest
+
+TI = pytest.importorskip('technical_indicators')
+
+from core import indicator_service
+from test_kernels import make_candles
+
+CANDLE_COUNT = 1000
+
+INDICATORS = [('sma', (20,)), ('ema', (20,)), ('ema', (200,)), ('rma', (14,)), ('rsi', (14,)), ('macd', ())]
+
+
+def compared_length(name, params):
+    return (CANDLE_COUNT - indicator_service.INDICATOR_WARMUP[name](params))
+
+
+@pytest.mark.parametrize('name, params', INDICATORS)
+def test_series_match_technical_indicators(name, params):
+    candles = make_candles(CANDLE_COUNT)
+    time_values = [candle[0] for candle in candles]
+    close_prices = [candle[4] for candle in candles]
+
+    result = indicator_service.IndicatorService().get('TEST', '1m', candles, name, params)
+    expected = getattr(TI, 'get_{0}'.format(name.upper()))(close_prices, *params, time_values=time_values,
+                                                           map_time=True)
+    length = compared_length(name, params)
+
+    assert len(result) >= length and len(expected) >= length
+    assert [row[0] for row in result[:length]] == [row[0] for row in expected[:length]]
+    if name == 'macd':
+        for sub_name in ['macd', 'signal', 'hist']:
+            np.testing.assert_allclose([row[1][sub_name] for row in result[:length]],
+                                       [row[1][sub_name] for row in expected[:length]], rtol=1e-4, atol=1e-6)
+    else:
+        np.testing.assert_allclose([row[1] for row in result[:length]], [row[1] for row in expected[:length]],
+                                   rtol=1e-4)
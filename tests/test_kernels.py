@@ -0,0 +1,155 @@
+'''
+The array kernels against the per-candle paths (indicator_state folding one candle at a time and the patterns
+swing scan), for the plain loop, the numpy and (if installed) the numba compiled kernels.
+'''
+import numpy as np
+import pytest
+
+import patterns
+from core import kernels
+from core import indicator_state
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+IMPLEMENTATIONS = ['loop', 'numpy'] + (['numba'] if numba != None else [])
+
+CANDLE_COUNT = 400
+PERIOD_MS = 60000
+
+
+@pytest.fixture(params=IMPLEMENTATIONS)
+def implementation(request, monkeypatch):
+    if request.param == 'loop':
+        recursive_average, swing_points = kernels._recursive_average_loop, kernels._swing_points_loop
+    elif request.param == 'numpy':
+        recursive_average, swing_points = kernels._recursive_average_numpy, kernels._swing_points_numpy
+    else:
+        recursive_average = numba.njit(kernels._recursive_average_loop)
+        swing_points = numba.njit(kernels._swing_points_loop)
+
+    monkeypatch.setattr(kernels, '_recursive_average', recursive_average)
+    monkeypatch.setattr(kernels, '_swing_points', swing_points)
+    return (request.param)
+
+
+def make_candles(count=CANDLE_COUNT, seed=7):
+    ''' Random walk candles newest first (prices rounded so there are equal highs/lows). '''
+    random = np.random.default_rng(seed)
+    closes = np.round(100 + np.cumsum(random.normal(0, 1, count)), 1)
+    candles = []
+    for index, close in enumerate(closes):
+        high = round(close + abs(random.normal(0, 0.5)), 1)
+        low = round(close - abs(random.normal(0, 0.5)), 1)
+        candles.append([index * PERIOD_MS, close, high, low, close, 1.0])
+    return (candles[::-1])
+
+
+def fold_per_candle(state, candles):
+    ''' Feed candles to an incremental indicator one new candle per update (never the bulk fold). '''
+    result = []
+    for count in range(2, len(candles) + 1):
+        result = state.update(candles[len(candles) - count:])
+    return (result)
+
+
+def kernel_series(candles, values):
+    ''' Kernel output (oldest first) as [[time, value], ...] newest first without the warm up NaNs. '''
+    times = [candle[0] for candle in candles[::-1]]
+    return ([[time, value] for time, value in zip(times, values) if not np.isnan(value)][::-1])
+
+
+def closes_of(candles):
+    return ([candle[4] for candle in candles[::-1]])
+
+
+def reference_rsi(closes, period):
+    ''' Wilder's RSI one value at a time. '''
+    values = [np.nan] * len(closes)
+    changes = np.diff(closes)
+    gain = np.mean(np.maximum(changes[:period], 0))
+    loss = np.mean(np.maximum(-changes[:period], 0))
+    for index in range(period, len(closes)):
+        if index > period:
+            change = changes[index - 1]
+            gain = ((gain * (period - 1)) + max(change, 0)) / period
+            loss = ((loss * (period - 1)) + max(-change, 0)) / period
+        values[index] = 100.0 if loss == 0 else 100 - (100 / (1 + (gain / loss)))
+    return (values)
+
+
+def test_ema_matches_per_candle_state(implementation):
+    candles = make_candles()
+    expected = fold_per_candle(indicator_state.EMAState(20), candles)
+    result = kernel_series(candles, kernels.ema(closes_of(candles), 20))
+
+    assert [row[0] for row in result] == [row[0] for row in expected]
+    np.testing.assert_allclose([row[1] for row in result], [row[1] for row in expected], rtol=1e-9)
+
+
+def test_macd_matches_per_candle_state(implementation):
+    candles = make_candles()
+    expected = fold_per_candle(indicator_state.MACDState(12, 26, 9), candles)
+    macd, signal, hist = kernels.macd(closes_of(candles), 12, 26, 9)
+
+    ## The state only gives values once the signal line has one (the macd line starts earlier).
+    for name, values in [('macd', macd), ('signal', signal), ('hist', hist)]:
+        result = kernel_series(candles, np.where(np.isnan(signal), np.nan, values))
+        assert [row[0] for row in result] == [row[0] for row in expected]
+        np.testing.assert_allclose([row[1] for row in result], [row[1][name] for row in expected], rtol=1e-9,
+                                   atol=1e-12)
+
+
+def test_bulk_fold_matches_per_candle_state(implementation):
+    candles = make_candles()
+    for state_type, params in [(indicator_state.EMAState, (20,)), (indicator_state.MACDState, (12, 26, 9))]:
+        folded = state_type(*params).update(candles)
+        expected = fold_per_candle(state_type(*params), candles)
+
+        assert [row[0] for row in folded] == [row[0] for row in expected]
+        for row, expected_row in zip(folded, expected):
+            assert row[1] == pytest.approx(expected_row[1], rel=1e-9)
+
+
+def test_sma_matches_rolling_mean():
+    closes = closes_of(make_candles())
+    expected = [np.nan] * 19 + [np.mean(closes[index - 19:index + 1]) for index in range(19, len(closes))]
+    np.testing.assert_allclose(kernels.sma(closes, 20), expected, rtol=1e-9, equal_nan=True)
+
+
+def test_rsi_matches_reference(implementation):
+    closes = closes_of(make_candles())
+    np.testing.assert_allclose(kernels.rsi(closes, 14), reference_rsi(closes, 14), rtol=1e-9, equal_nan=True)
+
+
+def test_swing_points_match_patterns(implementation, monkeypatch):
+    candles = make_candles()
+    highs = np.array([candle[2] for candle in candles[::-1]])
+    lows = np.array([candle[3] for candle in candles[::-1]])
+
+    ## The patterns scan without the JIT kernel is the plain numpy sliding window.
+    monkeypatch.setattr(kernels, 'JIT_ENABLED', False)
+    expected_highs, expected_lows = patterns.find_swing_points(highs, lows, 5)
+    result_highs, result_lows = kernels.swing_points(highs, lows, 5)
+
+    assert len(expected_highs) and len(expected_lows)
+    np.testing.assert_array_equal(result_highs, expected_highs)
+    np.testing.assert_array_equal(result_lows, expected_lows)
+
+
+@pytest.mark.parametrize('jit_enabled', [False, True])
+def test_pattern_scanner_per_candle_matches_full_scan(implementation, monkeypatch, jit_enabled):
+    monkeypatch.setattr(kernels, 'JIT_ENABLED', jit_enabled)
+    candles = make_candles()
+
+    scanner = patterns.PatternScanner()
+    for count in range(2, len(candles) + 1):
+        scanner.update(candles[len(candles) - count:])
+
+    full_scanner = patterns.PatternScanner()
+    full_scanner.update(candles)
+
+    assert scanner.swings
+    assert scanner.swings == full_scanner.swings
@@ -0,0 +1,140 @@
+'''
+Replacing a resting order of a real SPOT trader against a stub rest api: amending with cancel-replace (success, a
+failed cancel and a failed new order) and cancelling the order when the replacement BUY gets no capital.
+'''
+import types
+
+import pytest
+
+pytest.importorskip('technical_indicators')
+
+from core import trader
+from core import wallet_service
+from core import capital_allocator
+
+RULES = {'STEP_VALUE': 0.001, 'TICK_VALUE': 0.01, 'MINIMUM_NOTATION': 10}
+
+ORDER_ID = 1001
+
+
+class StubRestAPI(object):
+    ''' Records the calls made and answers with the responses given. '''
+
+    def __init__(self, cancel_replace_result=None, cancel_result=None):
+        self.cancel_replace_result = cancel_replace_result
+        self.cancel_result = cancel_result if cancel_result != None else {'orderId': ORDER_ID, 'status': 'CANCELED'}
+        self.calls = []
+
+    def cancel_replace_order(self, trading_type, **params):
+        self.calls.append(('cancel_replace_order', params))
+        return (self.cancel_replace_result)
+
+    def cancel_order(self, trading_type, **params):
+        self.calls.append(('cancel_order', params))
+        return (self.cancel_result)
+
+    def place_order(self, trading_type, **params):
+        self.calls.append(('place_order', params))
+        return ({'orderId': ORDER_ID + 1, 'price': params['price'], 'type': params['type']})
+
+
+class StubSocketAPI(object):
+    def get_live_candles(self, symbol):
+        return ([])
+
+    def get_live_depths(self, symbol):
+        return ({})
+
+
+def make_trader(rest_api, **kwargs):
+    ''' A real SPOT trader with a LIMIT BUY resting at 100. '''
+    trader_ = trader.BaseTrader('USDT', 'ETH', rest_api, socket_api=StubSocketAPI(), **kwargs)
+    trader_.setup_initial_values('SPOT', 'REAL', RULES)
+    trader_.state_data['base_currency'] = 50.0
+
+    cp = trader_.market_activity
+    cp['order_side'] = 'BUY'
+    cp['order_type'] = 'LIMIT'
+    cp['order_status'] = 'PLACED'
+    cp['order_id'] = ORDER_ID
+    cp['price'] = 100.0
+    return (trader_, cp)
+
+
+def buy_order(price):
+    return ({'side': 'BUY', 'description': 'Long entry', 'order_type': 'LIMIT', 'price': price})
+
+
+def test_amend_success():
+    rest_api = StubRestAPI({'cancelResult': 'SUCCESS', 'newOrderResult': 'SUCCESS',
+                            'cancelResponse': {'orderId': ORDER_ID},
+                            'newOrderResponse': {'orderId': ORDER_ID + 1, 'price': '101', 'type': 'LIMIT'}})
+    trader_, cp = make_trader(rest_api)
+
+    result = trader_._amend_order('LONG', cp, buy_order('101'))
+
+    assert result == {'action': 'AMENDED_ORDER', 'data': {'orderId': ORDER_ID + 1, 'price': '101', 'type': 'LIMIT'}}
+    assert [call[0] for call in rest_api.calls] == ['cancel_replace_order']
+    assert rest_api.calls[0][1]['cancelOrderId'] == ORDER_ID
+    assert rest_api.calls[0][1]['quantity'] == '0.495'
+
+
+def test_amend_failed_cancel_keeps_the_order():
+    cancel_response = {'code': -2011, 'msg': 'Unknown order sent.'}
+    rest_api = StubRestAPI({'code': -2022, 'msg': 'Order cancel-replace failed.',
+                            'data': {'cancelResult': 'FAILURE', 'newOrderResult': 'NOT_ATTEMPTED',
+                                     'cancelResponse': cancel_response, 'newOrderResponse': None}})
+    trader_, cp = make_trader(rest_api)
+
+    result = trader_._amend_order('LONG', cp, buy_order('101'))
+
+    assert result['action'] == 'ORDER_ISSUE' and result['data']['code'] == -2022
+    assert cp['order_id'] == ORDER_ID and cp['order_status'] == 'PLACED'
+
+
+def test_amend_failed_new_order_resets_the_order():
+    new_order_response = {'code': -2010, 'msg': 'Account has insufficient balance for requested action.'}
+    rest_api = StubRestAPI({'code': -2021, 'msg': 'Order cancel-replace partially failed.',
+                            'data': {'cancelResult': 'SUCCESS', 'newOrderResult': 'FAILURE',
+                                     'cancelResponse': {'orderId': ORDER_ID},
+                                     'newOrderResponse': new_order_response}})
+    trader_, cp = make_trader(rest_api)
+
+    result = trader_._amend_order('LONG', cp, buy_order('101'))
+
+    assert result == {'action': 'ORDER_ISSUE', 'data': new_order_response}
+    assert cp['order_id'] == None and cp['order_status'] == None and cp['order_type'] == 'WAIT'
+
+
+@pytest.mark.parametrize('free_balance, expected_state', [(30.0, 'PAUSE_INSUFBALANCE'), (80.0, None)])
+def test_replacement_without_capital_cancels_the_order(free_balance, expected_state):
+    ## 30 free is DENIED, 80 free with 40 reserved by another market is PENDING.
+    wallet = wallet_service.WalletService()
+    wallet.on_account_position({'B': [{'a': 'USDT', 'f': str(free_balance), 'l': '0'}]})
+    wallet.reserve('USDT', 'USDT-BTC', 40.0)
+    allocator = capital_allocator.CapitalAllocator('USDT', wallet)
+
+    rest_api = StubRestAPI()
+    trader_, cp = make_trader(rest_api, wallet_service=wallet, capital_allocator=allocator)
+    strategy = types.SimpleNamespace(long_entry_conditions=lambda *args: buy_order(101.0))
+
+    trader_._trade_manager('LONG', cp, {}, [], strategy)
+
+    assert rest_api.calls == [('cancel_order', {'symbol': 'ETHUSDT', 'orderId': ORDER_ID})]
+    assert cp['order_id'] == None and cp['order_type'] == 'WAIT'
+    assert trader_.state_data['runtime_state'] == expected_state
+
+
+def test_replacement_without_capital_keeps_the_order_if_the_cancel_fails():
+    wallet = wallet_service.WalletService()
+    wallet.on_account_position({'B': [{'a': 'USDT', 'f': '30', 'l': '0'}]})
+    allocator = capital_allocator.CapitalAllocator('USDT', wallet)
+
+    rest_api = StubRestAPI(cancel_result={'code': -2011, 'msg': 'Unknown order sent.'})
+    trader_, cp = make_trader(rest_api, wallet_service=wallet, capital_allocator=allocator)
+    strategy = types.SimpleNamespace(long_entry_conditions=lambda *args: buy_order(101.0))
+
+    trader_._trade_manager('LONG', cp, {}, [], strategy)
+
+    assert cp['order_id'] == ORDER_ID and cp['order_status'] == 'PLACED'
+    assert trader_.state_data['runtime_state'] == 'CHECK_ORDERS'
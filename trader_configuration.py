@@ -5,9 +5,24 @@ import technical_indicators as TI
 ## Minimum price rounding.
 pRounding = 8
 
-def technical_indicators(candles):
+## Indicators used by the conditions (name:(indicator, *params)), computed over all candles.
+INDICATORS = {'macd':('macd',)}
+
+## Indicators only shown on the web UI chart (only computed while a chart is being viewed).
+CHART_INDICATORS = {'ema.ema200':('ema', 200)}
+
+def technical_indicators(candles, indicator_view=None):
     indicators = {}
 
+    ## Indicators requested via the view are computed once per update and shared with any other traders using them.
+    if indicator_view:
+        indicators.update({'macd':indicator_view.get('macd')})
+
+        indicators.update({'ema':{}})
+        indicators['ema'].update({'ema200':indicator_view.get('ema', 200)})
+
+        return(indicators)
+
     time_values     = [candle[0] for candle in candles]
     open_prices     = [candle[1] for candle in candles]
     high_prices     = [candle[2] for candle in candles]
@@ -64,10 +79,61 @@ def technical_indicators(candles):
         stopLimitPrice  = Used for OCO to to determine price placement for part 2 of the order.
         description     = A description for the order that can be used to identify multiple conditions.
         order_type      = The type of the order that is to be placed.
+        score           = (Optional BUY) Rank of the signal, when BUYs compete for capital the highest score is placed first.
 
 --- Candle Structure ---
     Candles are structured in a multidimensional list as follows:
         [[time, open, high, low, close, volume], ...]
+
+--- Strategies ---
+    This file is the 'default' strategy, other strategies can be written in the same way as <STRATEGIES_DIR>/<name>.py
+    and selected with STRATEGY/MARKET_STRATEGIES. Strategy files are reloaded when they are changed.
+    A strategy can declare the indicators it uses instead of writing technical_indicators, only these are computed:
+        INDICATORS = {'macd':('macd',), 'ema.ema200':('ema', 200)}
+        INDICATOR_LOOKBACK = 2      (optional, values used per indicator so only the candles needed are used,
+                                     exponential indicators e.g. MACD then start from a shorter history so their
+                                     values differ slightly from those over all candles)
+        CHART_INDICATORS = {...}    (optional, only computed when the web UI chart is viewed)
+
+--- Rules ---
+    Instead of (or as well as) the condition functions below, conditions can be declared as rules which are
+    compiled once for all markets (see core/rule_engine.py), declaring a rule set replaces its function:
+        from core.rule_engine import RuleSet, crosses_above, crosses_below, compare, stop_loss, any_of
+
+        LONG_ENTRY_RULES = RuleSet([crosses_above('macd.macd', 'macd.signal'), compare('close', '>', 'ema.ema200')],
+            {'side':'BUY', 'description':'Long entry signal', 'order_type':'MARKET'})
+        LONG_EXIT_RULES = RuleSet([any_of(crosses_below('macd.macd', 'macd.signal'), stop_loss(0.4))],
+            {'side':'SELL', 'description':'Long exit signal', 'order_type':'MARKET'})
+
+--- Patterns ---
+    Swing points and W/M patterns can be added through the indicator view (window = candles either side of a swing):
+        indicators.update(indicator_view.get('patterns', 5))
+    This adds 'patterns_data_points' ({'swing_high':[...], 'swing_low':[...]}) and 'patterns_data_lines' (one line per
+    pattern found) which are also shown on the web UI chart.
+
+--- Extra Timeframes ---
+    Candles for the timeframes set with TRADER_TIMEFRAMES are loaded once at startup and then built from the trader
+    interval candles.
+    technical_indicators can take 'timeframe_views' ({'1h':view, ...}, each view has .candles and .get())
+    and the condition functions can take 'timeframe_candles' ({'1h':candles, ...}) as keyword arguments.
+
+--- Tick Data ---
+    With TICK_STREAMS set the condition functions can take 'ticks' as a keyword argument, every tick since the last
+    call merged into one batch (None if there were none) with numpy arrays one row per tick oldest first (columns are
+    in core/tick_stream.py, ticks.sequence is the number of the newest batch included):
+        ticks.trades    = [[trade time, price, quantity, buyer is maker (1/0)], ...]
+        ticks.book      = [[update id, bid price, bid quantity, ask price, ask quantity], ...]
+    e.g. the volume bought at market since the last call: ticks.trades[ticks.trades[:, 3] == 0][:, 2].sum()
+
+--- Order Book ---
+    A local order book is kept for each market (updated every 100ms) and can be accessed with:
+        from core import order_book
+        book = order_book.get_book(symbol)
+    Which provides:
+        book.best_bid() / book.best_ask()   = Top of book prices.
+        book.vwap(side, quantity)           = Average fill price for a market order of quantity.
+        book.depth_within(percent)          = Quantity on each side within percent of the top of book.
+        book.imbalance(levels)              = Bid/ask volume imbalance of the top levels (-1 to 1).
 '''
 
 